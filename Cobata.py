@@ -174,6 +174,8 @@ def login_page():
             if st.button("Entrar", use_container_width=True):
                 if username in users_db and users_db[username]["password"] == password:
                     st.session_state.logged_in = True
+                    # Usado no token das rotas do endpoint chamadas pelos grids (acesso.py)
+                    st.session_state.username = username
                     st.session_state.user_permissions = users_db[username]["permissions"]
                     
                     if "Página Inicial" in st.session_state.user_permissions:
@@ -3,10 +3,17 @@ import pandas as pd
 import sqlite3
 import logging
 from streamlit_autorefresh import st_autorefresh
-from st_aggrid import AgGrid, GridOptionsBuilder, GridUpdateMode, JsCode
+from st_aggrid import GridOptionsBuilder, JsCode
 import plotly.express as px
 import plotly.graph_objects as go
 import datetime
+from banco_local import CONSULTAS, conectar_analitico
+from busca_produtos import buscar_codprods
+from grade_servidor import base_url_js, exibir_grade
+from acesso import cabecalhos_js
+from cache_dados import derivar, obter
+from metricas_estoque import calcular_metricas, ler_metricas
+from registro_consultas import conectar
 
 # Configuração da página (deve ser a primeira chamada do Streamlit)
 
@@ -21,59 +28,52 @@ logger = logging.getLogger(__name__)
 
 # Caminho base para os arquivos .db
 DB_PATH = "database\\"
+# Colunas que só aparecem no detalhe (buscado sob demanda): não vão no payload do grid
+COLUNAS_DETALHE = ['Vendas Sem. Atual', 'Vendas Sem. -1', 'Vendas Sem. -2', 'Vendas Sem. -3',
+                   'Vendas Mês -1', 'Vendas Mês -2', 'Vendas Mês -3',
+                   'Dev. Mês Atual', 'Dev. Mês -1', 'Dev. Mês -2', 'Dev. Mês -3', 'Qtde. Últ. Entrada']
 
 # --- Funções de Acesso a Dados ---
-@st.cache_data(ttl=60)
+# Cache compartilhado entre as sessões (cache_dados): os dados só são relidos quando a sincronização
+# muda a tabela (versão no sync_state). Falhas voltam None e não ficam guardadas.
 def fetch_estoque_data():
-    """Busca dados de estoque diretamente do banco SQLite (pceest.db)."""
-    estoque_sql = """
-        SELECT 
-            NOMES_PRODUTO, QTULTENT, DTULTENT, DTULTSAIDA, CODFILIAL,
-            QTVENDSEMANA, QTVENDSEMANA1, QTVENDSEMANA2, QTVENDSEMANA3,
-            QTVENDMES, QTVENDMES1, QTVENDMES2, QTVENDMES3, QTGIRODIA,
-            QTDEVOLMES, QTDEVOLMES1, QTDEVOLMES2, QTDEVOLMES3,
-            CODPROD, QT_ESTOQUE, QTRESERV, QTINDENIZ, DTULTPEDCOMPRA,
-            BLOQUEADA, CODFORNECEDOR, FORNECEDOR, CATEGORIA
-        FROM PCEEST
+    start_of_year = datetime.date.today().replace(month=1, day=1).strftime('%Y-%m-%d')
+    df = obter(('estoque_produtos_ultima_venda', start_of_year), ('pceest', 'pcvendedor2'), lambda: ler_estoque_data(start_of_year))
+    return pd.DataFrame() if df is None else df
+
+def fetch_sales_data_for_current_year():
+    start_of_year = datetime.date.today().replace(month=1, day=1).strftime('%Y-%m-%d') # Formato 'YYYY-MM-DD'
+    df = obter(('estoque_vendas_ano', start_of_year), ('pcvendedor2',), lambda: ler_vendas_ano(start_of_year))
+    return pd.DataFrame() if df is None else df
+
+def ler_estoque_data(start_of_year):
+    """
+    Busca os dados de estoque já com a data da última venda do ano (ULTIMA_VENDA).
+    O JOIN entre pceest.db e pcvendedor2.db roda no SQLite pela conexão analítica.
     """
+    estoque_sql = CONSULTAS['estoque_produtos_ultima_venda']['sql']
     try:
-        connection = sqlite3.connect(f"{DB_PATH}pceest.db", timeout=10)
-        df = pd.read_sql_query(estoque_sql, connection)
+        connection = conectar_analitico(DB_PATH)
+        df = pd.read_sql_query(estoque_sql, connection, params=(start_of_year,))
         logger.info(f"Dados de estoque carregados com sucesso. {len(df)} linhas.")
         return df
     except (sqlite3.Error, pd.io.sql.DatabaseError) as e:
         logger.error(f"Erro ao buscar dados de estoque: {e}")
         st.error(f"Erro ao buscar dados de estoque: {e}. Verifique se o caminho '{DB_PATH}pceest.db' está correto.")
-        return pd.DataFrame()
+        return None
     finally:
         if 'connection' in locals() and connection:
             connection.close()
 
 # <<< OTIMIZAÇÃO 1: Filtrar dados de vendas diretamente no banco de dados >>>
-# <<< OTIMIZAÇÃO 2: Sincronizar o tempo do cache (ttl) com o auto_refresh >>>
-@st.cache_data(ttl=120)
-def fetch_sales_data_for_current_year():
+# <<< OTIMIZAÇÃO 2: Cache pela versão da tabela no sync_state, não por tempo (fetch_sales_data_for_current_year) >>>
+def ler_vendas_ano(start_of_year):
     """
     Busca os dados de vendas da tabela pcvendedor2 APENAS do início do ano atual até hoje.
     """
-    today = datetime.date.today()
-    start_of_year = today.replace(month=1, day=1).strftime('%Y-%m-%d') # Formato 'YYYY-MM-DD'
-
-    sales_sql = f"""
-    SELECT
-        CODPROD, DATA, QT, PVENDA, CODOPER, CODCLI, CONDVENDA, CODIGOVENDEDOR
-    FROM
-        pcvendedor2
-    WHERE
-        -- Filtro de data adicionado para performance máxima
-        DATA >= ? 
-        -- Mantém os filtros essenciais para considerar apenas vendas válidas
-        AND CODCLI NOT IN ('3', '91503', '111564', '1')
-        AND CONDVENDA = '1'
-        AND CODIGOVENDEDOR NOT IN (219, 3, 63, 100, 12, 104, 186, 217, 172, 173, 73, 144, 107, 207, 174, 149, 167, 199, 191, 218, 196, 214, 96)
-    """
+    sales_sql = CONSULTAS['estoque_vendas_ano']['sql']
     try:
-        connection = sqlite3.connect(f"{DB_PATH}pcvendedor2.db", timeout=10)
+        connection = conectar(f"{DB_PATH}pcvendedor2.db", timeout=10)
         # Usamos 'params' para passar a data de forma segura e evitar SQL Injection
         df_sales = pd.read_sql_query(sales_sql, connection, params=(start_of_year,))
         logger.info(f"Dados de vendas do ano atual carregados. {len(df_sales)} linhas.")
@@ -81,125 +81,38 @@ def fetch_sales_data_for_current_year():
     except (sqlite3.Error, pd.io.sql.DatabaseError) as e:
         logger.error(f"Erro ao buscar dados de vendas: {e}")
         st.error(f"Erro ao buscar dados de vendas do banco 'pcvendedor2.db': {e}.")
-        return pd.DataFrame()
+        return None
     finally:
         if 'connection' in locals() and connection:
             connection.close()
 
+def fetch_estoque_metrics():
+    """Estoque já classificado pela sincronização (estoque_metrics), ou None se a tabela ainda não existe."""
+    return obter(('estoque_metrics',), ('estoque_metrics',), lambda: ler_metricas(DB_PATH))
+
 # --- Funções de Processamento de Dados ---
-# Nenhuma alteração necessária aqui, a lógica permanece a mesma.
+# O cálculo (Curva ABC, cobertura, devolução) fica em metricas_estoque.py, usado também pela sincronização
 def process_dataframe(df, df_sales):
-    """
-    Renomeia colunas, limpa dados e calcula novas métricas.
-    A Curva ABC agora segue a nova regra de negócio baseada em data e volume.
-    """
-    # Renomeação e limpeza inicial do df de estoque
-    df = df.rename(columns={
-        'CODPROD': 'Código Produto', 'NOMES_PRODUTO': 'Nome do Produto', 'QTULTENT': 'Qtde. Últ. Entrada',
-        'QT_ESTOQUE': 'Estoque Disponível', 'QTRESERV': 'Qtde. Reservada', 'QTINDENIZ': 'Qtde. Avariada',
-        'DTULTENT': 'Data Últ. Entrada', 'DTULTSAIDA': 'Data Últ. Saída', 'CODFILIAL': 'Filial',
-        'DTULTPEDCOMPRA': 'Data Últ. Ped. Compra', 'BLOQUEADA': 'Qtde. Bloqueada', 'CODFORNECEDOR': 'Cód. Fornecedor',
-        'FORNECEDOR': 'Fornecedor', 'CATEGORIA': 'Categoria', 'QTVENDSEMANA': 'Vendas Sem. Atual',
-        'QTVENDSEMANA1': 'Vendas Sem. -1', 'QTVENDSEMANA2': 'Vendas Sem. -2', 'QTVENDSEMANA3': 'Vendas Sem. -3',
-        'QTVENDMES': 'Vendas Mês Atual', 'QTVENDMES1': 'Vendas Mês -1', 'QTVENDMES2': 'Vendas Mês -2',
-        'QTVENDMES3': 'Vendas Mês -3', 'QTGIRODIA': 'Giro Diário', 'QTDEVOLMES': 'Dev. Mês Atual',
-        'QTDEVOLMES1': 'Dev. Mês -1', 'QTDEVOLMES2': 'Dev. Mês -2', 'QTDEVOLMES3': 'Dev. Mês -3',
-    })
-    numeric_cols = ['Estoque Disponível', 'Qtde. Reservada', 'Qtde. Bloqueada', 'Qtde. Avariada','Qtde. Últ. Entrada', 'Vendas Sem. Atual', 'Vendas Sem. -1', 'Vendas Sem. -2', 'Vendas Sem. -3','Vendas Mês Atual', 'Vendas Mês -1', 'Vendas Mês -2', 'Vendas Mês -3', 'Giro Diário', 'Dev. Mês Atual', 'Dev. Mês -1', 'Dev. Mês -2', 'Dev. Mês -3']
-    for col in numeric_cols:
-        if col in df.columns:
-            df[col] = pd.to_numeric(df[col], errors='coerce').fillna(0)
-    
-    # #### INÍCIO DA NOVA LÓGICA DE CLASSIFICAÇÃO ABC ####
-
-    # 1. Prepara os dados de vendas
-    if not df_sales.empty:
-        df_sales['DATA'] = pd.to_datetime(df_sales['DATA'], errors='coerce')
-        df_sales['VALOR_VENDA'] = df_sales.apply(
-            lambda row: row['QT'] if row['CODOPER'] == 'S' else -row['QT'], axis=1
-        ) * df_sales['PVENDA']
-        df_sales = df_sales.rename(columns={'CODPROD': 'Código Produto'})
-        df_sales['Código Produto'] = df_sales['Código Produto'].astype(str)
-    
-    df['Código Produto'] = df['Código Produto'].astype(str)
-    today = pd.to_datetime(datetime.date.today())
-
-    # 2. Determina produtos Curva A (Pareto sobre vendas dos últimos 15 dias)
-    class_A_products = set()
-    if not df_sales.empty:
-        # O filtro de 15 dias agora é aplicado em um dataframe já muito menor
-        sales_15_days_df = df_sales[(today - df_sales['DATA']).dt.days <= 15]
-        if not sales_15_days_df.empty:
-            sales_value_15 = sales_15_days_df.groupby('Código Produto')['VALOR_VENDA'].sum().reset_index()
-            sales_value_15 = sales_value_15[sales_value_15['VALOR_VENDA'] > 0]
-            if not sales_value_15.empty:
-                sales_value_15 = sales_value_15.sort_values(by='VALOR_VENDA', ascending=False)
-                total_value_15 = sales_value_15['VALOR_VENDA'].sum()
-                sales_value_15['CUM_PERC'] = (sales_value_15['VALOR_VENDA'].cumsum() / total_value_15) * 100
-                class_A_products = set(sales_value_15[sales_value_15['CUM_PERC'] <= 80]['Código Produto'])
-
-    # 3. Obtém a data da última venda para todos os produtos
-    last_sale_dates = pd.DataFrame()
-    if not df_sales.empty:
-        last_sale_dates = df_sales.groupby('Código Produto')['DATA'].max().reset_index()
-        last_sale_dates = last_sale_dates.rename(columns={'DATA': 'ULTIMA_VENDA'})
-    
-    # 4. Junta a data da última venda ao dataframe principal
-    if not last_sale_dates.empty:
-        df = df.merge(last_sale_dates, on='Código Produto', how='left')
-    else:
-        df['ULTIMA_VENDA'] = pd.NaT
-
-    # 5. Define e aplica a função de classificação
-    def classify_recency(row, class_A_set, today_date):
-        if row['Código Produto'] in class_A_set:
-            return 'A'
-        last_sale = row['ULTIMA_VENDA']
-        if pd.isna(last_sale):
-            return 'C'
-        days_since_sale = (today_date - last_sale).days
-        if days_since_sale <= 30:
-            return 'B'
-        else:
-            return 'C'
-
-    df['Classe ABC'] = df.apply(classify_recency, axis=1, args=(class_A_products, today))
-    
-    # #### FIM DA NOVA LÓGICA DE CLASSIFICAÇÃO ABC ####
-
-    # Cálculos restantes (dependentes do df principal)
-    df['Giro Diário'] = df['Giro Diário'].replace(0, pd.NA)
-    df['Dias de Estoque'] = (df['Estoque Disponível'] / df['Giro Diário']).fillna(0).round(0)
-    df['Taxa de Devolução (%)'] = df.apply(lambda row: (row['Dev. Mês Atual'] / row['Vendas Mês Atual'] * 100) if row['Vendas Mês Atual'] > 0 else 0, axis=1).round(2)
-    bins = [-1, 7, 30, 90, float('inf')]
-    labels = ['Crítico', 'Atenção', 'Saudável', 'Excesso']
-    df['Status Estoque'] = pd.cut(df['Dias de Estoque'], bins=bins, labels=labels, right=True)
-
-    def create_detail_data(row):
-          return [
-              {'Métrica': 'Vendas Semanais', 'Atual': row['Vendas Sem. Atual'], 'Semana -1': row['Vendas Sem. -1'], 'Semana -2': row['Vendas Sem. -2'], 'Semana -3': row['Vendas Sem. -3']},
-              {'Métrica': 'Vendas Mensais', 'Atual': row['Vendas Mês Atual'], 'Mês -1': row['Vendas Mês -1'], 'Mês -2': row['Vendas Mês -2'], 'Mês -3': row['Vendas Mês -3']},
-              {'Métrica': 'Devoluções Mensais', 'Atual': row['Dev. Mês Atual'], 'Mês -1': row['Dev. Mês -1'], 'Mês -2': row['Dev. Mês -2'], 'Mês -3': row['Dev. Mês -3']},
-              {'Métrica': 'Outras Qtde.', 'Reservada': row['Qtde. Reservada'], 'Bloqueada': row['Qtde. Bloqueada'], 'Avariada': row['Qtde. Avariada'], 'Últ. Entrada': row['Qtde. Últ. Entrada']}
-          ]
-    df['detail_data'] = df.apply(create_detail_data, axis=1)
-    
-    return df
+    """Renomeia colunas, limpa dados e calcula as métricas (metricas_estoque.calcular_metricas)."""
+    return calcular_metricas(df, df_sales)
 
 # --- Interface Principal do Streamlit ---
 def main():
     st_autorefresh(interval=120000, key="auto_refresh")
     st.title("Dashboard de Análise de Estoque e Vendas")
     
-    # Carrega ambos os conjuntos de dados (a função de vendas agora é muito mais rápida)
-    estoque_df = fetch_estoque_data()
-    sales_df = fetch_sales_data_for_current_year() # <<< CHAMANDO A NOVA FUNÇÃO OTIMIZADA
+    # Métricas gravadas pela sincronização: uma leitura só. Sem a tabela (sincronizador antigo), calcula aqui.
+    df_processado = fetch_estoque_metrics()
+    if df_processado is None:
+        estoque_df = fetch_estoque_data()
+        sales_df = fetch_sales_data_for_current_year()
+
+        if estoque_df.empty:
+            st.warning("Não há dados de estoque para exibir."); return
 
-    if estoque_df.empty:
+        df_processado = process_dataframe(estoque_df, sales_df)
+    elif df_processado.empty:
         st.warning("Não há dados de estoque para exibir."); return
-        
-    # Processa os dados com a nova lógica ABC
-    df_processado = process_dataframe(estoque_df, sales_df)
 
     # O RESTANTE DO SEU CÓDIGO PERMANECE EXATAMENTE IGUAL
     
@@ -224,7 +137,10 @@ def main():
         c1, c2, c3 = st.columns(3)
         selected_filiais = c1.multiselect("Filial", filiais, default=[]); selected_categorias = c2.multiselect("Categoria", categorias, default=[]); selected_fornecedores = c3.multiselect("Fornecedor", fornecedores, default=[])
         
-        if pesquisar: df_filtrado = df_filtrado[df_filtrado['Código Produto'].astype(str).str.contains(pesquisar, case=False, na=False) | df_filtrado['Nome do Produto'].str.contains(pesquisar, case=False, na=False) | df_filtrado['Fornecedor'].str.contains(pesquisar, case=False, na=False)]
+        # Busca pelo índice FTS5 da sincronização (busca_produtos.py); sem o índice, str.contains nas três colunas
+        codigos = buscar_codprods(pesquisar, DB_PATH) if pesquisar else None
+        if codigos is not None: df_filtrado = df_filtrado[df_filtrado['Código Produto'].isin(codigos)]
+        elif pesquisar: df_filtrado = df_filtrado[df_filtrado['Código Produto'].astype(str).str.contains(pesquisar, case=False, na=False) | df_filtrado['Nome do Produto'].str.contains(pesquisar, case=False, na=False) | df_filtrado['Fornecedor'].str.contains(pesquisar, case=False, na=False)]
         if selected_filiais: df_filtrado = df_filtrado[df_filtrado['Filial'].isin(selected_filiais)]
         if selected_categorias: df_filtrado = df_filtrado[df_filtrado['Categoria'].isin(selected_categorias)]
         if selected_fornecedores: df_filtrado = df_filtrado[df_filtrado['Fornecedor'].isin(selected_fornecedores)]
@@ -243,7 +159,13 @@ def main():
     estoque_style_js = JsCode("""function(params) { if (params.value <= 0) { return {'color': 'white', 'backgroundColor': '#E65555'}; } var status = params.data['Status Estoque']; if (status == 'Crítico') { return {'color': 'white', 'backgroundColor': '#E65555'}; } if (status == 'Atenção') { return {'color': 'black', 'backgroundColor': '#F4E07B'}; } if (status == 'Saudável') { return {'color': 'black', 'backgroundColor': '#82E0AA'}; } if (status == 'Excesso') { return {'color': 'white', 'backgroundColor': '#D2B4DE'}; } return {'color': 'black', 'backgroundColor': 'white'}; }""")
     
     colunas_principais = ['Filial', 'Código Produto', 'Nome do Produto', 'Status Estoque', 'Classe ABC', 'Estoque Disponível', 'Qtde. Reservada', 'Qtde. Bloqueada', 'Qtde. Avariada', 'Dias de Estoque', 'Vendas Mês Atual', 'Fornecedor', 'Categoria', 'Taxa de Devolução (%)']
-    gb = GridOptionsBuilder.from_dataframe(df_filtrado)
+    colunas_restantes = [col for col in df_filtrado.columns if col not in colunas_principais and col not in COLUNAS_DETALHE and col != 'ULTIMA_VENDA']
+    df_para_exibir = df_filtrado[colunas_principais + colunas_restantes]
+    # Proveniência (métricas do cache + filtros): o grade_servidor reaproveita a publicação sem ler as linhas
+    filtros = (pesquisar, None if codigos is None else tuple(sorted(codigos)), tuple(selected_abc), tuple(selected_stock_status),
+               tuple(selected_status), tuple(selected_filiais), tuple(selected_categorias), tuple(selected_fornecedores))
+    df_para_exibir = derivar(df_para_exibir, df_processado, *filtros)
+    gb = GridOptionsBuilder.from_dataframe(df_para_exibir)
     gb.configure_default_column(editable=False, groupable=True)
     gb.configure_column("Filial", width=80, pinned='left')
     gb.configure_column("Código Produto", width=120, pinned='left')
@@ -259,15 +181,15 @@ def main():
     gb.configure_column("Fornecedor", width=200)
     gb.configure_column("Categoria", width=150)
     gb.configure_column("Taxa de Devolução (%)", width=160, type=["numericColumn", "rightAligned"])
-    gb.configure_columns(['detail_data', 'ULTIMA_VENDA'], hide=True)
     grid_options = gb.build()
     grid_options['masterDetail'] = True
-    grid_options['detailCellRendererParams'] = {'detailGridOptions': { 'columnDefs': [{'field': c} for c in ['Métrica', 'Atual', 'Semana -1', 'Semana -2', 'Semana -3', 'Mês -1', 'Mês -2', 'Mês -3', 'Reservada', 'Bloqueada', 'Avariada', 'Últ. Entrada']] }, 'getDetailRowData': JsCode("function(params) { params.successCallback(params.data.detail_data); }")}
+    # Detalhe sob demanda: a linha leva só as chaves (Código Produto, Filial, Nome) e o navegador busca o resto ao expandir
+    detalhe_js = JsCode(f"""function(params) {{ var d = params.data; var url = {base_url_js()} + '/detalhe_estoque?codprod=' + encodeURIComponent(d['Código Produto']) + '&filial=' + encodeURIComponent(d['Filial']) + '&nome=' + encodeURIComponent(d['Nome do Produto']); fetch(url, {{headers: {cabecalhos_js()}}}).then(function(r) {{ return r.json(); }}).then(function(linhas) {{ params.successCallback(Array.isArray(linhas) ? linhas : []); }}).catch(function() {{ params.successCallback([]); }}); }}""")
+    grid_options['detailCellRendererParams'] = {'detailGridOptions': { 'columnDefs': [{'field': c} for c in ['Métrica', 'Atual', 'Semana -1', 'Semana -2', 'Semana -3', 'Mês -1', 'Mês -2', 'Mês -3', 'Reservada', 'Bloqueada', 'Avariada', 'Últ. Entrada']] }, 'getDetailRowData': detalhe_js}
     grid_options['columnDefs'][0]['cellRenderer'] = 'agGroupCellRenderer'
     
-    colunas_restantes = [col for col in df_filtrado.columns if col not in colunas_principais and col != 'ULTIMA_VENDA']
-    df_para_exibir = df_filtrado[colunas_principais + colunas_restantes]
-    AgGrid(df_para_exibir, gridOptions=grid_options, height=600, width='100%', theme='streamlit', allow_unsafe_jscode=True, enable_enterprise_modules=True)
+    # Row model no servidor (grade_servidor.py): o navegador recebe só os blocos de linhas que exibe
+    exibir_grade(df_para_exibir, 'estoque', grid_options, db_dir=DB_PATH, height=600, width='100%', theme='streamlit')
 
     # --- Legenda, Saúde do Estoque e outras seções continuam aqui ...
     st.caption("Legenda dos Status de Estoque (baseado em dias de cobertura):")
@@ -1,14 +1,22 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
 from datetime import datetime, timedelta
 from dateutil.relativedelta import relativedelta
-import sqlite3
 from st_aggrid import AgGrid, GridOptionsBuilder, JsCode
 import logging
 import plotly.express as px
 from streamlit_autorefresh import st_autorefresh
 import hashlib
+import json
 import os # <-- 1. ADICIONE ESTA LINHA
+from acesso import cabecalhos_js
+from arvore_fornecedor import listar_fornecedores, meses_periodo
+from banco_local import CONSULTAS
+from cache_dados import chave_dataframe, derivar, obter
+from grade_servidor import TAMANHO_BLOCO, base_url_js
+from motor_analitico import agregar, dia
+from registro_consultas import conectar
 
 # --- Configurações Iniciais ---
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -26,6 +34,8 @@ except NameError:
     script_dir = os.path.abspath('.')
 
 DB_FILE = os.path.join(script_dir, "pcvendedor2.db")
+# 'servidor': árvore sob demanda pelo endpoint (/arvore_fornecedor); 'cliente': árvore inteira montada na página
+ARVORE_FORNECEDOR = os.environ.get('ARVORE_FORNECEDOR', 'servidor')
 # ----------------------------------------------------------------
 
 
@@ -37,10 +47,14 @@ def initialize_database():
     A operação é segura e só cria o índice se ele não existir.
     """
     try:
-        connection = sqlite3.connect(DB_FILE)
+        connection = conectar(DB_FILE)
         cursor = connection.cursor()
-        # Cria um índice na coluna DATA. O 'IF NOT EXISTS' garante que não haverá erro se o índice já existir.
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_data_vendas ON pcvendedor2 (DATA);")
+        # Com o modelo fato/dimensão, 'pcvendedor2' é uma VIEW e os índices ficam na fato (criados pelo endpoint).
+        cursor.execute("SELECT type FROM sqlite_master WHERE name = 'pcvendedor2'")
+        tipo = cursor.fetchone()
+        if tipo and tipo[0] == 'table':
+            # Cria um índice na coluna DATA. O 'IF NOT EXISTS' garante que não haverá erro se o índice já existir.
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_data_vendas ON pcvendedor2 (DATA);")
         connection.commit()
         connection.close()
         logger.info("Índice do banco de dados verificado/criado com sucesso.")
@@ -54,22 +68,40 @@ def initialize_database():
 
 
 # --- Funções de Acesso e Processamento de Dados ---
-@st.cache_data(ttl=300)
+# Cache compartilhado entre as sessões (cache_dados), válido até a sincronização mudar o pcvendedor2
 def fetch_vendas_data(data_inicial, data_final):
+    """Vendas do período pelo cache compartilhado. Retorna o DataFrame e o horário em que foi lido do SQLite."""
+    df = obter(('fornecedor_vendas', data_inicial, data_final), ('pcvendedor2',),
+               lambda: ler_vendas_data(data_inicial, data_final), db_dir=os.path.dirname(DB_FILE))
+    if df is None:
+        return pd.DataFrame(), datetime.now()
+    return df, df.attrs.get('atualizado_em', datetime.now())
+
+def fetch_fornecedores_periodo(data_inicial, data_final):
+    """Fornecedores com venda no período: no modo 'servidor' a página não precisa das vendas em si."""
+    db_dir = os.path.dirname(DB_FILE)
+    df = obter(('fornecedor_lista', data_inicial, data_final), ('pcvendedor2',),
+               lambda: listar_fornecedores(data_inicial, data_final, db_dir), db_dir=db_dir)
+    if df is None:
+        return pd.DataFrame(), datetime.now()
+    return df, df.attrs.get('atualizado_em', datetime.now())
+
+def ler_vendas_data(data_inicial, data_final):
     """
     Busca dados de vendas e cria colunas explícitas para Venda e Devolução,
     garantindo que os cálculos sejam sempre corretos e isolados.
-    Retorna o DataFrame e o timestamp da atualização.
+    O horário da leitura fica em df.attrs['atualizado_em']; em caso de erro retorna None.
     
     ## OTIMIZAÇÃO DE PERFORMANCE ##
     A consulta SQL foi modificada para usar um índice na coluna 'DATA',
     evitando a função DATE() que causa lentidão (full table scan).
     """
     # MODIFICADO: A consulta SQL agora é "SARGable", permitindo o uso de índices.
-    vendas_sql = "SELECT NUMPED, CLIENTE, VENDEDOR, PRODUTO, QT, PVENDA, VLBONIFIC, DATA, FORNECEDOR FROM pcvendedor2 WHERE DATA >= ? AND DATA < ?"
+    # DATA_DIA é o número do dia gravado na fato (a coluna DATA da view é calculada e não usa índice).
+    vendas_sql = CONSULTAS['fornecedor_vendas']['sql']
     
     try:
-        connection = sqlite3.connect(DB_FILE)
+        connection = conectar(DB_FILE)
         
         # MODIFICADO: Ajusta a data final para incluir todas as horas do último dia.
         # Ex: Se data_final for '2023-10-25', o filtro será até '2023-10-26 00:00:00'.
@@ -80,7 +112,10 @@ def fetch_vendas_data(data_inicial, data_final):
         
         update_time = datetime.now() # Captura o momento da busca
 
-        if df.empty: return pd.DataFrame(), update_time
+        if df.empty:
+            df = pd.DataFrame()
+            df.attrs['atualizado_em'] = update_time
+            return df
 
         df['DATA'] = pd.to_datetime(df['DATA'], errors='coerce')
         for col in ['QT', 'PVENDA', 'VLBONIFIC']:
@@ -92,17 +127,33 @@ def fetch_vendas_data(data_inicial, data_final):
         df['VALOR_DEVOLUCAO'] = -df['VALOR_TRANSACAO'].where(df['QT'] < 0, 0)
         df['MES'] = df['DATA'].dt.month
         df['ANO'] = df['DATA'].dt.year
-        return df, update_time
+        df.attrs['atualizado_em'] = update_time
+        return df
     except Exception as e:
         st.error(f"Erro ao buscar dados de vendas: {e}")
-        return pd.DataFrame(), datetime.now()
+        return None
+
+# Chaves da árvore, do nível mais alto ao mais baixo (Mês = ANO + MES)
+CHAVES_ARVORE = ['FORNECEDOR', 'ANO', 'MES', 'PRODUTO', 'VENDEDOR']
+
+def agregar_nivel(df: pd.DataFrame, chaves):
+    """Totais de um nível da árvore numa única agregação agrupada (ordem do groupby, sem chaves nulas)."""
+    return df.groupby(chaves).agg(
+        VENDAS_BRUTAS=('VALOR_VENDA_LIQUIDA', 'sum'),
+        TOTAL_DEVOLVIDO=('VALOR_DEVOLUCAO', 'sum'),
+        TOTAL_PEDIDOS=('NUMPED', 'nunique'),
+        POSITIVACAO=('CLIENTE_POSITIVADO', 'nunique'),
+        QT=('QT', 'sum'),
+    ).reset_index()
 
-@st.cache_data(ttl=300, hash_funcs={pd.DataFrame: lambda df: hashlib.md5(pd.util.hash_pandas_object(df).values.tobytes()).hexdigest()})
+# Chave do cache pela proveniência do DataFrame (consulta, período e versão do pcvendedor2, filtro de fornecedores),
+# sem fazer hash de todas as linhas a cada chamada
+@st.cache_data(ttl=300, hash_funcs={pd.DataFrame: chave_dataframe})
 def prepare_tree_data(df: pd.DataFrame, start_date, end_date, show_transactions=True):
     """
-    ## LÓGICA CORRIGIDA E OTIMIZADA ##
     Prepara os dados na estrutura de árvore: Fornecedor -> Mês -> Produto -> Vendedor -> (Transação opcional).
-    Otimizado com mais operações vetoriais e menos loops para melhorar desempenho.
+    Uma agregação agrupada por nível (agregar_nivel) em vez de um groupby por fornecedor/mês/produto/vendedor;
+    os nós saem na mesma ordem de antes (pai seguido dos filhos, chaves em ordem crescente).
     """
     if df.empty: return [], []
     month_range = pd.date_range(start=start_date, end=end_date, freq='MS').strftime('%b/%y').unique()
@@ -125,84 +176,144 @@ def prepare_tree_data(df: pd.DataFrame, start_date, end_date, show_transactions=
     ]
     tree_data.extend(supplier_nodes)
 
-    # Agrupamentos por fornecedor
-    grouped_forn = df.groupby('FORNECEDOR')
-    for fornecedor, df_fornecedor in grouped_forn:
-        # Agrupamentos por mês dentro do fornecedor
-        grouped_mes = df_fornecedor.groupby(['ANO', 'MES'])
-        for (ano, mes_num), df_mes in grouped_mes:
-            mes_nome_str = datetime(ano, mes_num, 1).strftime('%B/%Y')
-            
-            # Nível 2: Mês (vetorial onde possível)
-            mes_node = {
-                'dataPath': [fornecedor, f"{ano}-{mes_num:02d}"], 'ENTIDADE': f"🗓️ {mes_nome_str}",
-                'VENDAS_BRUTAS': df_mes['VALOR_VENDA_LIQUIDA'].sum(),
-                'TOTAL_DEVOLVIDO': df_mes['VALOR_DEVOLUCAO'].sum(),
-                'VENDAS_LIQUIDAS': df_mes['VALOR_VENDA_LIQUIDA'].sum() - df_mes['VALOR_DEVOLUCAO'].sum(),
-                'TOTAL_PEDIDOS': df_mes['NUMPED'].nunique(),
-                'POSITIVACAO': df_mes[df_mes['VALOR_VENDA_LIQUIDA'] > 0]['CLIENTE'].nunique()
-            }
-            tree_data.append(mes_node)
-            
-            # Agrupamentos por produto dentro do mês
-            grouped_prod = df_mes.groupby('PRODUTO')
-            for produto, df_produto in grouped_prod:
-                vendas_brutas_prod = df_produto['VALOR_VENDA_LIQUIDA'].sum()
-                total_devolvido_prod = df_produto['VALOR_DEVOLUCAO'].sum()
-                
-                # Nível 3: Produto
-                produto_node = {
-                    'dataPath': [fornecedor, f"{ano}-{mes_num:02d}", produto], 'ENTIDADE': f"📦 {produto}",
-                    'VENDAS_BRUTAS': vendas_brutas_prod,
-                    'TOTAL_DEVOLVIDO': total_devolvido_prod,
-                    'VENDAS_LIQUIDAS': vendas_brutas_prod - total_devolvido_prod,
-                    'TOTAL_PEDIDOS': df_produto['NUMPED'].nunique(),
-                    'POSITIVACAO': df_produto[df_produto['VALOR_VENDA_LIQUIDA'] > 0]['CLIENTE'].nunique(),
-                    'QT': df_produto['QT'].sum()
-                }
-                tree_data.append(produto_node)
-
-                # Agrupamentos por vendedor dentro do produto
-                grouped_vend = df_produto.groupby('VENDEDOR')
-                for vendedor, df_vendedor in grouped_vend:
-                    vendas_brutas_vend = df_vendedor['VALOR_VENDA_LIQUIDA'].sum()
-                    total_devolvido_vend = df_vendedor['VALOR_DEVOLUCAO'].sum()
-
-                    # Nível 4: Vendedor
-                    vendedor_node = {
-                        'dataPath': [fornecedor, f"{ano}-{mes_num:02d}", produto, vendedor], 'ENTIDADE': f"👨‍💼 {vendedor}",
-                        'VENDAS_BRUTAS': vendas_brutas_vend,
-                        'TOTAL_DEVOLVIDO': total_devolvido_vend,
-                        'VENDAS_LIQUIDAS': vendas_brutas_vend - total_devolvido_vend,
-                        'TOTAL_PEDIDOS': df_vendedor['NUMPED'].nunique(),
-                        'POSITIVACAO': df_vendedor[df_vendedor['VALOR_VENDA_LIQUIDA'] > 0]['CLIENTE'].nunique(),
-                        'QT': df_vendedor['QT'].sum()
-                    }
-                    tree_data.append(vendedor_node)
-                    
-                    if show_transactions:
-                        # Nível 5: Transações (vetorial para criar nodes)
-                        transacoes = df_vendedor.reset_index()
-                        transacao_nodes = [
-                            {
-                                'dataPath': [fornecedor, f"{ano}-{mes_num:02d}", produto, vendedor, f"T.{row['index']}"],
-                                'ENTIDADE': f"📄 Pedido: {row['NUMPED']}",
-                                'NUMPED': row['NUMPED'],
-                                'CLIENTE': row['CLIENTE'],
-                                'QT': row['QT'],
-                                'PVENDA': row['PVENDA'],
-                                'TIPO': 'Devolução' if row['QT'] < 0 else 'Venda',
-                                'VENDAS_BRUTAS': row['VALOR_VENDA_LIQUIDA'],
-                                'TOTAL_DEVOLVIDO': row['VALOR_DEVOLUCAO']
-                            }
-                            for _, row in transacoes.iterrows()
-                        ]
-                        tree_data.extend(transacao_nodes)
-                        
+    # Positivação = clientes distintos com venda: o nunique ignora os nulos das linhas sem venda
+    df = df.assign(CLIENTE_POSITIVADO=df['CLIENTE'].where(df['VALOR_VENDA_LIQUIDA'] > 0))
+
+    # Níveis 2 a 4: Mês, Produto e Vendedor, cada um numa agregação só
+    niveis = []
+    for profundidade, icone in ((3, '🗓️'), (4, '📦'), (5, '👨‍💼')):
+        nivel = agregar_nivel(df, CHAVES_ARVORE[:profundidade])
+        nivel['VENDAS_LIQUIDAS'] = nivel['VENDAS_BRUTAS'] - nivel['TOTAL_DEVOLVIDO']
+        mes_chave = nivel['ANO'].astype(str) + '-' + nivel['MES'].astype(str).str.zfill(2)
+        caminho = [nivel['FORNECEDOR'], mes_chave] + [nivel[c] for c in CHAVES_ARVORE[3:profundidade]]
+        nivel['dataPath'] = [list(p) for p in zip(*caminho)]
+        if profundidade == 3:
+            nomes = {(ano, mes): datetime(ano, mes, 1).strftime('%B/%Y') for ano, mes in set(zip(nivel['ANO'], nivel['MES']))}
+            nivel['ENTIDADE'] = [f"{icone} {nomes[(ano, mes)]}" for ano, mes in zip(nivel['ANO'], nivel['MES'])]
+        else:
+            nivel['ENTIDADE'] = f"{icone} " + nivel[CHAVES_ARVORE[profundidade - 1]].astype(str)
+        colunas = ['dataPath', 'ENTIDADE', 'VENDAS_BRUTAS', 'TOTAL_DEVOLVIDO', 'VENDAS_LIQUIDAS', 'TOTAL_PEDIDOS', 'POSITIVACAO']
+        niveis.append((nivel[CHAVES_ARVORE[:profundidade]], nivel[colunas + (['QT'] if profundidade > 3 else [])].to_dict('records')))
+
+    if show_transactions:
+        # Nível 5: Transações, na ordem das chaves e, dentro do vendedor, na ordem original
+        transacoes = df.dropna(subset=CHAVES_ARVORE).sort_values(CHAVES_ARVORE, kind='stable')
+        mes_chave = transacoes['ANO'].astype(str) + '-' + transacoes['MES'].astype(str).str.zfill(2)
+        transacao_nodes = pd.DataFrame({
+            'dataPath': [list(p) for p in zip(transacoes['FORNECEDOR'], mes_chave, transacoes['PRODUTO'], transacoes['VENDEDOR'], 'T.' + transacoes.index.astype(str))],
+            'ENTIDADE': '📄 Pedido: ' + transacoes['NUMPED'].astype(str),
+            'NUMPED': transacoes['NUMPED'],
+            'CLIENTE': transacoes['CLIENTE'],
+            'QT': transacoes['QT'],
+            'PVENDA': transacoes['PVENDA'],
+            'TIPO': np.where(transacoes['QT'] < 0, 'Devolução', 'Venda'),
+            'VENDAS_BRUTAS': transacoes['VALOR_VENDA_LIQUIDA'],
+            'TOTAL_DEVOLVIDO': transacoes['VALOR_DEVOLUCAO'],
+        })
+        niveis.append((transacoes[CHAVES_ARVORE].assign(SEQ=np.arange(len(transacoes))), transacao_nodes.to_dict('records')))
+
+    # Ordem de exibição: ordenar as chaves de todos os níveis juntos, com a chave ausente (nó pai) antes dos filhos
+    ordem = pd.concat(
+        [chaves.assign(NIVEL=n, POS=np.arange(len(chaves))) for n, (chaves, _) in enumerate(niveis)], ignore_index=True
+    )
+    if 'SEQ' not in ordem.columns:
+        ordem['SEQ'] = np.nan
+    ordem = ordem.sort_values(CHAVES_ARVORE + ['SEQ'], na_position='first', kind='stable')
+    registros = [nos for _, nos in niveis]
+    tree_data.extend(registros[n][pos] for n, pos in zip(ordem['NIVEL'], ordem['POS']))
     return tree_data, ordered_cols
 
+def opcoes_arvore(colunas_mes):
+    """Opções do grid da árvore (colunas, estilos, coluna de hierarquia). colunas_mes: [(campo, cabeçalho)]."""
+    gb = GridOptionsBuilder()
+    cell_style_js = JsCode(""" function(params) { if (params.node.level > 0) { return {backgroundColor: 'rgba(255, 255, 255, 0.05)'}; } return null; } """)
+    for campo, cabecalho in colunas_mes: gb.configure_column(campo, headerName=cabecalho, type=["numericColumn"], valueFormatter="x > 0 ? x.toLocaleString('pt-BR', {style: 'currency', currency: 'BRL'}) : ''", width=130, cellStyle=cell_style_js)
+    gb.configure_column("Total Período", headerName="Total Período (Vendas Brutas)", type=["numericColumn"], valueFormatter="x.toLocaleString('pt-BR', {style: 'currency', currency: 'BRL'})", width=180, cellStyle=cell_style_js, pinned='right')
+    currency_formatter = "x != null && x != 0 ? x.toLocaleString('pt-BR', {style: 'currency', currency: 'BRL'}) : ''"
+    gb.configure_column("VENDAS_BRUTAS", headerName="Vendas/C.Devolução", type=["numericColumn"], valueFormatter=currency_formatter, width=180)
+    gb.configure_column("TOTAL_DEVOLVIDO", headerName="Total Devolvido", type=["numericColumn"], valueFormatter=currency_formatter, width=150)
+    gb.configure_column("VENDAS_LIQUIDAS", headerName="Vendas/S.Devolução", type=["numericColumn"], valueFormatter=currency_formatter, width=180)
+    gb.configure_column("TOTAL_PEDIDOS", headerName="Nº Pedidos", type=["numericColumn"], width=120)
+    gb.configure_column("POSITIVACAO", headerName="Positivação (Clientes)", type=["numericColumn"], width=180)
+
+    # Colunas que agora terão dados nos níveis mais baixos
+    gb.configure_column("TIPO", headerName="Tipo", width=110)
+    gb.configure_column("NUMPED", headerName="Nº Pedido", width=120)
+    gb.configure_column("CLIENTE", headerName="Cliente", width=250)
+    gb.configure_column("QT", headerName="Qtd.", width=80)
+    gb.configure_column("PVENDA", headerName="Preço Venda", type=["numericColumn"], valueFormatter="x != null && x != 0 ? x.toLocaleString('pt-BR', {style: 'currency', currency: 'BRL'}) : ''", width=130)
+
+    gb.configure_column('dataPath', hide=True); gb.configure_column('ENTIDADE', hide=True)
+    grid_options = gb.build()
+    grid_options['getRowStyle'] = JsCode(""" function(params) { switch (params.node.level) { case 1: return { 'background-color': 'rgba(255, 255, 255, 0.04)' }; case 2: return { 'background-color': 'rgba(255, 255, 255, 0.07)' }; case 3: return { 'background-color': 'rgba(255, 255, 255, 0.1)' }; case 4: return { 'background-color': 'rgba(255, 255, 255, 0.13)' }; case 5: return { 'background-color': 'rgba(255, 255, 255, 0.16)' }; default: return null; }} """)
+    grid_options['treeData'] = True; grid_options['animateRows'] = True
+    grid_options['groupDefaultExpanded'] = 0
+    grid_options['autoGroupColumnDef'] = { "headerName": "Hierarquia", "minWidth": 400, "pinned": "left", "cellRendererParams": { "suppressCount": True }, "valueGetter": "data.ENTIDADE" }
+    return grid_options
+
+def exibir_arvore_servidor(data_inicial, data_final, fornecedores):
+    """
+    Árvore com row model 'serverSide': abre só com os fornecedores e pede os filhos de cada nó ao endpoint
+    (/arvore_fornecedor, arvore_fornecedor.py) quando ele é expandido.
+    """
+    colunas_mes = [(mes, pd.Timestamp(mes).strftime('%b/%y')) for mes in meses_periodo(data_inicial, data_final)]
+    grid_options = opcoes_arvore(colunas_mes)
+    filtro = json.dumps({'inicio': data_inicial.strftime('%Y-%m-%d'), 'fim': data_final.strftime('%Y-%m-%d'), 'fornecedores': list(fornecedores)})
+    grid_options['rowModelType'] = 'serverSide'
+    grid_options['cacheBlockSize'] = TAMANHO_BLOCO
+    grid_options['isServerSideGroup'] = JsCode("function(data) { return data.group; }")
+    grid_options['getServerSideGroupKey'] = JsCode("function(data) { return data.CHAVE; }")
+    # Token do login no cabeçalho (acesso.py) e corpo como text/plain, como no grade_servidor
+    grid_options['serverSideDatasource'] = JsCode(f"""{{
+        getRows: function(params) {{
+            var pedido = Object.assign({filtro}, {{groupKeys: params.request.groupKeys, startRow: params.request.startRow, endRow: params.request.endRow}});
+            fetch({base_url_js()} + '/arvore_fornecedor', {{method: 'POST', headers: {cabecalhos_js({'Content-Type': 'text/plain'})}, body: JSON.stringify(pedido)}})
+                .then(function(r) {{ if (!r.ok) {{ throw new Error(r.status); }} return r.json(); }})
+                .then(function(res) {{
+                    if (params.success) {{ params.success({{rowData: res.linhas, rowCount: res.total}}); }}
+                    else {{ params.successCallback(res.linhas, res.total); }}
+                }})
+                .catch(function() {{ params.fail(); }});
+        }}
+    }}""")
+    colunas = [definicao['field'] for definicao in grid_options['columnDefs']]
+    # A chave muda com o filtro: o grid é recriado com a nova fonte de dados
+    chave = hashlib.md5(filtro.encode()).hexdigest()[:12]
+    AgGrid(pd.DataFrame(columns=colunas), gridOptions=grid_options, height=700, width='100%', theme='streamlit',
+           allow_unsafe_jscode=True, enable_enterprise_modules=True, key=f'fornecedor_tree_grid_{chave}')
+
+def fetch_resumo_fornecedor_mes(data_inicial, data_final):
+    """
+    Venda e devolução por fornecedor e mês, agregadas no motor analítico (DuckDB ou SQLite).
+    Os gráficos só precisam desses totais; não carregam mais as linhas do ano inteiro.
+    """
+    df = obter(('fornecedor_mes', data_inicial, data_final), ('pcvendedor2',),
+               lambda: agregar_resumo_fornecedor_mes(data_inicial, data_final), db_dir=os.path.dirname(DB_FILE))
+    return pd.DataFrame() if df is None else df
+
+def agregar_resumo_fornecedor_mes(data_inicial, data_final):
+    try:
+        df = agregar('fornecedor_mes', (dia(data_inicial), dia(data_final + timedelta(days=1))))
+        for col in ['VALOR_TRANSACAO', 'VALOR_DEVOLUCAO']:
+            df[col] = pd.to_numeric(df[col], errors='coerce').fillna(0)
+        return df
+    except Exception as e:
+        logging.error(f"Erro ao agregar vendas por fornecedor: {e}")
+        st.error(f"Erro ao buscar dados dos gráficos: {e}")
+        return None
+
+def filtrar_periodo_grafico(df: pd.DataFrame, periodo, today):
+    """Meses ('YYYY-MM') do resumo que entram no período escolhido no gráfico."""
+    if periodo == 'Ano':
+        return df[df['ANO_MES'].str.startswith(f"{today.year:04d}-")]
+    if periodo == 'Mês Atual':
+        return df[df['ANO_MES'] == today.strftime('%Y-%m')]
+    # Últimos 3 Meses
+    start_date_chart = (today - relativedelta(months=2)).replace(day=1)
+    return df[df['ANO_MES'] >= start_date_chart.strftime('%Y-%m')]
+
 def display_charts(df: pd.DataFrame):
-    """Exibe gráficos baseados no DataFrame completo do período selecionado."""
+    """Exibe gráficos a partir do resumo por fornecedor e mês (fetch_resumo_fornecedor_mes)."""
     st.header("Análise Gráfica", divider="rainbow")
     if df.empty: st.warning("Não há dados para gerar gráficos."); return
     
@@ -211,14 +322,7 @@ def display_charts(df: pd.DataFrame):
         st.subheader("Top Fornecedores por Venda Líquida")
         periodo = st.radio("Período do Gráfico:", ('Ano', 'Mês Atual', 'Últimos 3 Meses'), horizontal=True, key="periodo_grafico_vendas", index=1)
         
-        today = datetime.now().date()
-        if periodo == 'Ano':
-            df_chart = df[df['DATA'].dt.year == today.year]
-        elif periodo == 'Mês Atual':
-            df_chart = df[(df['DATA'].dt.year == today.year) & (df['DATA'].dt.month == today.month)]
-        else: # Últimos 3 Meses
-            start_date_chart = (today - relativedelta(months=2)).replace(day=1)
-            df_chart = df[df['DATA'].dt.date >= start_date_chart]
+        df_chart = filtrar_periodo_grafico(df, periodo, datetime.now().date())
 
         if not df_chart.empty:
             top_fornecedores = df_chart.groupby('FORNECEDOR')['VALOR_TRANSACAO'].sum().nlargest(10).sort_values()
@@ -229,14 +333,7 @@ def display_charts(df: pd.DataFrame):
         st.subheader("Top 10 Fornecedores por Devolução")
         periodo_dev = st.radio("Período do Gráfico:", ('Ano', 'Mês Atual', 'Últimos 3 Meses'), horizontal=True, key="periodo_grafico_dev", index=1)
         
-        today_dev = datetime.now().date()
-        if periodo_dev == 'Ano':
-            df_chart_dev = df[df['DATA'].dt.year == today_dev.year]
-        elif periodo_dev == 'Mês Atual':
-            df_chart_dev = df[(df['DATA'].dt.year == today_dev.year) & (df['DATA'].dt.month == today_dev.month)]
-        else: # Últimos 3 Meses
-            start_date_chart_dev = (today_dev - relativedelta(months=2)).replace(day=1)
-            df_chart_dev = df[df['DATA'].dt.date >= start_date_chart_dev]
+        df_chart_dev = filtrar_periodo_grafico(df, periodo_dev, datetime.now().date())
         
         top_devolucoes = df_chart_dev[df_chart_dev['VALOR_DEVOLUCAO'] > 0].groupby('FORNECEDOR')['VALOR_DEVOLUCAO'].sum().nlargest(10).sort_values()
         if not top_devolucoes.empty:
@@ -253,10 +350,10 @@ def main():
     today = datetime.now()
     
     # --- NOVO: Carregamento de dados para os GRÁFICOS ---
-    # Carrega os dados do ano inteiro para ter uma base consistente para os gráficos.
+    # Resumo do ano inteiro (fornecedor x mês) para ter uma base consistente para os gráficos.
     # Isso independe dos filtros de data que o usuário selecionar abaixo.
     start_of_year_for_charts = today.replace(month=1, day=1)
-    df_vendas_graficos, _ = fetch_vendas_data(start_of_year_for_charts, today)
+    df_vendas_graficos = fetch_resumo_fornecedor_mes(start_of_year_for_charts.date(), today.date())
     
     # --- NÍVEL 1: FILTROS PRINCIPAIS (COM LAYOUT AJUSTADO) ---
     col1, col2, col3, col4 = st.columns([1, 1, 2, 1])
@@ -273,7 +370,11 @@ def main():
     data_final = datetime.combine(data_final, datetime.min.time())
 
     # MODIFICADO: Busca os dados especificamente para a TABELA usando os filtros de data.
-    df_vendas_tabela, last_update_time = fetch_vendas_data(data_inicial, data_final)
+    # Árvore sob demanda: a página só lista os fornecedores; os nós vêm do endpoint quando são expandidos.
+    if ARVORE_FORNECEDOR == 'servidor':
+        df_vendas_tabela, last_update_time = fetch_fornecedores_periodo(data_inicial, data_final)
+    else:
+        df_vendas_tabela, last_update_time = fetch_vendas_data(data_inicial, data_final)
 
     with col4:
         st.markdown("<div style='text-align: right;'>&nbsp;</div>", unsafe_allow_html=True)
@@ -294,38 +395,17 @@ def main():
     st.header("Análise Detalhada", divider="rainbow")
     
     # MODIFICADO: Garante que a tabela use os dados filtrados por data.
-    if not df_vendas_tabela.empty:
-        df_para_tabela = df_vendas_tabela[df_vendas_tabela['FORNECEDOR'].isin(fornecedores_selecionados)] if fornecedores_selecionados else df_vendas_tabela
+    if not df_vendas_tabela.empty and ARVORE_FORNECEDOR == 'servidor':
+        exibir_arvore_servidor(data_inicial, data_final, fornecedores_selecionados)
+    elif not df_vendas_tabela.empty:
+        df_para_tabela = derivar(df_vendas_tabela[df_vendas_tabela['FORNECEDOR'].isin(fornecedores_selecionados)], df_vendas_tabela, 'fornecedores', tuple(fornecedores_selecionados)) if fornecedores_selecionados else df_vendas_tabela
         tree_data, dynamic_month_cols = prepare_tree_data(df_para_tabela, data_inicial, data_final, show_transactions=True)
         
         if not tree_data: 
             st.warning("Nenhum dado para exibir na tabela com os filtros atuais.")
         else:
-            gb = GridOptionsBuilder()
-            cell_style_js = JsCode(""" function(params) { if (params.node.level > 0) { return {backgroundColor: 'rgba(255, 255, 255, 0.05)'}; } return null; } """)
-            for mes_ano in dynamic_month_cols: gb.configure_column(mes_ano, headerName=mes_ano, type=["numericColumn"], valueFormatter="x > 0 ? x.toLocaleString('pt-BR', {style: 'currency', currency: 'BRL'}) : ''", width=130, cellStyle=cell_style_js)
-            gb.configure_column("Total Período", headerName="Total Período (Vendas Brutas)", type=["numericColumn"], valueFormatter="x.toLocaleString('pt-BR', {style: 'currency', currency: 'BRL'})", width=180, cellStyle=cell_style_js, pinned='right')
-            currency_formatter = "x != null && x != 0 ? x.toLocaleString('pt-BR', {style: 'currency', currency: 'BRL'}) : ''"
-            gb.configure_column("VENDAS_BRUTAS", headerName="Vendas/C.Devolução", type=["numericColumn"], valueFormatter=currency_formatter, width=180)
-            gb.configure_column("TOTAL_DEVOLVIDO", headerName="Total Devolvido", type=["numericColumn"], valueFormatter=currency_formatter, width=150)
-            gb.configure_column("VENDAS_LIQUIDAS", headerName="Vendas/S.Devolução", type=["numericColumn"], valueFormatter=currency_formatter, width=180)
-            gb.configure_column("TOTAL_PEDIDOS", headerName="Nº Pedidos", type=["numericColumn"], width=120)
-            gb.configure_column("POSITIVACAO", headerName="Positivação (Clientes)", type=["numericColumn"], width=180)
-            
-            # Colunas que agora terão dados nos níveis mais baixos
-            gb.configure_column("TIPO", headerName="Tipo", width=110)
-            gb.configure_column("NUMPED", headerName="Nº Pedido", width=120)
-            gb.configure_column("CLIENTE", headerName="Cliente", width=250)
-            gb.configure_column("QT", headerName="Qtd.", width=80)
-            gb.configure_column("PVENDA", headerName="Preço Venda", type=["numericColumn"], valueFormatter="x != null && x != 0 ? x.toLocaleString('pt-BR', {style: 'currency', currency: 'BRL'}) : ''", width=130)
-            
-            gb.configure_column('dataPath', hide=True); gb.configure_column('ENTIDADE', hide=True)
-            grid_options = gb.build()
-            grid_options['getRowStyle'] = JsCode(""" function(params) { switch (params.node.level) { case 1: return { 'background-color': 'rgba(255, 255, 255, 0.04)' }; case 2: return { 'background-color': 'rgba(255, 255, 255, 0.07)' }; case 3: return { 'background-color': 'rgba(255, 255, 255, 0.1)' }; case 4: return { 'background-color': 'rgba(255, 255, 255, 0.13)' }; case 5: return { 'background-color': 'rgba(255, 255, 255, 0.16)' }; default: return null; }} """)
-            grid_options['treeData'] = True; grid_options['animateRows'] = True
+            grid_options = opcoes_arvore([(mes_ano, mes_ano) for mes_ano in dynamic_month_cols])
             grid_options['getDataPath'] = JsCode("function(data) { return data.dataPath; }")
-            grid_options['groupDefaultExpanded'] = 0
-            grid_options['autoGroupColumnDef'] = { "headerName": "Hierarquia", "minWidth": 400, "pinned": "left", "cellRendererParams": { "suppressCount": True }, "valueGetter": "data.ENTIDADE" }
             AgGrid(pd.DataFrame(tree_data), gridOptions=grid_options, height=700, width='100%', theme='streamlit', allow_unsafe_jscode=True, enable_enterprise_modules=True, key='fornecedor_tree_grid')
 
     # --- NÍVEL 3: ANÁLISE GRÁFICA ---
@@ -6,7 +6,10 @@ import sqlite3
 import logging
 from dateutil.relativedelta import relativedelta
 from streamlit_autorefresh import st_autorefresh
-from st_aggrid import AgGrid, GridOptionsBuilder, JsCode
+from st_aggrid import GridOptionsBuilder, JsCode
+from banco_local import CONSULTAS
+from grade_servidor import exibir_grade
+from registro_consultas import conectar
 
 # Configuração de logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -25,7 +28,7 @@ DB_PATH = "database\\"  # Ajuste para o caminho real da pasta 'database' com bar
 def get_sqlite_connection(db_file):
     """Estabelece conexão com o banco SQLite."""
     try:
-        connection = sqlite3.connect(f"{DB_PATH}{db_file}")
+        connection = conectar(f"{DB_PATH}{db_file}")
         logger.info(f"Conexão com {db_file} estabelecida com sucesso")
         return connection
     except sqlite3.Error as e:
@@ -35,16 +38,7 @@ def get_sqlite_connection(db_file):
 
 def fetch_pcmovendpend_data(data_inicial, data_final):
     """Busca dados de pcmovendpend diretamente do banco SQLite (pcmovendpend.db)."""
-    pcmovendpend_sql = """
-        SELECT 
-            DTINICIOOS,
-            DTFIMOS,
-            CONFERENTE,
-            STATUS
-        FROM pcmovendpend
-        WHERE DATE(DATA) BETWEEN ? AND ?
-        ORDER BY DTFIMOS
-    """
+    pcmovendpend_sql = CONSULTAS['pedidos_separacao']['sql']
     
     connection = get_sqlite_connection("pcmovendpend.db")
     if connection is None:
@@ -77,23 +71,7 @@ def fetch_pcmovendpend_data(data_inicial, data_final):
 
 def fetch_pending_orders_data():
     """Busca todos os dados de pedidos pendentes e em conferência com QTDITENS."""
-    detailed_sql = """
-        SELECT 
-            NUMPED,
-            NUMCAR,
-            TOTVOL,
-            NUMTRANSWMS,
-            CODCLIENTE,
-            CLIENTE,
-            DTINICIOOS,
-            DTFIMOS,
-            CONFERENTE,
-            STATUS,
-            ROTA,
-            QTDITENS
-        FROM PCMOVENDPEND
-        WHERE STATUS IN ('NÃO INICIADO', 'EM CONFERÊNCIA')
-    """
+    detailed_sql = CONSULTAS['pedidos_pendentes']['sql']
     
     connection = get_sqlite_connection("pcmovendpend.db")
     if connection is None:
@@ -126,18 +104,7 @@ def fetch_pending_orders_data():
 
 def fetch_pcpedc_data(data_inicial, data_final):
     """Busca dados de pcpedc diretamente do banco SQLite (pcpedc_posicao.db)."""
-    pcpedc_sql = """
-        SELECT 
-            ROTA,
-            DATA,
-            L_COUNT,
-            M_COUNT,
-            F_COUNT,
-            DESCRICAO
-        FROM pcpedc_posicao
-        WHERE DATE(DATA) BETWEEN ? AND ?
-        ORDER BY DATA
-    """
+    pcpedc_sql = CONSULTAS['pedidos_posicao']['sql']
     
     connection = get_sqlite_connection("pcpedc_posicao.db")
     if connection is None:
@@ -202,7 +169,11 @@ def clear_weekly_data():
         if connection:
             try:
                 cursor = connection.cursor()
-                cursor.execute("DELETE FROM PCMOVENDPEND WHERE STATUS = 'CONCLUÍDA' AND DATE(DTFIMOS) < ?", (date.today() - timedelta(days=7),))
+                # pcmovendpend é uma VIEW; os dados ficam em fato_pcmovendpend com DTFIMOS como número do dia
+                cursor.execute(
+                    "DELETE FROM fato_pcmovendpend WHERE STATUS = 'CONCLUÍDA' AND DTFIMOS < CAST(julianday(?) - 2440587.5 AS INTEGER)",
+                    ((date.today() - timedelta(days=7)).strftime('%Y-%m-%d'),)
+                )
                 connection.commit()
                 logger.info("Dados da semana anterior limpos com sucesso.")
             except sqlite3.Error as e:
@@ -681,7 +652,8 @@ def main():
 
 
             st.markdown('<div class="scrollable-table">', unsafe_allow_html=True)
-            AgGrid(pending_data_renamed, grid_options, height=500, width=1005, theme='custom-dark', allow_unsafe_jscode=True)
+            # Blocos de linhas pedidos ao endpoint.py (grade_servidor.py) em vez do DataFrame inteiro no navegador
+            exibir_grade(pending_data_renamed, 'pedidos_conferencia', grid_options, db_dir=DB_PATH, height=500, width=1005, theme='custom-dark')
             st.markdown('</div>', unsafe_allow_html=True)
 
     else:
@@ -1,11 +1,16 @@
 import streamlit as st
 import pandas as pd
 import sqlite3
-from datetime import datetime, date, timedelta
+from datetime import datetime, date
 import locale
+import calendar
 import io
-from st_aggrid import AgGrid, GridOptionsBuilder, GridUpdateMode
+from st_aggrid import GridOptionsBuilder, GridUpdateMode
 from streamlit_autorefresh import st_autorefresh
+from banco_local import CONSULTAS, conectar_historico, versao_tabela
+from cache_dados import obter
+from grade_servidor import exibir_grade
+from motor_analitico import agregar, dia
 
 # Função principal
 def main():
@@ -20,23 +25,18 @@ def main():
     if 'last_refresh' not in st.session_state:
         st.session_state.last_refresh = datetime.now()
 
-    # Forçar atualização se o intervalo passou
-    if (datetime.now() - st.session_state.last_refresh).total_seconds() >= 300:
-        st.session_state.cached_data = None
-        st.session_state.cached_range = (None, None)
+    # Versão do pcvendedor no sync_state: os dados em cache_dados são relidos só quando ela muda
+    versao = versao_tabela('pcvendedor')
+    if st.session_state.get('versao_dados') != versao:
+        st.session_state.versao_dados = versao
         st.session_state.last_refresh = datetime.now()
 
-    # Auto-refresh
+    # Auto-refresh: só confere a versão; os dados são relidos apenas se ela mudou
     st_autorefresh(interval=300000, key="data_refresh")
-    next_refresh = st.session_state.last_refresh + timedelta(seconds=300)
-    st.write(f"Próxima atualização em: {next_refresh.strftime('%H:%M:%S')}")
+    st.write(f"Dados carregados em: {st.session_state.last_refresh.strftime('%H:%M:%S')}")
 
-    # Botão de atualização manual
-    if st.button("Atualizar Dados"):
-        st.session_state["force_refresh"] = True
-        st.session_state.cached_data = None
-        st.session_state.cached_range = (None, None)
-        st.session_state.last_refresh = datetime.now()
+    # Botão de atualização manual (reexecuta a página; o cache já acompanha a versão da tabela)
+    st.button("Atualizar Dados")
 
     # Título
     st.title("Relatório de Vendas e Positivação por Vendedor")
@@ -86,49 +86,28 @@ def main():
 
     # Função para buscar dados do banco
     def fetch_data(data_inicial, data_final):
-        db_path = "database/pcvendedor.db"
         conn = None
         try:
-            conn = sqlite3.connect(db_path)
-            query = """
-                SELECT 
-                    DATAPEDIDO, VALOR, QUANTIDADE, CODIGOVENDA, CODFORNECEDOR, CODPRODUTO, 
-                    CUSTOPRODUTO, PEDIDO, CODUSUR, VENDEDOR, CODCLIENTE, ROTA,
-                    FORNECEDOR, CLIENTE, FANTASIA, RAMO, SUPERVISOR, PRODUTO
-                FROM pcvendedor
-                WHERE DATE(DATAPEDIDO) BETWEEN ? AND ?
-                ORDER BY DATAPEDIDO
-            """
+            # Meses congelados do período entram pela camada fria (banco_local.conectar_historico)
+            conn = conectar_historico('pcvendedor', data_inicial, data_final)
+            query = CONSULTAS['positivacao_vendas']['sql']
             df = pd.read_sql_query(query, conn, params=(data_inicial.strftime("%Y-%m-%d"), data_final.strftime("%Y-%m-%d")))
             if df.empty:
                 st.warning("Nenhum dado encontrado no banco pcvendedor.db para o período selecionado.")
-            df['DATAPEDIDO'] = pd.to_datetime(df['DATAPEDIDO']).dt.date
+            df['DATAPEDIDO'] = pd.to_datetime(df['DATAPEDIDO'])
             return df
         except sqlite3.Error as e:
             st.error(f"Erro ao conectar ao banco pcvendedor.db: {e}")
-            return pd.DataFrame()
+            return None
         finally:
             if conn:
                 conn.close()
 
-    # Função para obter dados (com cache)
+    # Função para obter dados (cache compartilhado entre as sessões, cache_dados)
     def get_data(data_inicial, data_final):
-        force_refresh = st.session_state.get("force_refresh", False)
-        
-        if not force_refresh and 'cached_data' in st.session_state and st.session_state.cached_data is not None:
-            if (st.session_state.cached_range[0] <= data_inicial and
-                st.session_state.cached_range[1] >= data_final):
-                df = st.session_state.cached_data
-                return df[(df['DATAPEDIDO'] >= pd.to_datetime(data_inicial)) & 
-                         (df['DATAPEDIDO'] <= pd.to_datetime(data_final))]
-        
-        df = fetch_data(data_inicial, data_final)
-        if not df.empty:
-            df['DATAPEDIDO'] = pd.to_datetime(df['DATAPEDIDO'])
-            st.session_state.cached_data = df
-            st.session_state.cached_range = (data_inicial, data_final)
-        st.session_state["force_refresh"] = False
-        return df
+        df = obter(('positivacao_vendas', data_inicial, data_final), ('pcvendedor',),
+                   lambda: fetch_data(data_inicial, data_final))
+        return pd.DataFrame() if df is None else df
 
     # Processar dados para o relatório de resumo
     def process_summary_data(df, data_inicial, data_final):
@@ -330,36 +309,33 @@ def main():
         result_df.sort_values(['DATAPEDIDO', 'VENDEDOR', 'PEDIDO'], inplace=True)
         
         return result_df
-    # Processar dados para resumo por ano/mês
-    def process_year_month_summary(df, selected_year, selected_month):
-        if df.empty:
-            st.warning("Nenhum dado retornado para o período selecionado (Ano/Mês).")
+    # Meses com venda desde a data informada (agregado no motor analítico, sem carregar as linhas)
+    def fetch_available_months(data_inicial):
+        try:
+            meses = agregar('positivacao_meses', (dia(data_inicial),), intervalo=(data_inicial, None))
+            return sorted(int(m) for m in meses['MES'].dropna())
+        except Exception as e:
+            st.error(f"Erro ao buscar os meses disponíveis: {e}")
+            return []
+
+    # Faturamento e custo por vendedor/cliente no mês, agregados no motor analítico (DuckDB ou SQLite)
+    def fetch_year_month_summary(selected_year, selected_month):
+        inicio = date(selected_year, selected_month, 1)
+        fim = date(selected_year, selected_month, calendar.monthrange(selected_year, selected_month)[1])
+        try:
+            return agregar('positivacao_resumo_cliente', (dia(inicio), dia(fim), dia(inicio), dia(fim)), intervalo=(inicio, fim))
+        except Exception as e:
+            st.error(f"Erro ao agregar o resumo por ano/mês: {e}")
             return pd.DataFrame()
-        
-        required_columns = ['DATAPEDIDO', 'VALOR', 'QUANTIDADE', 'CUSTOPRODUTO', 'CODIGOVENDA', 
-                           'CODCLIENTE', 'VENDEDOR', 'CODUSUR', 'CLIENTE', 'FANTASIA', 'RAMO', 'PEDIDO']
-        missing_columns = [col for col in required_columns if col not in df.columns]
-        if missing_columns:
+
+    # Processar dados para resumo por ano/mês (summary já vem agregado por fetch_year_month_summary)
+    def process_year_month_summary(summary):
+        if summary.empty:
+            st.warning("Nenhum dado retornado para o período selecionado (Ano/Mês).")
             return pd.DataFrame()
         
-        df = df[(df['DATAPEDIDO'].dt.year == selected_year) & (df['DATAPEDIDO'].dt.month == selected_month)]
-        
-        df['VALOR'] = pd.to_numeric(df['VALOR'], errors='coerce').fillna(0)
-        df['QUANTIDADE'] = pd.to_numeric(df['QUANTIDADE'], errors='coerce').fillna(0)
-        df['CUSTOPRODUTO'] = pd.to_numeric(df['CUSTOPRODUTO'], errors='coerce').fillna(0)
-        df['CODIGOVENDA'] = pd.to_numeric(df['CODIGOVENDA'], errors='coerce').fillna(1)
-        df['CODCLIENTE'] = pd.to_numeric(df['CODCLIENTE'], errors='coerce').fillna(0)
-        
-        bonified_pedidos = df[df['CODIGOVENDA'] != 1]['PEDIDO'].unique()
-        df_non_bonific = df[~df['PEDIDO'].isin(bonified_pedidos)]
-        
-        df_non_bonific['FATURAMENTO_CLIENTE'] = df_non_bonific['VALOR'] * df_non_bonific['QUANTIDADE']
-        df_non_bonific['CUSTO_MERCADORIA'] = df_non_bonific['CUSTOPRODUTO'] * df_non_bonific['QUANTIDADE']
-        
-        summary = df_non_bonific.groupby(['CODUSUR', 'VENDEDOR', 'CODCLIENTE', 'CLIENTE', 'FANTASIA', 'RAMO']).agg({
-            'FATURAMENTO_CLIENTE': 'sum',
-            'CUSTO_MERCADORIA': 'sum'
-        }).reset_index()
+        summary['FATURAMENTO_CLIENTE'] = pd.to_numeric(summary['FATURAMENTO_CLIENTE'], errors='coerce').fillna(0)
+        summary['CUSTO_MERCADORIA'] = pd.to_numeric(summary['CUSTO_MERCADORIA'], errors='coerce').fillna(0)
         
         summary['CONT_MARG'] = summary['FATURAMENTO_CLIENTE'] - summary['CUSTO_MERCADORIA']
         summary['MARGEM'] = (summary['CONT_MARG'] / summary['FATURAMENTO_CLIENTE'] * 100).round(2)
@@ -445,13 +421,13 @@ def main():
                 
                 grid_options = gb.build()
                 
-                AgGrid(
+                exibir_grade(
                     result_df,
-                    gridOptions=grid_options,
+                    'positivacao_resumo',
+                    grid_options,
                     height=400,
                     fit_columns_on_grid_load=False,
-                    update_mode=GridUpdateMode.NO_UPDATE,
-                    allow_unsafe_jscode=True
+                    update_mode=GridUpdateMode.NO_UPDATE
                 )
                 
                 output = io.BytesIO()
@@ -523,13 +499,13 @@ def main():
                 
                 grid_options = gb.build()
                 
-                AgGrid(
+                exibir_grade(
                     detailed_df,
-                    gridOptions=grid_options,
+                    'positivacao_detalhes',
+                    grid_options,
                     height=500,
                     fit_columns_on_grid_load=False,
-                    update_mode=GridUpdateMode.NO_UPDATE,
-                    allow_unsafe_jscode=True
+                    update_mode=GridUpdateMode.NO_UPDATE
                 )
                 
                 output = io.BytesIO()
@@ -549,15 +525,12 @@ def main():
         st.subheader("Resumo por Ano e Mês")
         
         year_month_start = date(2024, 1, 1)
-        year_month_end = date.today()
         
         with st.spinner("Carregando dados para resumo por ano/mês..."):
-            df = get_data(year_month_start, year_month_end)
+            available_months = fetch_available_months(year_month_start)
         
-        if not df.empty:
-            df['DATAPEDIDO'] = pd.to_datetime(df['DATAPEDIDO'])
+        if available_months:
             available_years = list(range(2024, date.today().year + 1))
-            available_months = sorted(df['DATAPEDIDO'].dt.month.unique())
             
             current_year = date.today().year
             current_month = date.today().month
@@ -585,7 +558,7 @@ def main():
                 )
             
             with st.spinner("Processando resumo por ano/mês..."):
-                year_month_summary = process_year_month_summary(df, selected_year, selected_month)
+                year_month_summary = process_year_month_summary(fetch_year_month_summary(selected_year, selected_month))
                 if not year_month_summary.empty:
                     st.session_state.year_month_summaries.append({
                         'year': selected_year,
@@ -616,13 +589,13 @@ def main():
                 
                 grid_options = gb.build()
                 
-                AgGrid(
+                exibir_grade(
                     year_month_summary,
-                    gridOptions=grid_options,
+                    'positivacao_ano_mes',
+                    grid_options,
                     height=400,
                     fit_columns_on_grid_load=False,
-                    update_mode=GridUpdateMode.NO_UPDATE,
-                    allow_unsafe_jscode=True
+                    update_mode=GridUpdateMode.NO_UPDATE
                 )
                 
                 output = io.BytesIO()
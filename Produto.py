@@ -5,6 +5,10 @@ import sqlite3
 from datetime import datetime, date, timedelta
 import calendar
 from streamlit_autorefresh import st_autorefresh
+from banco_local import CONSULTAS
+from busca_produtos import buscar_codprods
+from cache_dados import obter
+from registro_consultas import conectar
 
 # Configuration
 DB_PATH = "database\\vwsomelier.db"
@@ -12,22 +16,40 @@ DB_PATH = "database\\vwsomelier.db"
 def get_db_connection():
     """Return a connection to the SQLite database."""
     try:
-        conn = sqlite3.connect(DB_PATH)
+        conn = conectar(DB_PATH)
         return conn
     except sqlite3.Error as e:
         st.error(f"Erro ao conectar ao banco de dados: {e}")
         return None
 
-def carregar_dados():
-    """Load data directly from the SQLite database."""
+def carregar_dados(periodo_inicio, periodo_fim):
+    """
+    Load sales between the two dates (inclusive) from monthly partitions.
+    Each month is read once per vwsomelier version and kept in the shared cache (cache_dados),
+    so overlapping ranges and the two date pickers reuse the months already loaded.
+    """
+    partes = []
+    for mes in pd.period_range(pd.to_datetime(periodo_inicio), pd.to_datetime(periodo_fim), freq='M'):
+        df_mes = obter(('produto_vendas_mes', str(mes)), ('vwsomelier',), lambda mes=mes: ler_mes(mes))
+        if df_mes is None:
+            return pd.DataFrame()
+        partes.append(df_mes)
+    partes = [p for p in partes if not p.empty]
+    if not partes:
+        return pd.DataFrame()
+    df = pd.concat(partes, ignore_index=True)
+    return df[(df['Data do Pedido'] >= pd.to_datetime(periodo_inicio)) & (df['Data do Pedido'] <= pd.to_datetime(periodo_fim))]
+
+def ler_mes(mes):
+    """Load and prepare one month (pd.Period) from SQLite, filtered by DATA_DIA on idx_vwsomelier_data (None on error)."""
     conn = get_db_connection()
     if conn is None:
-        return pd.DataFrame()
+        return None
     
     try:
-        df = pd.read_sql(f"SELECT DESCRICAO_1, CODPROD, DATA, QT, PVENDA, VLCUSTOFIN,CONDVENDA,NUMPED,CODOPER, DTCANCEL FROM vwsomelier", conn)
+        params = (mes.start_time.strftime('%Y-%m-%d'), mes.end_time.strftime('%Y-%m-%d'))
+        df = pd.read_sql(CONSULTAS['produto_vendas_periodo']['sql'], conn, params=params)
         if df.empty:
-            st.warning("Nenhum dado encontrado no banco de dados.")
             return pd.DataFrame()
 
         # Process data
@@ -49,7 +71,7 @@ def carregar_dados():
         return df
     except sqlite3.Error as e:
         st.error(f"Erro ao carregar dados do banco de dados: {e}")
-        return pd.DataFrame()
+        return None
     finally:
         if conn:
             conn.close()
@@ -123,12 +145,6 @@ def main():
     st.write(f"Próxima atualização em: {next_refresh.strftime('%H:%M:%S')}")
 
 
-    df = carregar_dados()
-
-    if df.empty:
-        st.error("Nenhum dado carregado. Verifique se o banco de dados contém dados.")
-        return
-
     hoje = datetime.now()
     primeiro_dia_mes = hoje.replace(day=1)
     ultimo_dia_mes = hoje.replace(day=calendar.monthrange(hoje.year, hoje.month)[1])
@@ -136,34 +152,30 @@ def main():
     st.markdown("""<style> .stTextInput>div>div>input { border: 2px solid #4CAF50; border-radius: 10px; padding: 10px; font-size: 16px; background-color: #1a1a1a; } </style>""", unsafe_allow_html=True)
     produto_pesquisa = st.text_input('🔍 Pesquise por um produto ou código', '', key='search_input')
 
-    if 'Data do Pedido' in df.columns:
-        with st.container():
-            st.subheader("Tabela de Resumo")
-            col1, col2 = st.columns(2)
-            with col1:
-                periodo_inicio_tabela = st.date_input('Data de Início - Tabela', value=primeiro_dia_mes)
-            with col2:
-                periodo_fim_tabela = st.date_input('Data de Fim - Tabela', value=ultimo_dia_mes)
-        
-        df_filtrado = df.dropna(subset=['Data do Pedido'])
-        df_filtrado['Data do Pedido'] = pd.to_datetime(df_filtrado['Data do Pedido'], errors='coerce')
-        if df_filtrado['Data do Pedido'].isnull().any():
-            st.warning("Valores inválidos persistiram na coluna 'Data do Pedido' após filtragem.")
-            invalid_dates = df_filtrado[df_filtrado['Data do Pedido'].isnull()]['DATA'].unique()
-            st.write("Valores inválidos encontrados em 'DATA':", invalid_dates)
-            df_filtrado = df_filtrado.dropna(subset=['Data do Pedido'])
-
-        df_filtrado = df_filtrado[(df_filtrado['Data do Pedido'] >= pd.to_datetime(periodo_inicio_tabela)) & 
-                                  (df_filtrado['Data do Pedido'] <= pd.to_datetime(periodo_fim_tabela))]
+    with st.container():
+        st.subheader("Tabela de Resumo")
+        col1, col2 = st.columns(2)
+        with col1:
+            periodo_inicio_tabela = st.date_input('Data de Início - Tabela', value=primeiro_dia_mes)
+        with col2:
+            periodo_fim_tabela = st.date_input('Data de Fim - Tabela', value=ultimo_dia_mes)
 
+    # Only the months of the selected range are read (and only once per table version)
+    df_filtrado = carregar_dados(periodo_inicio_tabela, periodo_fim_tabela)
+    if not df_filtrado.empty:
         if produto_pesquisa:
-            produto_pesquisa = ' '.join(produto_pesquisa.split()).strip()
-            df_filtrado['DESCRICAO_1'] = df_filtrado['DESCRICAO_1'].apply(lambda x: ' '.join(str(x).split()).strip())
-            df_filtrado['CÓDIGO PRODUTO'] = df_filtrado['CÓDIGO PRODUTO'].apply(lambda x: ' '.join(str(x).split()).strip())
-            df_filtrado = df_filtrado[
-                df_filtrado['DESCRICAO_1'].str.contains(produto_pesquisa, case=False, na=False) |
-                df_filtrado['CÓDIGO PRODUTO'].str.contains(produto_pesquisa, case=False, na=False)
-            ]
+            # CODPRODs pelo índice FTS5 mantido pela sincronização (busca_produtos.py)
+            codigos = buscar_codprods(produto_pesquisa)
+            if codigos is not None:
+                df_filtrado = df_filtrado[df_filtrado['CODPROD'].isin(codigos)]
+            else:
+                produto_pesquisa = ' '.join(produto_pesquisa.split()).strip()
+                df_filtrado['DESCRICAO_1'] = df_filtrado['DESCRICAO_1'].apply(lambda x: ' '.join(str(x).split()).strip())
+                df_filtrado['CÓDIGO PRODUTO'] = df_filtrado['CÓDIGO PRODUTO'].apply(lambda x: ' '.join(str(x).split()).strip())
+                df_filtrado = df_filtrado[
+                    df_filtrado['DESCRICAO_1'].str.contains(produto_pesquisa, case=False, na=False) |
+                    df_filtrado['CÓDIGO PRODUTO'].str.contains(produto_pesquisa, case=False, na=False)
+                ]
 
         exibir_tabela(df_filtrado)
 
@@ -174,6 +186,7 @@ def main():
             periodo_inicio_produtos = st.date_input('Data de Início - Top Produtos', value=primeiro_dia_mes)
         with col2:
             periodo_fim_produtos = st.date_input('Data de Fim - Top Produtos', value=ultimo_dia_mes)
+        df = carregar_dados(periodo_inicio_produtos, periodo_fim_produtos)
         exibir_grafico_top_produtos(df, periodo_inicio_produtos, periodo_fim_produtos)
 
 if __name__ == "__main__":
@@ -8,6 +8,9 @@ import os
 import logging
 from dateutil.relativedelta import relativedelta
 from streamlit_autorefresh import st_autorefresh
+from banco_local import CONSULTAS, conectar_historico
+from cache_dados import obter
+from registro_consultas import conectar
 
 # Configuração de logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -22,7 +25,7 @@ DB_PATH = "database/pcpedc.db"
 def test_db_connection():
     """Testa a conexão com o banco SQLite e lista tabelas."""
     try:
-        conn = sqlite3.connect(DB_PATH, check_same_thread=False)
+        conn = conectar(DB_PATH, check_same_thread=False)
         cursor = conn.cursor()
         cursor.execute("SELECT name FROM sqlite_master WHERE type='table';")
         tables = cursor.fetchall()
@@ -43,17 +46,14 @@ def init_db():
     logger.info(f"Banco de dados encontrado em {DB_PATH}")
 
 def fetch_db_data(data_inicial, data_final):
-    """Busca dados da tabela pcpedc no SQLite."""
+    """Busca dados da tabela pcpedc no SQLite (None em caso de erro, para o cache não guardar a falha)."""
     logger.info(f"Buscando dados do SQLite de {data_inicial} a {data_final}")
     try:
-        conn = sqlite3.connect(DB_PATH, check_same_thread=False)
+        # Meses antigos do comparativo vêm da camada fria (banco_local.conectar_historico)
+        conn = conectar_historico('pcpedc', data_inicial, data_final, db_dir=os.path.dirname(DB_PATH), check_same_thread=False)
         data_inicial_str = data_inicial.strftime('%Y-%m-%d')
         data_final_str = data_final.strftime('%Y-%m-%d')
-        query = """
-            SELECT CODPROD, QT_SAIDA, NUMPED, DATA, PVENDA, CONDVENDA, NOME, CODUSUR, CODFILIAL, CODPRACA, CODCLI, NOME_EMITENTE, DEVOLUCAO
-            FROM pcpedc
-            WHERE DATA BETWEEN ? AND ?
-        """
+        query = CONSULTAS['pagina_inicial_pedidos']['sql']
         data = pd.read_sql_query(query, conn, params=(data_inicial_str, data_final_str))
         conn.close()
         
@@ -83,10 +83,10 @@ def fetch_db_data(data_inicial, data_final):
         return data
     except sqlite3.Error as e:
         logger.error(f"Erro ao consultar o SQLite: {e}")
-        return pd.DataFrame()
+        return None
     except Exception as e:
         logger.error(f"Erro inesperado: {e}")
-        return pd.DataFrame()
+        return None
 
 def carregar_dados(data_inicial, data_final):
     """Carrega dados do SQLite, focando no período solicitado."""
@@ -97,7 +97,10 @@ def carregar_dados(data_inicial, data_final):
         st.error("Data final deve ser posterior à data inicial.")
         return pd.DataFrame()
     
-    return fetch_db_data(data_inicial, data_final)
+    # Cache compartilhado entre as sessões (cache_dados), válido até a sincronização mudar o pcpedc
+    df = obter(('pagina_inicial_pedidos', data_inicial, data_final), ('pcpedc',),
+               lambda: fetch_db_data(data_inicial, data_final))
+    return pd.DataFrame() if df is None else df
 
 def calcular_faturamento(data, hoje, ontem, semana_inicial, semana_passada_inicial):
     """Calcula métricas de faturamento considerando horário atual."""
@@ -6,73 +6,68 @@ import locale
 import plotly.express as px
 from st_aggrid import AgGrid, GridOptionsBuilder, GridUpdateMode
 from streamlit_autorefresh import st_autorefresh
+from banco_local import CONSULTAS, conectar_historico
+from cache_dados import obter
 
 locale.setlocale(locale.LC_ALL, 'pt_BR.UTF-8')
 
 # Configuração do caminho para os arquivos .db
 DB_PATH = "database\\"
 
+# Anos do gráfico por vendedor; o histórico lido (camada fria incluída) começa no primeiro deles
+ANOS_GRAFICO = [2024, 2025]
+INICIO_HISTORICO = date(ANOS_GRAFICO[0], 1, 1)
+
 def get_db_connection(db_file):
     """Estabelece conexão com o banco SQLite."""
     try:
-        conn = sqlite3.connect(f"{DB_PATH}{db_file}")
+        # Meses congelados na camada fria desde INICIO_HISTORICO entram junto com os do SQLite
+        conn = conectar_historico(db_file.removesuffix('.db'), INICIO_HISTORICO, db_dir=DB_PATH)
         return conn
     except sqlite3.Error as e:
         st.error(f"Erro ao conectar ao {db_file}: {e}")
         return None
 
 def fetch_pcpedc_data():
-    """Busca dados diretamente do banco SQLite pcpedc.db com a nova query."""
+    """Devoluções do pcpedc pelo cache compartilhado (cache_dados): o SQLite só é lido quando a tabela muda."""
+    df = obter(('vendedores_devolucao',), ('pcpedc',), ler_pcpedc_data)
+    return pd.DataFrame() if df is None else df
+
+def fetch_pcvendedor_data():
+    """Vendas do pcvendedor pelo cache compartilhado (cache_dados)."""
+    df = obter(('vendedores_vendas',), ('pcvendedor',), ler_pcvendedor_data)
+    return pd.DataFrame() if df is None else df
+
+def ler_pcpedc_data():
+    """Busca dados diretamente do banco SQLite pcpedc.db com a nova query (None em caso de erro)."""
     conn = get_db_connection("pcpedc.db")
     if conn is None:
-        return pd.DataFrame()
+        return None
     
     try:
-        query = """
-            SELECT 
-                CODPROD ,
-                QT_SAIDA ,
-                VALOR_DEVOLVIDO ,
-                NUMPED ,
-                DATA ,
-                PVENDA ,
-                CONDVENDA ,
-                NOME ,
-                CODUSUR ,
-                CODFILIAL ,
-                CODPRACA ,
-                CODCLI ,
-                NOME_EMITENTE ,
-                DEVOLUCAO
-            FROM pcpedc 
-            WHERE DEVOLUCAO = 'S'
-        """
+        query = CONSULTAS['vendedores_devolucao']['sql']
         df = pd.read_sql(query, conn)
         return df
     except sqlite3.Error as e:
         st.error(f"Erro ao buscar dados de pcpedc.db: {e}")
-        return pd.DataFrame()
+        return None
     finally:
         if conn:
             conn.close()
 
-def fetch_pcvendedor_data():
-    """Busca dados diretamente do banco SQLite pcvendedor.db."""
+def ler_pcvendedor_data():
+    """Busca dados diretamente do banco SQLite pcvendedor.db (None em caso de erro)."""
     conn = get_db_connection("pcvendedor.db")
     if conn is None:
-        return pd.DataFrame()
+        return None
     
     try:
-        query = """
-            SELECT CODIGOVENDA, SUPERVISOR, CUSTOPRODUTO, CODCIDADE, CODPRODUTO, CODUSUR, VENDEDOR, ROTA, PERIODO, CODCLIENTE, CLIENTE, FANTASIA, DATAPEDIDO, PRODUTO, PEDIDO, FORNECEDOR, QUANTIDADE, BLOQUEADO, VALOR, CODFORNECEDOR, RAMO, ENDERECO, BAIRRO, MUNICIPIO, CIDADE, VLBONIFIC, BONIFIC
-            FROM pcvendedor
-            ORDER BY DATAPEDIDO
-        """
+        query = CONSULTAS['vendedores_vendas']['sql']
         df = pd.read_sql(query, conn)
         return df
     except sqlite3.Error as e:
         st.error(f"Erro ao buscar dados de pcvendedor.db: {e}")
-        return pd.DataFrame()
+        return None
     finally:
         if conn:
             conn.close()
@@ -350,8 +345,8 @@ def main():
         </div>
         """,
         unsafe_allow_html=True)
-    data_inicial = st.date_input("Data Inicial", value=date.today())
-    data_final = st.date_input("Data Final", value=date.today())
+    data_inicial = st.date_input("Data Inicial", value=date.today(), min_value=INICIO_HISTORICO)
+    data_final = st.date_input("Data Final", value=date.today(), min_value=INICIO_HISTORICO)
 
     if data_inicial > data_final:
         st.error("A Data Inicial não pode ser maior que a Data Final.")
@@ -373,7 +368,7 @@ def main():
         vendedor_default = int(vendedor_default)
         vendedores_display = vendedores['NOME'].str.strip().sort_values().reset_index(drop=True)
         vendedor_selecionado = st.selectbox("Selecione um Vendedor", vendedores_display, index=vendedor_default)
-        ano_selecionado = st.selectbox("Selecione um Ano para o Gráfico", [2024, 2025])
+        ano_selecionado = st.selectbox("Selecione um Ano para o Gráfico", ANOS_GRAFICO)
         exibir_grafico_vendas_por_vendedor(data, vendedor_selecionado, ano_selecionado)
     else:
         st.warning("Não há dados para o período selecionado.")
@@ -384,8 +379,8 @@ def main():
 
     # Seletor de data para a seção de vendas por cliente
     st.markdown("### Filtro de Período")
-    vendas_data_inicial = st.date_input("Data Inicial para Vendas", value=date.today(), key="vendas_inicial")
-    vendas_data_final = st.date_input("Data Final para Vendas", value=date.today())
+    vendas_data_inicial = st.date_input("Data Inicial para Vendas", value=date.today(), min_value=INICIO_HISTORICO, key="vendas_inicial")
+    vendas_data_final = st.date_input("Data Final para Vendas", value=date.today(), min_value=INICIO_HISTORICO)
 
     if vendas_data_inicial > vendas_data_final:
         st.error("A Data Inicial não pode ser maior que a Data Final na seção de vendas por cliente.")
@@ -0,0 +1,65 @@
+# ACESSO.PY - CREDENCIAL DAS ROTAS DO ENDPOINT CHAMADAS DIRETO PELO NAVEGADOR
+# Os grids das páginas buscam dados no endpoint.py (/detalhe_estoque, /grade/, /arvore_fornecedor) e essas
+# rotas exigem o mesmo login das páginas (users.json, Cobata.py). Depois do login a página gera um token
+# '<usuário>.<expira>.<assinatura>' (HMAC-SHA256 com a senha do usuário) que o grid envia no cabeçalho
+# X-Acesso; o endpoint refaz a assinatura com o users.json e confere a permissão da página.
+# Trocar a senha ou tirar o usuário do users.json invalida os tokens já emitidos.
+import hashlib
+import hmac
+import json
+import logging
+import os
+import time
+
+try:
+    import streamlit as st
+except ImportError:
+    # O endpoint.py só valida os tokens
+    st = None
+
+USUARIOS_ARQUIVO = os.environ.get('USUARIOS_ARQUIVO', 'users.json')
+ACESSO_VALIDADE_HORAS = int(os.environ.get('ACESSO_VALIDADE_HORAS', '12'))
+CABECALHO = 'X-Acesso'
+
+logger = logging.getLogger(__name__)
+
+def _usuarios():
+    try:
+        with open(USUARIOS_ARQUIVO, encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        logger.error(f"Erro ao ler {USUARIOS_ARQUIVO}: {e}")
+        return {}
+
+def _assinatura(usuario, expira, senha):
+    return hmac.new(senha.encode(), f"{usuario}.{expira}".encode(), hashlib.sha256).hexdigest()
+
+def gerar_token(usuario):
+    """Token do usuário, ou None se ele não está no users.json."""
+    dados = _usuarios().get(usuario)
+    if not dados:
+        return None
+    # Expiração arredondada para a hora: o token (e o JsCode do grid) não muda a cada rerun
+    expira = (int(time.time()) // 3600 + ACESSO_VALIDADE_HORAS) * 3600
+    return f"{usuario}.{expira}.{_assinatura(usuario, expira, dados['password'])}"
+
+def validar_token(token, permissao=None):
+    """Usuário do token se ele é válido, não expirou e (se informada) tem a permissão da página; senão None."""
+    try:
+        usuario, expira, assinatura = (token or '').rsplit('.', 2)
+        expira = int(expira)
+    except ValueError:
+        return None
+    dados = _usuarios().get(usuario)
+    if not dados or expira < time.time():
+        return None
+    if not hmac.compare_digest(assinatura, _assinatura(usuario, expira, dados['password'])):
+        return None
+    if permissao is not None and permissao not in dados.get('permissions', []):
+        return None
+    return usuario
+
+def cabecalhos_js(cabecalhos=None):
+    """Cabeçalhos (objeto JavaScript) dos fetch dos grids, com o token do usuário logado na sessão."""
+    usuario = st.session_state.get('username') if st is not None else None
+    return json.dumps({**(cabecalhos or {}), CABECALHO: (gerar_token(usuario) or '') if usuario else ''})
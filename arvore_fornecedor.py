@@ -0,0 +1,179 @@
+# ARVORE_FORNECEDOR.PY - ÁRVORE FORNECEDOR -> MÊS -> PRODUTO -> VENDEDOR -> TRANSAÇÃO SOB DEMANDA
+# O grid do Fornecedor.py usa o row model 'serverSide' do AG Grid com treeData: abre só com os fornecedores
+# e, quando o usuário expande um nó, pede ao endpoint.py (/arvore_fornecedor) os filhos daquele caminho.
+# Cada pedido roda uma agregação agrupada só sobre o subconjunto do nó (fornecedor, mês, produto, vendedor),
+# com o intervalo de datas no índice da fato; nada do período inteiro vai para o navegador de uma vez.
+# Os valores são os mesmos do prepare_tree_data do Fornecedor.py (que continua como modo 'cliente').
+import logging
+import re
+import sqlite3
+from datetime import date, datetime, timedelta
+
+import pandas as pd
+
+from banco_local import DB_DIR, conectar_historico
+from grade_servidor import BLOCO_MAX, TAMANHO_BLOCO
+from motor_analitico import dia
+
+# Níveis abaixo do fornecedor: coluna da chave e ícone do nó (o mês é 'YYYY-MM')
+NIVEIS = [('MES', '🗓️'), ('PRODUTO', '📦'), ('VENDEDOR', '👨‍💼')]
+METRICAS = ['VENDAS_BRUTAS', 'TOTAL_DEVOLVIDO', 'VENDAS_LIQUIDAS', 'TOTAL_PEDIDOS', 'POSITIVACAO']
+
+logger = logging.getLogger(__name__)
+
+def meses_periodo(inicio, fim):
+    """Meses ('YYYY-MM') do período, na ordem: as colunas mensais dos fornecedores."""
+    return list(pd.period_range(pd.Timestamp(inicio), pd.Timestamp(fim), freq='M').strftime('%Y-%m'))
+
+def _vendas(caminho, inicio, fim, fornecedores):
+    """
+    CTE com as vendas do nó (caminho = chaves a partir do fornecedor) já com venda líquida e devolução,
+    calculadas como no Fornecedor.ler_vendas_data. Retorna (sql, params).
+    """
+    dia_inicio, dia_fim = dia(inicio), dia(fim) + 1
+    condicoes, params = [], []
+    if len(caminho) > 1:
+        # Mês aberto: o intervalo encolhe para o mês e continua no índice por DATA
+        primeiro = date.fromisoformat(caminho[1] + '-01')
+        seguinte = (primeiro + timedelta(days=32)).replace(day=1)
+        dia_inicio, dia_fim = max(dia_inicio, dia(primeiro)), min(dia_fim, dia(seguinte))
+    if caminho:
+        condicoes.append("FORNECEDOR = ?")
+        params.append(caminho[0])
+    elif fornecedores:
+        condicoes.append(f"FORNECEDOR IN ({', '.join('?' * len(fornecedores))})")
+        params.extend(fornecedores)
+    for (coluna, _), chave in zip(NIVEIS[1:], caminho[2:]):
+        condicoes.append(f"{coluna} = ?")
+        params.append(chave)
+    where = ''.join(f" AND {c}" for c in condicoes)
+    sql = f"""
+        WITH base AS (
+            SELECT FORNECEDOR, strftime('%Y-%m', DATA_DIA + 2440587.5) AS MES, PRODUTO, VENDEDOR, NUMPED, CLIENTE,
+                   DATA_DIA, COALESCE(QT, 0) AS QT, COALESCE(PVENDA, 0) AS PVENDA,
+                   COALESCE(QT, 0) * COALESCE(PVENDA, 0) - COALESCE(VLBONIFIC, 0) AS VALOR_TRANSACAO
+            FROM pcvendedor2
+            WHERE DATA_DIA >= ? AND DATA_DIA < ?{where}
+        ),
+        vendas AS (
+            SELECT *, CASE WHEN QT >= 0 THEN VALOR_TRANSACAO ELSE 0 END AS VALOR_VENDA_LIQUIDA,
+                   CASE WHEN QT < 0 THEN -VALOR_TRANSACAO ELSE 0 END AS VALOR_DEVOLUCAO
+            FROM base
+        )
+    """
+    return sql, [dia_inicio, dia_fim] + params
+
+def _fornecedores(conn, inicio, fim, fornecedores):
+    """Nós do primeiro nível: venda líquida por mês (colunas 'YYYY-MM') e no período."""
+    sql, params = _vendas([], inicio, fim, fornecedores)
+    cursor = conn.execute(sql + "SELECT FORNECEDOR, MES, SUM(VALOR_VENDA_LIQUIDA) FROM vendas GROUP BY 1, 2", params)
+    df = pd.DataFrame(cursor.fetchall(), columns=['FORNECEDOR', 'MES', 'VALOR'])
+    pivot = df.pivot_table(index='FORNECEDOR', columns='MES', values='VALOR', aggfunc='sum', fill_value=0)
+    pivot = pivot.reindex(columns=meses_periodo(inicio, fim), fill_value=0).sort_index()
+    totais = df.groupby('FORNECEDOR')['VALOR'].sum()
+    return [
+        {'CHAVE': forn, 'dataPath': [forn], 'group': True, 'ENTIDADE': f"🏢 {forn}",
+         'Total Período': float(totais.get(forn, 0)), **{mes: float(valor) for mes, valor in row.items()}}
+        for forn, row in pivot.iterrows()
+    ]
+
+def _grupos(conn, caminho, inicio, fim):
+    """Nós de mês, produto ou vendedor: uma agregação agrupada pela chave do nível, só dentro do nó pai."""
+    coluna, icone = NIVEIS[len(caminho) - 1]
+    sql, params = _vendas(caminho, inicio, fim, ())
+    cursor = conn.execute(sql + f"""
+        SELECT {coluna} AS CHAVE,
+               SUM(VALOR_VENDA_LIQUIDA) AS VENDAS_BRUTAS,
+               SUM(VALOR_DEVOLUCAO) AS TOTAL_DEVOLVIDO,
+               SUM(VALOR_VENDA_LIQUIDA) - SUM(VALOR_DEVOLUCAO) AS VENDAS_LIQUIDAS,
+               COUNT(DISTINCT NUMPED) AS TOTAL_PEDIDOS,
+               COUNT(DISTINCT CASE WHEN VALOR_VENDA_LIQUIDA > 0 THEN CLIENTE END) AS POSITIVACAO,
+               SUM(QT) AS QT
+        FROM vendas WHERE {coluna} IS NOT NULL GROUP BY 1 ORDER BY 1
+    """, params)
+    nos = []
+    for chave, *valores in cursor:
+        no = {'CHAVE': chave, 'dataPath': list(caminho) + [chave], 'group': True}
+        if coluna == 'MES':
+            no['ENTIDADE'] = f"{icone} {datetime.strptime(chave, '%Y-%m').strftime('%B/%Y')}"
+        else:
+            no['ENTIDADE'] = f"{icone} {chave}"
+        no.update(zip(METRICAS, valores[:-1]))
+        if coluna != 'MES':
+            no['QT'] = valores[-1]
+        nos.append(no)
+    return nos
+
+def _transacoes(conn, caminho, inicio, fim, primeira, limite):
+    """Folhas (linhas de venda do vendedor no produto/mês), paginadas no SQL. Retorna (nós, total)."""
+    sql, params = _vendas(caminho, inicio, fim, ())
+    total = conn.execute(sql + "SELECT COUNT(*) FROM vendas", params).fetchone()[0]
+    cursor = conn.execute(sql + """
+        SELECT NUMPED, CLIENTE, QT, PVENDA, VALOR_VENDA_LIQUIDA, VALOR_DEVOLUCAO FROM vendas
+        ORDER BY DATA_DIA, NUMPED LIMIT ? OFFSET ?
+    """, params + [limite, primeira])
+    nos = [
+        {'CHAVE': f"T.{primeira + i}", 'dataPath': list(caminho) + [f"T.{primeira + i}"], 'group': False,
+         'ENTIDADE': f"📄 Pedido: {numped}", 'NUMPED': numped, 'CLIENTE': cliente, 'QT': qt, 'PVENDA': pvenda,
+         'TIPO': 'Devolução' if qt < 0 else 'Venda', 'VENDAS_BRUTAS': venda, 'TOTAL_DEVOLVIDO': devolucao}
+        for i, (numped, cliente, qt, pvenda, venda, devolucao) in enumerate(cursor)
+    ]
+    return nos, total
+
+def ler_filhos(pedido, db_dir=DB_DIR):
+    """
+    Responde a um pedido do grid: {'inicio', 'fim', 'fornecedores', 'groupKeys' (caminho do nó aberto),
+    'startRow', 'endRow'}. Retorna {'linhas': [...], 'total': n}. ValueError para pedido inválido.
+    """
+    if not isinstance(pedido.get('inicio'), str) or not isinstance(pedido.get('fim'), str):
+        raise ValueError("'inicio' e 'fim' devem ser datas 'YYYY-MM-DD'.")
+    inicio, fim = date.fromisoformat(pedido['inicio'][:10]), date.fromisoformat(pedido['fim'][:10])
+    if inicio > fim:
+        raise ValueError(f"Período invertido: {inicio} a {fim}.")
+    chaves = pedido.get('groupKeys') or []
+    fornecedores = pedido.get('fornecedores') or []
+    if not isinstance(chaves, list) or not isinstance(fornecedores, list):
+        raise ValueError("'groupKeys' e 'fornecedores' devem ser listas.")
+    caminho = [str(chave) for chave in chaves]
+    if len(caminho) > len(NIVEIS) + 1:
+        raise ValueError(f"Caminho com níveis demais: {caminho}")
+    # O mês do caminho vira intervalo de datas em _vendas
+    if len(caminho) > 1 and not re.fullmatch(r'\d{4}-(0[1-9]|1[0-2])', caminho[1]):
+        raise ValueError(f"Mês inválido no caminho: {caminho[1]!r}")
+    primeira = max(int(pedido.get('startRow') or 0), 0)
+    ultima = int(pedido.get('endRow') or primeira + TAMANHO_BLOCO)
+    limite = max(min(ultima - primeira, BLOCO_MAX), 0)
+
+    conn = None
+    try:
+        conn = conectar_historico('pcvendedor2', inicio, fim, db_dir=db_dir, timeout=10)
+        if len(caminho) == len(NIVEIS) + 1:
+            nos, total = _transacoes(conn, caminho, inicio, fim, primeira, limite)
+            return {'linhas': nos, 'total': total}
+        if caminho:
+            nos = _grupos(conn, caminho, inicio, fim)
+        else:
+            nos = _fornecedores(conn, inicio, fim, [str(f) for f in fornecedores])
+        # Grupos cabem na memória (centenas): a página do bloco é recortada aqui
+        return {'linhas': nos[primeira:primeira + limite], 'total': len(nos)}
+    finally:
+        if conn:
+            conn.close()
+
+def listar_fornecedores(inicio, fim, db_dir=DB_DIR):
+    """Fornecedores com venda no período (DataFrame com FORNECEDOR), para o filtro da página. None se falhou."""
+    conn = None
+    try:
+        conn = conectar_historico('pcvendedor2', inicio, fim, db_dir=db_dir, timeout=10)
+        df = pd.read_sql_query(
+            "SELECT DISTINCT FORNECEDOR FROM pcvendedor2 WHERE DATA_DIA >= ? AND DATA_DIA < ? ORDER BY 1",
+            conn, params=(dia(inicio), dia(fim) + 1)
+        )
+        df.attrs['atualizado_em'] = datetime.now()
+        return df
+    except (sqlite3.Error, pd.io.sql.DatabaseError) as e:
+        logger.error(f"Erro ao listar os fornecedores do período: {e}")
+        return None
+    finally:
+        if conn:
+            conn.close()
@@ -0,0 +1,305 @@
+# BANCO_LOCAL.PY - CONSULTAS DAS PÁGINAS AO CACHE SQLITE E VERIFICAÇÃO DOS PLANOS
+# As páginas leem o SQL daqui. Assim o verificador de planos testa exatamente o que os dashboards executam.
+# Uso: python banco_local.py [pasta_dos_bancos]  -> sai com código 1 se alguma consulta fizer varredura completa.
+import logging
+import os
+import pathlib
+import sqlite3
+import sys
+
+from camada_fria import anexar_camada_fria
+from registro_consultas import conectar
+
+# Pasta dos arquivos .db gerados pelo endpoint.py
+DB_DIR = 'database'
+
+# Um arquivo por tabela (mesmos nomes de endpoint.TABLE_STORAGE). Na conexão analítica cada arquivo
+# vira um schema com o próprio nome: pceest.PCEEST, pcvendedor2.fato_pcvendedor2, ...
+BANCOS = [
+    'vwsomelier', 'pcpedc', 'pceest', 'pcpedi_fornecedor', 'pcmovendpend',
+    'pcpedi', 'pcvendedor', 'pcvendedor2', 'pcpedc_posicao',
+]
+
+# Views TEMP da conexão analítica (só existem nela; nada é gravado nos arquivos).
+# Leem direto das fatos com chaves INTEGER para o JOIN entre arquivos usar os índices.
+VIEWS_ANALITICAS = {
+    # Vendas que contam para a Curva ABC do Estoque (mesmos filtros de estoque_vendas_ano)
+    'vendas_validas': """
+        SELECT f.CODPROD, f.DATA AS DATA_DIA, f.QT, f.PVENDA, f.CODOPER, f.CODCLI, f.CODIGOVENDEDOR
+        FROM pcvendedor2.fato_pcvendedor2 f
+        WHERE f.CODCLI NOT IN (3, 91503, 111564, 1)
+            AND f.CONDVENDA = 1
+            AND f.CODIGOVENDEDOR NOT IN (219, 3, 63, 100, 12, 104, 186, 217, 172, 173, 73, 144, 107, 207, 174, 149, 167, 199, 191, 218, 196, 214, 96)
+    """,
+}
+
+def conectar_analitico(db_dir=DB_DIR):
+    """
+    Conexão de leitura com todos os arquivos anexados (ATTACH ... mode=ro) e as views de VIEWS_ANALITICAS.
+    Consultas entre tabelas (estoque x vendas) rodam dentro do SQLite.
+    """
+    conn = conectar('file::memory:', uri=True, timeout=10)
+    try:
+        for banco in BANCOS:
+            caminho = pathlib.Path(db_dir, f'{banco}.db')
+            if not caminho.exists():
+                logging.warning(f"Banco {caminho} não encontrado; schema {banco} fica fora da conexão analítica.")
+                continue
+            conn.execute(f"ATTACH DATABASE ? AS {banco}", (f"{caminho.resolve().as_uri()}?mode=ro",))
+        for nome, sql in VIEWS_ANALITICAS.items():
+            try:
+                conn.execute(f"CREATE TEMP VIEW {nome} AS {sql}")
+            except sqlite3.OperationalError as e:
+                logging.warning(f"View analítica {nome} não criada: {e}")
+    except sqlite3.Error:
+        conn.close()
+        raise
+    return conn
+
+# Banco de controle do sincronizador (endpoint.CONTROL_DB), com a tabela sync_state
+CONTROLE_DB = 'controle'
+
+def versoes_sync(db_dir=DB_DIR):
+    """
+    {tabela: versão} do sync_state. A versão só muda quando a sincronização altera a tabela: usada como
+    chave de cache pelas páginas ({} se o sincronizador ainda não gravou nenhuma versão).
+    """
+    caminho = pathlib.Path(db_dir, f'{CONTROLE_DB}.db')
+    if not caminho.exists():
+        return {}
+    conn = None
+    try:
+        conn = sqlite3.connect(f"{caminho.resolve().as_uri()}?mode=ro", uri=True, timeout=5)
+        return dict(conn.execute("SELECT TABELA, VERSAO FROM sync_state").fetchall())
+    except sqlite3.Error as e:
+        logging.warning(f"sync_state indisponível: {e}")
+        return {}
+    finally:
+        if conn:
+            conn.close()
+
+def versao_tabela(*tabelas, db_dir=DB_DIR):
+    """Versão de uma tabela (int) ou tupla de versões de várias, 0 para tabela sem versão registrada."""
+    versoes = versoes_sync(db_dir)
+    if len(tabelas) == 1:
+        return versoes.get(tabelas[0], 0)
+    return tuple(versoes.get(tabela, 0) for tabela in tabelas)
+
+def conectar_historico(banco, inicio, fim=None, db_dir=DB_DIR, **kwargs):
+    """
+    Conexão ao arquivo da tabela com as linhas congeladas do intervalo (datas; fim None = até hoje) juntadas
+    à view de mesmo nome (camada_fria.py). As consultas de CONSULTAS rodam sem mudança nas duas camadas.
+    O início é obrigatório (ValueError): sem ele cada conexão carregaria o histórico inteiro.
+    """
+    if inicio is None:
+        raise ValueError(f"conectar_historico('{banco}') exige o início do intervalo.")
+    conn = conectar(os.path.join(db_dir, f'{banco}.db'), **kwargs)
+    try:
+        anexar_camada_fria(conn, banco, inicio, fim, db_dir=db_dir)
+    except Exception as e:
+        # As views TEMP só são criadas no fim: sem elas a conexão continua lendo os meses do SQLite
+        logging.error(f"Camada fria de {banco} indisponível ({e}); lendo só os meses do SQLite.")
+    return conn
+
+# Parâmetro 'YYYY-MM-DD' convertido para o número do dia gravado nas fatos (coluna <data>_DIA das views)
+DIA = "CAST(julianday(?) - 2440587.5 AS INTEGER)"
+
+# Cada consulta: banco (arquivo sem .db), sql, parâmetros de exemplo para o EXPLAIN e 'leitura_completa'
+# quando a página de fato precisa de todas as linhas (varredura esperada, o verificador só informa).
+CONSULTAS = {
+    # Conexão analítica: estoque com a data da última venda válida desde ? (antes era um merge no pandas).
+    # O + no GROUP BY impede o planejador de varrer idx_pcvendedor2_codprod inteiro para agrupar;
+    # assim o filtro de data usa a faixa de idx_pcvendedor2_data_vendas.
+    'estoque_produtos_ultima_venda': {
+        'banco': 'analitico',
+        'sql': f"""
+            SELECT
+                e.NOMES_PRODUTO, e.QTULTENT, e.DTULTENT, e.DTULTSAIDA, e.CODFILIAL,
+                e.QTVENDSEMANA, e.QTVENDSEMANA1, e.QTVENDSEMANA2, e.QTVENDSEMANA3,
+                e.QTVENDMES, e.QTVENDMES1, e.QTVENDMES2, e.QTVENDMES3, e.QTGIRODIA,
+                e.QTDEVOLMES, e.QTDEVOLMES1, e.QTDEVOLMES2, e.QTDEVOLMES3,
+                e.CODPROD, e.QT_ESTOQUE, e.QTRESERV, e.QTINDENIZ, e.DTULTPEDCOMPRA,
+                e.BLOQUEADA, e.CODFORNECEDOR, e.FORNECEDOR, e.CATEGORIA,
+                date(u.ULTIMA_VENDA_DIA + 2440587.5) AS ULTIMA_VENDA
+            FROM pceest.PCEEST e
+            LEFT JOIN (
+                SELECT CODPROD, MAX(DATA_DIA) AS ULTIMA_VENDA_DIA
+                FROM vendas_validas
+                WHERE DATA_DIA >= {DIA}
+                GROUP BY +CODPROD
+            ) u ON u.CODPROD = e.CODPROD
+        """,
+        'exemplo': ('2025-01-01',),
+        'leitura_completa': True,
+    },
+    # Coberta por idx_pcvendedor2_data_vendas: filtro e colunas saem do índice, sem ler a fato
+    'estoque_vendas_ano': {
+        'banco': 'pcvendedor2',
+        'sql': f"""
+            SELECT CODPROD, DATA, QT, PVENDA, CODOPER, CODCLI, CONDVENDA, CODIGOVENDEDOR
+            FROM pcvendedor2
+            WHERE DATA_DIA >= {DIA}
+                AND CODCLI NOT IN ('3', '91503', '111564', '1')
+                AND CONDVENDA = '1'
+                AND CODIGOVENDEDOR NOT IN (219, 3, 63, 100, 12, 104, 186, 217, 172, 173, 73, 144, 107, 207, 174, 149, 167, 199, 191, 218, 196, 214, 96)
+        """,
+        'exemplo': ('2025-01-01',),
+        'leitura_completa': False,
+    },
+    'fornecedor_vendas': {
+        'banco': 'pcvendedor2',
+        'sql': f"""
+            SELECT NUMPED, CLIENTE, VENDEDOR, PRODUTO, QT, PVENDA, VLBONIFIC, DATA, FORNECEDOR
+            FROM pcvendedor2
+            WHERE DATA_DIA >= {DIA} AND DATA_DIA < {DIA}
+        """,
+        'exemplo': ('2025-01-01', '2025-02-01'),
+        'leitura_completa': False,
+    },
+    'pagina_inicial_pedidos': {
+        'banco': 'pcpedc',
+        'sql': f"""
+            SELECT CODPROD, QT_SAIDA, NUMPED, DATA, PVENDA, CONDVENDA, NOME, CODUSUR, CODFILIAL, CODPRACA, CODCLI, NOME_EMITENTE, DEVOLUCAO
+            FROM pcpedc
+            WHERE DATA_DIA BETWEEN {DIA} AND {DIA}
+        """,
+        'exemplo': ('2025-01-01', '2025-01-31'),
+        'leitura_completa': False,
+    },
+    # Coberta por idx_pcmovendpend_data_conferencia
+    'pedidos_separacao': {
+        'banco': 'pcmovendpend',
+        'sql': f"""
+            SELECT DTINICIOOS, DTFIMOS, CONFERENTE, STATUS
+            FROM pcmovendpend
+            WHERE DATA_DIA BETWEEN {DIA} AND {DIA}
+            ORDER BY DTFIMOS_DIA
+        """,
+        'exemplo': ('2025-01-01', '2025-01-31'),
+        'leitura_completa': False,
+    },
+    'pedidos_pendentes': {
+        'banco': 'pcmovendpend',
+        'sql': """
+            SELECT NUMPED, NUMCAR, TOTVOL, NUMTRANSWMS, CODCLIENTE, CLIENTE, DTINICIOOS, DTFIMOS,
+                   CONFERENTE, STATUS, ROTA, QTDITENS
+            FROM PCMOVENDPEND
+            WHERE STATUS IN ('NÃO INICIADO', 'EM CONFERÊNCIA')
+        """,
+        'exemplo': (),
+        'leitura_completa': False,
+    },
+    'pedidos_posicao': {
+        'banco': 'pcpedc_posicao',
+        'sql': f"""
+            SELECT ROTA, DATA, L_COUNT, M_COUNT, F_COUNT, DESCRICAO
+            FROM pcpedc_posicao
+            WHERE DATA_DIA BETWEEN {DIA} AND {DIA}
+            ORDER BY DATA_DIA
+        """,
+        'exemplo': ('2025-01-01', '2025-01-31'),
+        'leitura_completa': False,
+    },
+    'positivacao_vendas': {
+        'banco': 'pcvendedor',
+        'sql': f"""
+            SELECT
+                DATAPEDIDO, VALOR, QUANTIDADE, CODIGOVENDA, CODFORNECEDOR, CODPRODUTO,
+                CUSTOPRODUTO, PEDIDO, CODUSUR, VENDEDOR, CODCLIENTE, ROTA,
+                FORNECEDOR, CLIENTE, FANTASIA, RAMO, SUPERVISOR, PRODUTO
+            FROM pcvendedor
+            WHERE DATAPEDIDO_DIA BETWEEN {DIA} AND {DIA}
+            ORDER BY DATAPEDIDO_DIA
+        """,
+        'exemplo': ('2025-01-01', '2025-01-31'),
+        'leitura_completa': False,
+    },
+    # 'S' é a maioria das linhas (o resto é 'S/ED'): um índice em DEVOLUCAO só trocaria a varredura
+    # sequencial por uma busca por linha. Fica como leitura completa.
+    'vendedores_devolucao': {
+        'banco': 'pcpedc',
+        'sql': """
+            SELECT CODPROD, QT_SAIDA, VALOR_DEVOLVIDO, NUMPED, DATA, PVENDA, CONDVENDA, NOME, CODUSUR,
+                   CODFILIAL, CODPRACA, CODCLI, NOME_EMITENTE, DEVOLUCAO
+            FROM pcpedc
+            WHERE DEVOLUCAO = 'S'
+        """,
+        'exemplo': (),
+        'leitura_completa': True,
+    },
+    'vendedores_vendas': {
+        'banco': 'pcvendedor',
+        'sql': """
+            SELECT CODIGOVENDA, SUPERVISOR, CUSTOPRODUTO, CODCIDADE, CODPRODUTO, CODUSUR, VENDEDOR, ROTA, PERIODO,
+                   CODCLIENTE, CLIENTE, FANTASIA, DATAPEDIDO, PRODUTO, PEDIDO, FORNECEDOR, QUANTIDADE, BLOQUEADO,
+                   VALOR, CODFORNECEDOR, RAMO, ENDERECO, BAIRRO, MUNICIPIO, CIDADE, VLBONIFIC, BONIFIC
+            FROM pcvendedor
+            ORDER BY DATAPEDIDO_DIA
+        """,
+        'exemplo': (),
+        'leitura_completa': True,
+    },
+    # Produto: lido um mês de cada vez (cache_dados guarda cada mês); períodos que se cruzam reaproveitam os meses
+    'produto_vendas_periodo': {
+        'banco': 'vwsomelier',
+        'sql': f"""
+            SELECT DESCRICAO_1, CODPROD, DATA, QT, PVENDA, VLCUSTOFIN, CONDVENDA, NUMPED, CODOPER, DTCANCEL
+            FROM vwsomelier
+            WHERE DATA_DIA BETWEEN {DIA} AND {DIA}
+        """,
+        'exemplo': ('2025-01-01', '2025-01-31'),
+        'leitura_completa': False,
+    },
+}
+
+def plano_de_consulta(conn, nome):
+    """Linhas do EXPLAIN QUERY PLAN da consulta registrada."""
+    consulta = CONSULTAS[nome]
+    return [row[3] for row in conn.execute(f"EXPLAIN QUERY PLAN {consulta['sql']}", consulta['exemplo']).fetchall()]
+
+def varreduras(plano):
+    """Passos do plano que leem a tabela ou o índice inteiro."""
+    return [passo for passo in plano if passo.startswith('SCAN ') and not passo.startswith('SCAN CONSTANT ROW')]
+
+def verificar_planos(db_dir=DB_DIR):
+    """
+    Roda EXPLAIN QUERY PLAN em todas as consultas registradas.
+    Retorna a lista de (consulta, passo) com varredura completa não esperada.
+    """
+    falhas = []
+    for nome, consulta in CONSULTAS.items():
+        caminho = os.path.join(db_dir, f"{consulta['banco']}.db")
+        if consulta['banco'] != 'analitico' and not os.path.exists(caminho):
+            falhas.append((nome, f"banco não encontrado: {caminho}"))
+            continue
+        conn = None
+        try:
+            if consulta['banco'] == 'analitico':
+                conn = conectar_analitico(db_dir)
+            else:
+                conn = sqlite3.connect(f"file:{caminho}?mode=ro", uri=True)
+            plano = plano_de_consulta(conn, nome)
+        except sqlite3.Error as e:
+            falhas.append((nome, f"erro no EXPLAIN: {e}"))
+            continue
+        finally:
+            if conn:
+                conn.close()
+
+        scans = varreduras(plano)
+        status = 'OK' if not scans else ('LEITURA COMPLETA (esperada)' if consulta['leitura_completa'] else 'VARREDURA')
+        print(f"[{status}] {nome}")
+        for passo in plano:
+            print(f"    {passo}")
+        if scans and not consulta['leitura_completa']:
+            falhas.extend((nome, passo) for passo in scans)
+    return falhas
+
+if __name__ == '__main__':
+    falhas = verificar_planos(sys.argv[1] if len(sys.argv) > 1 else DB_DIR)
+    if falhas:
+        print(f"\n{len(falhas)} problema(s) de plano:")
+        for nome, passo in falhas:
+            print(f"  {nome}: {passo}")
+        sys.exit(1)
+    print("\nTodas as consultas usam índice (ou são leituras completas esperadas).")
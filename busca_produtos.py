@@ -0,0 +1,167 @@
+# BUSCA_PRODUTOS.PY - ÍNDICE DE BUSCA DE PRODUTOS (FTS5 TRIGRAM) MANTIDO PELO SINCRONIZADOR
+# database/busca.db tem uma linha por produto com código, descrições e fornecedores, numa tabela FTS5 com o
+# tokenizador trigram: qualquer trecho de 3+ caracteres é achado pelo índice, como no str.contains das páginas,
+# sem varrer os DataFrames. As páginas pedem os CODPROD que casam (buscar_codprods) e filtram pela chave.
+# Fontes: cadastro (dim_produto/dim_fornecedor), estoque (PCEEST) e as descrições das vendas (vwsomelier).
+# O endpoint.py chama atualizar_indice() no fim de cada ciclo; o índice só é refeito quando alguma fonte mudou.
+# Sem FTS5/trigram (SQLite 3.34+) ou sem o índice, buscar_codprods() devolve None e a página volta ao str.contains.
+import json
+import logging
+import os
+import pathlib
+import sqlite3
+from datetime import date, datetime
+
+from banco_local import DB_DIR, versoes_sync
+from registro_consultas import conectar
+
+BUSCA_DB = 'busca'
+# Separador das várias descrições/fornecedores de um mesmo produto na linha do índice
+SEPARADOR = ' | '
+
+logger = logging.getLogger(__name__)
+
+def normalizar(texto):
+    """Texto sem espaços repetidos nem nas pontas ('' para None)."""
+    return '' if texto is None else ' '.join(str(texto).split())
+
+def _ler(db_dir, banco, sql, params=()):
+    """Linhas da consulta no arquivo do banco, somente leitura ([] se o arquivo não existe ou falhou)."""
+    caminho = pathlib.Path(db_dir, f'{banco}.db')
+    if not caminho.exists():
+        return []
+    conn = None
+    try:
+        conn = sqlite3.connect(f"{caminho.resolve().as_uri()}?mode=ro", uri=True, timeout=10)
+        return conn.execute(sql, params).fetchall()
+    except sqlite3.Error as e:
+        logger.warning(f"Índice de busca: fonte '{banco}' ignorada neste ciclo ({e}).")
+        return []
+    finally:
+        if conn:
+            conn.close()
+
+def _assinatura(db_dir):
+    """Versões das fontes: estoque e vendas pelo sync_state, cadastro pelo hash das dimensões."""
+    versoes = versoes_sync(db_dir)
+    dimensoes = _ler(db_dir, 'pcvendedor2', "SELECT DIMENSAO, HASH FROM dim_controle WHERE DIMENSAO IN ('dim_produto', 'dim_fornecedor')")
+    return json.dumps({
+        'pceest': versoes.get('pceest', 0),
+        'vwsomelier': versoes.get('vwsomelier', 0),
+        'dimensoes': dict(dimensoes),
+    }, sort_keys=True)
+
+def _criar_tabelas(conn):
+    conn.execute("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS busca_produto
+        USING fts5(CODPROD UNINDEXED, CODIGO, DESCRICAO, FORNECEDOR, tokenize = 'trigram')
+    """)
+    # Descrições já vistas nas vendas: cada ciclo só lê a janela sincronizada da vwsomelier
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS descricao_vendida (
+            CODPROD INTEGER, DESCRICAO TEXT, PRIMARY KEY (CODPROD, DESCRICAO)
+        ) WITHOUT ROWID
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS busca_controle (
+            ID INTEGER PRIMARY KEY CHECK (ID = 1), FONTES TEXT, PRODUTOS INTEGER, ATUALIZADO_EM TEXT
+        )
+    """)
+
+def atualizar_indice(desde=None, db_dir=DB_DIR):
+    """
+    Refaz o índice se o cadastro, o estoque ou as vendas mudaram desde a última vez. 'desde' (date) limita a
+    leitura das descrições da vwsomelier à janela sincronizada (None = histórico inteiro).
+    Retorna o número de produtos indexados, 0 se nada mudou, ou None se o índice não pôde ser gravado.
+    """
+    conn = None
+    try:
+        conn = conectar(os.path.join(db_dir, f'{BUSCA_DB}.db'), timeout=10)
+        _criar_tabelas(conn)
+        fontes = _assinatura(db_dir)
+        gravada = conn.execute("SELECT FONTES FROM busca_controle WHERE ID = 1").fetchone()
+        if gravada and gravada[0] == fontes:
+            return 0
+
+        # Primeira vez: descrições de todo o histórico; depois só a janela (a fato é indexada por DATA)
+        if conn.execute("SELECT 1 FROM descricao_vendida LIMIT 1").fetchone() is None:
+            desde = None
+        filtro, params = ("WHERE DATA >= ?", (desde.toordinal() - date(1970, 1, 1).toordinal(),)) if desde else ("", ())
+        vendidas = _ler(db_dir, 'vwsomelier', f"SELECT DISTINCT CODPROD, DESCRICAO_1 FROM fato_vwsomelier {filtro}", params)
+        conn.executemany("INSERT OR IGNORE INTO descricao_vendida (CODPROD, DESCRICAO) VALUES (?, ?)",
+                         ((codprod, normalizar(descricao)) for codprod, descricao in vendidas if codprod is not None and descricao))
+
+        produtos = {}
+        def incluir(codprod, descricao, fornecedor):
+            if codprod is None:
+                return
+            descricoes, fornecedores = produtos.setdefault(codprod, ({}, {}))
+            # dict em vez de set: mantém a ordem das fontes (cadastro primeiro)
+            if normalizar(descricao):
+                descricoes[normalizar(descricao)] = None
+            if normalizar(fornecedor):
+                fornecedores[normalizar(fornecedor)] = None
+
+        for linha in _ler(db_dir, 'pcvendedor2', """
+            SELECT p.CODPROD, p.DESCRICAO, fo.FORNECEDOR
+            FROM dim_produto p LEFT JOIN dim_fornecedor fo ON fo.CODFORNEC = p.CODFORNEC
+        """):
+            incluir(*linha)
+        for linha in _ler(db_dir, 'pceest', "SELECT DISTINCT CODPROD, NOMES_PRODUTO, FORNECEDOR FROM fato_pceest"):
+            incluir(*linha)
+        for codprod, descricao in conn.execute("SELECT CODPROD, DESCRICAO FROM descricao_vendida"):
+            incluir(codprod, descricao, None)
+
+        with conn:
+            conn.execute("DELETE FROM busca_produto")
+            conn.executemany(
+                "INSERT INTO busca_produto (CODPROD, CODIGO, DESCRICAO, FORNECEDOR) VALUES (?, ?, ?, ?)",
+                ((codprod, str(codprod), SEPARADOR.join(descricoes), SEPARADOR.join(fornecedores))
+                 for codprod, (descricoes, fornecedores) in produtos.items())
+            )
+            conn.execute(
+                "INSERT OR REPLACE INTO busca_controle (ID, FONTES, PRODUTOS, ATUALIZADO_EM) VALUES (1, ?, ?, ?)",
+                (fontes, len(produtos), datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
+            )
+        logger.info(f"Índice de busca de produtos refeito: {len(produtos)} produto(s).")
+        return len(produtos)
+    except sqlite3.Error as e:
+        # Ex.: SQLite sem FTS5 ou sem o tokenizador trigram; as páginas continuam com a busca no DataFrame
+        logger.error(f"Erro ao atualizar o índice de busca de produtos: {e}")
+        return None
+    finally:
+        if conn:
+            conn.close()
+
+def buscar_codprods(termo, db_dir=DB_DIR):
+    """
+    Conjunto dos CODPROD cujo código, descrição ou fornecedor contém o termo (sem diferenciar maiúsculas).
+    None quando o índice não está disponível: a página filtra o DataFrame como antes.
+    """
+    termo = normalizar(termo)
+    caminho = pathlib.Path(db_dir, f'{BUSCA_DB}.db')
+    if not termo or not caminho.exists():
+        return None
+    conn = None
+    try:
+        conn = sqlite3.connect(f"{caminho.resolve().as_uri()}?mode=ro", uri=True, timeout=5)
+        if conn.execute("SELECT 1 FROM busca_controle WHERE ID = 1").fetchone() is None:
+            return None
+        if len(termo) >= 3:
+            # Termo entre aspas (frase): o trigram casa o trecho em qualquer posição das colunas indexadas
+            cursor = conn.execute("SELECT CODPROD FROM busca_produto WHERE busca_produto MATCH ?",
+                                  ('"' + termo.replace('"', '""') + '"',))
+        else:
+            # Menos de 3 caracteres não forma trigrama: LIKE sobre a tabela do índice (uma linha por produto)
+            padrao = '%' + termo.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+            cursor = conn.execute("""
+                SELECT CODPROD FROM busca_produto
+                WHERE CODIGO LIKE ?1 ESCAPE '\\' OR DESCRICAO LIKE ?1 ESCAPE '\\' OR FORNECEDOR LIKE ?1 ESCAPE '\\'
+            """, (padrao,))
+        return {row[0] for row in cursor}
+    except sqlite3.Error as e:
+        logger.warning(f"Índice de busca de produtos indisponível ({e}); buscando no DataFrame.")
+        return None
+    finally:
+        if conn:
+            conn.close()
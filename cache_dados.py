@@ -0,0 +1,157 @@
+# CACHE_DADOS.PY - CACHE DE DATAFRAMES COMPARTILHADO PELAS PÁGINAS DO STREAMLIT
+# Um único cache por processo: todas as sessões abertas usam a mesma cópia de cada consulta.
+# Chave = (consulta, parâmetros, versões das tabelas no sync_state): quando a sincronização muda uma
+# tabela a versão sobe e a entrada antiga deixa de ser usada (e sai na hora). Sem TTL.
+# Orçamento de memória (CACHE_DADOS_MB) com descarte da entrada usada há mais tempo (LRU).
+# Cada chamada recebe uma cópia rasa: com Copy-on-Write a página pode alterar o DataFrame à vontade
+# sem mexer no que está no cache.
+# Cada DataFrame devolvido leva em df.attrs['proveniencia'] a chave e as versões de onde veio: caches
+# derivados (st.cache_data de funções que recebem o DataFrame) usam chave_dataframe() em vez de fazer hash
+# de todas as linhas. Quem filtra ou transforma o DataFrame antes de passá-lo adiante marca com derivar().
+# A proveniência só vale enquanto cada coluna aponta para os mesmos dados em memória (ver proveniencia()).
+import hashlib
+import logging
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from banco_local import DB_DIR, versoes_sync
+
+CACHE_DADOS_MB = int(os.environ.get('CACHE_DADOS_MB', '512'))
+
+# No pandas 3 o Copy-on-Write é sempre ligado; antes disso é o que torna a cópia rasa segura
+if int(pd.__version__.split('.')[0]) < 3:
+    pd.set_option('mode.copy_on_write', True)
+
+logger = logging.getLogger(__name__)
+
+_entradas = OrderedDict()  # (chave, versoes) -> (DataFrame, bytes)
+_total_bytes = 0
+_lock = threading.Lock()
+# Uma carga por chave de cada vez: sessões que pedem o mesmo dado esperam a primeira em vez de repetir a leitura
+_cargas = {}
+_estatisticas = {'acertos': 0, 'faltas': 0, 'descartes': 0}
+
+def _tamanho(df):
+    return int(df.memory_usage(index=True, deep=True).sum())
+
+def _remover(chave_completa):
+    global _total_bytes
+    _, tamanho = _entradas.pop(chave_completa)
+    _total_bytes -= tamanho
+
+def obter(chave, tabelas, carregar, db_dir=DB_DIR):
+    """
+    DataFrame da consulta 'chave' (tupla com nome e parâmetros) nas versões atuais de 'tabelas'.
+    Na falta, chama carregar() e guarda o resultado. Exceções de carregar() passam direto e nada é guardado.
+    """
+    global _total_bytes
+    atuais = versoes_sync(db_dir)
+    chave_completa = (chave, tuple(atuais.get(tabela, 0) for tabela in tabelas))
+
+    with _lock:
+        if chave_completa in _entradas:
+            _entradas.move_to_end(chave_completa)
+            _estatisticas['acertos'] += 1
+            return carimbar(_entradas[chave_completa][0].copy(deep=False), chave_completa)
+        carga = _cargas.setdefault(chave, threading.Lock())
+
+    with carga:
+        with _lock:
+            # Outra sessão pode ter carregado enquanto esta esperava
+            if chave_completa in _entradas:
+                _entradas.move_to_end(chave_completa)
+                _estatisticas['acertos'] += 1
+                return carimbar(_entradas[chave_completa][0].copy(deep=False), chave_completa)
+            _estatisticas['faltas'] += 1
+
+        df = carregar()
+        if not isinstance(df, pd.DataFrame):
+            return df
+        tamanho = _tamanho(df)
+
+        with _lock:
+            # Versões antigas da mesma consulta não voltam a ser pedidas
+            for antiga in [k for k in _entradas if k[0] == chave]:
+                _remover(antiga)
+            limite = CACHE_DADOS_MB * 1024 * 1024
+            if tamanho <= limite:
+                _entradas[chave_completa] = (df, tamanho)
+                _total_bytes += tamanho
+                while _total_bytes > limite:
+                    descartada = next(iter(_entradas))
+                    _remover(descartada)
+                    _estatisticas['descartes'] += 1
+                    logger.info(f"Cache de dados: {descartada[0]} descartada (LRU, {_total_bytes / 2 ** 20:.0f} MB em uso).")
+            else:
+                logger.warning(f"Cache de dados: {chave} tem {tamanho / 2 ** 20:.0f} MB, acima do orçamento; não guardada.")
+        return carimbar(df.copy(deep=False), chave_completa)
+
+def _endereco(valores):
+    """Endereço dos dados de uma coluna (array do pandas): igual nas cópias rasas, novo quando os valores são refeitos."""
+    if isinstance(valores, np.ndarray):
+        return valores.__array_interface__['data'][0]
+    # numpy (_ndarray), datas, nullable Int64/boolean (_data) e categorias (_codes)
+    for atributo in ('_ndarray', '_data', '_codes'):
+        interno = getattr(valores, atributo, None)
+        if isinstance(interno, np.ndarray):
+            return interno.__array_interface__['data'][0]
+    # Colunas sobre Arrow (str do pandas 3)
+    arrow = getattr(valores, '_pa_array', None)
+    if arrow is not None:
+        return tuple(buffer.address for parte in arrow.chunks for buffer in parte.buffers() if buffer is not None)
+    return id(valores)
+
+def _enderecos(df):
+    return tuple(_endereco(df.iloc[:, i].array) for i in range(df.shape[1]))
+
+def carimbar(df, origem):
+    """Grava a proveniência em df.attrs com as linhas, colunas e endereços dos dados do DataFrame em que ela vale."""
+    df.attrs['proveniencia'] = (origem, len(df), tuple(df.columns), _enderecos(df))
+    return df
+
+def proveniencia(df):
+    """
+    Proveniência do DataFrame, ou None se não tem ou se ele não é mais o que foi carimbado.
+    O pandas copia attrs em quase toda operação, então vale só enquanto linhas, colunas e os dados de cada
+    coluna são os mesmos: cópias rasas mantêm; sort_values, fillna, df[col] = ... e filtros geram dados
+    novos e perdem (marque o resultado com derivar()). Escrita no lugar (df.loc[...] = ...) num DataFrame
+    que não compartilha dados com outro não muda os endereços: nesse caso chame derivar() de novo.
+    """
+    registro = df.attrs.get('proveniencia')
+    if registro is None:
+        return None
+    origem, linhas, colunas, enderecos = registro
+    if linhas != len(df) or colunas != tuple(df.columns) or enderecos != _enderecos(df):
+        return None
+    return origem
+
+def derivar(df, origem, *parametros):
+    """Marca df como obtido de 'origem' pelos parâmetros (ex.: filtro aplicado). Sem proveniência na origem, tira a de df."""
+    base = proveniencia(origem)
+    if base is None:
+        df.attrs.pop('proveniencia', None)
+        return df
+    return carimbar(df, (base, parametros))
+
+def chave_dataframe(df):
+    """hash_funcs do st.cache_data: a proveniência (sem ler as linhas) ou, sem ela, o hash do conteúdo."""
+    origem = proveniencia(df)
+    if origem is not None:
+        return ('proveniencia', origem)
+    return hashlib.md5(pd.util.hash_pandas_object(df).values.tobytes()).hexdigest()
+
+def limpar():
+    """Esvazia o cache (botões de 'Atualizar Dados')."""
+    global _total_bytes
+    with _lock:
+        _entradas.clear()
+        _total_bytes = 0
+
+def estatisticas():
+    """Acertos, faltas, descartes, entradas e MB em uso."""
+    with _lock:
+        return dict(_estatisticas, entradas=len(_entradas), mb=round(_total_bytes / 2 ** 20, 1))
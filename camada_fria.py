@@ -0,0 +1,206 @@
+# CAMADA_FRIA.PY - RETENÇÃO EM DUAS CAMADAS: MESES RECENTES NO SQLITE, HISTÓRICO EM PARQUET
+# Meses fechados e mais antigos que a janela de sincronização são congelados em Parquet comprimido,
+# um arquivo por mês com as colunas da fato (chaves INTEGER, datas como número do dia):
+# database/frio/<tabela>/mes=YYYY-MM.parquet. Depois saem da fato quente, que fica pequena.
+# O manifest.json guarda 'congelado_ate' (primeiro dia que continua no SQLite): os leitores pegam
+# da fato só o que vem depois dele e do Parquet só o que vem antes, então um mês nunca conta duas vezes.
+# Leitura das duas camadas juntas: anexar_camada_fria (conexões SQLite) e arquivos_frios (DuckDB).
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+from datetime import date, datetime
+
+from snapshot_parquet import PARQUET_DISPONIVEL, TIPOS_ARROW, _gravar_manifesto, _limites_do_mes, _mes_do_dia, pa, pq
+
+CAMADA_FRIA_DIR = 'frio'
+CAMADA_FRIA_COMPRESSION = 'zstd'
+
+logger = logging.getLogger(__name__)
+
+_congelamento_locks = {}
+_congelamento_locks_guard = threading.Lock()
+
+def _pasta_fria(db_dir, tabela):
+    return os.path.join(db_dir, CAMADA_FRIA_DIR, tabela)
+
+def _dia(valor):
+    """date/datetime/'YYYY-MM-DD'/número do dia -> número do dia (None passa direto)."""
+    if valor is None or isinstance(valor, int):
+        return valor
+    if isinstance(valor, str):
+        valor = date.fromisoformat(valor[:10])
+    if hasattr(valor, 'date'):
+        valor = valor.date()
+    return valor.toordinal() - 719163
+
+def carregar_manifesto_frio(tabela, db_dir='database'):
+    """Manifesto da camada fria da tabela, ou None se nenhum mês foi congelado."""
+    try:
+        with open(os.path.join(_pasta_fria(db_dir, tabela), 'manifest.json'), encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        logger.warning(f"Manifesto da camada fria de '{tabela}' ilegível: {e}")
+        return None
+
+def arquivos_frios(tabela, inicio, fim=None, db_dir='database'):
+    """
+    (coluna de partição, congelado_ate, [arquivos]) dos meses congelados que cruzam o intervalo
+    (datas ou números do dia; fim None = até hoje). None quando a tabela não tem camada fria.
+    ValueError sem o início: ler o histórico inteiro a cada conexão não é permitido.
+    """
+    if inicio is None:
+        raise ValueError(f"Leitura da camada fria de '{tabela}' exige o início do intervalo.")
+    manifesto = carregar_manifesto_frio(tabela, db_dir)
+    if manifesto is None:
+        return None
+    inicio, fim = _dia(inicio), _dia(fim)
+    pasta = _pasta_fria(db_dir, tabela)
+    arquivos = []
+    for mes, particao in manifesto['particoes'].items():
+        primeiro, ultimo = _limites_do_mes(mes)
+        if (inicio is None or ultimo >= inicio) and (fim is None or primeiro <= fim):
+            arquivos.append(os.path.join(pasta, particao['arquivo']))
+    return manifesto['particionado_por'], manifesto['congelado_ate'], arquivos
+
+def _esquema_fato(cursor, fato, schema='main'):
+    """[(coluna, tipo Arrow)] da fato, sem o ROW_HASH (só serve para o merge da sincronização)."""
+    cursor.execute(f"PRAGMA {schema}.table_info({fato})")
+    return [(coluna, TIPOS_ARROW.get(declarado.upper(), 'string'))
+            for _, coluna, declarado, *_ in cursor.fetchall() if coluna != 'ROW_HASH']
+
+def congelar_meses(tabela, fato, coluna_particao, ate, db_dir='database'):
+    """
+    Congela em Parquet os meses da fato anteriores a 'ate' (date, primeiro dia de um mês) e tira da fato
+    os meses congelados no ciclo anterior. A remoção fica um ciclo atrasada: quem leu o manifesto antigo
+    ainda encontra as linhas no SQLite. Retorna o número de meses congelados agora, ou None se falhou.
+    """
+    if not PARQUET_DISPONIVEL:
+        return None
+    with _congelamento_locks_guard:
+        lock = _congelamento_locks.setdefault(tabela, threading.Lock())
+
+    with lock:
+        pasta = _pasta_fria(db_dir, tabela)
+        conn = None
+        try:
+            manifesto = carregar_manifesto_frio(tabela, db_dir) or {
+                'tabela': tabela, 'particionado_por': coluna_particao, 'congelado_ate': None, 'particoes': {},
+            }
+            conn = sqlite3.connect(os.path.join(db_dir, f'{tabela}.db'), timeout=10)
+            cursor = conn.cursor()
+
+            # 1) Meses congelados no ciclo anterior saem da camada quente
+            if manifesto['congelado_ate'] is not None:
+                cursor.execute(f"DELETE FROM {fato} WHERE {coluna_particao} < ?", (manifesto['congelado_ate'],))
+                if cursor.rowcount:
+                    conn.commit()
+                    logger.info(f"Camada fria '{tabela}': {cursor.rowcount} linha(s) já congelada(s) removida(s) do SQLite.")
+
+            # 2) Meses fechados antes de 'ate' que ainda estão só no SQLite
+            ate_dia = _dia(ate)
+            cursor.execute(f"SELECT MIN({coluna_particao}) FROM {fato} WHERE {coluna_particao} < ?", (ate_dia,))
+            menor = cursor.fetchone()[0]
+            if menor is None:
+                return 0
+            meses = []
+            mes = _mes_do_dia(menor)
+            while _limites_do_mes(mes)[0] < ate_dia:
+                meses.append(mes)
+                mes = _mes_do_dia(_limites_do_mes(mes)[1] + 1)
+
+            esquema = _esquema_fato(cursor, fato)
+            colunas_sql = ', '.join(coluna for coluna, _ in esquema)
+            os.makedirs(pasta, exist_ok=True)
+            congelados = 0
+            for mes in meses:
+                if mes in manifesto['particoes']:
+                    continue
+                cursor.execute(f"SELECT {colunas_sql} FROM {fato} WHERE {coluna_particao} BETWEEN ? AND ?", _limites_do_mes(mes))
+                rows = cursor.fetchall()
+                if not rows:
+                    continue
+                arrays = [pa.array(valores, getattr(pa, tipo)()) for (_, tipo), valores in zip(esquema, zip(*rows))]
+                arquivo = f"mes={mes}.parquet"
+                temporario = os.path.join(pasta, f"{arquivo}.tmp")
+                pq.write_table(pa.Table.from_arrays(arrays, names=[c for c, _ in esquema]), temporario,
+                               compression=CAMADA_FRIA_COMPRESSION)
+                os.replace(temporario, os.path.join(pasta, arquivo))
+                manifesto['particoes'][mes] = {'arquivo': arquivo, 'linhas': len(rows)}
+                congelados += 1
+
+            # 3) Nova fronteira publicada; as linhas saem do SQLite no próximo ciclo
+            manifesto['congelado_ate'] = max(ate_dia, manifesto['congelado_ate'] or ate_dia)
+            manifesto['colunas'] = esquema
+            manifesto['gerado_em'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+            manifesto['particoes'] = dict(sorted(manifesto['particoes'].items()))
+            _gravar_manifesto(pasta, manifesto)
+            if congelados:
+                logger.info(f"Camada fria '{tabela}': {congelados} mês(es) congelado(s) até {ate}.")
+            return congelados
+        except (sqlite3.Error, OSError, pa.ArrowException) as e:
+            logger.error(f"Erro ao congelar meses de '{tabela}': {e}")
+            return None
+        finally:
+            if conn:
+                conn.close()
+
+def anexar_camada_fria(conn, tabela, inicio, fim=None, schema='main', db_dir='database'):
+    """
+    Na conexão SQLite, junta a camada fria à tabela: lê dos Parquet só as linhas do intervalo (filtro na
+    coluna de partição aplicado pelo pyarrow na leitura), guarda numa tabela TEMP e cria as views TEMP
+    'historico_fato_<tabela>' (fato quente + fria) e '<tabela>', que cobre a view do arquivo com o mesmo SQL.
+    Retorna False (e não mexe na conexão) se nenhum mês congelado cruza o intervalo.
+    ValueError sem o início do intervalo.
+    """
+    camada = arquivos_frios(tabela, inicio, fim, db_dir)
+    if camada is None or not camada[2]:
+        return False
+    if not PARQUET_DISPONIVEL:
+        logger.warning(f"Camada fria de '{tabela}' exige o pyarrow; lendo só os meses do SQLite.")
+        return False
+
+    coluna, congelado_ate, arquivos = camada
+    fato = f'fato_{tabela}'
+    cursor = conn.cursor()
+    esquema = _esquema_fato(cursor, fato, schema)
+    colunas = [c for c, _ in esquema]
+    colunas_sql = ', '.join(colunas)
+
+    cursor.execute(f"DROP TABLE IF EXISTS temp.frio_{tabela}")
+    cursor.execute(f"CREATE TEMP TABLE frio_{tabela} AS SELECT {colunas_sql} FROM {schema}.{fato} WHERE 0")
+    filtro = [(coluna, '>=', _dia(inicio))]
+    if fim is not None:
+        filtro.append((coluna, '<=', _dia(fim)))
+    insert = f"INSERT INTO temp.frio_{tabela} VALUES ({', '.join('?' * len(colunas))})"
+    for arquivo in arquivos:
+        # Colunas novas na fato (migração posterior ao congelamento) entram como NULL
+        presentes = [c for c in colunas if c in pq.read_schema(arquivo).names]
+        parte = pq.read_table(arquivo, columns=presentes, filters=filtro, memory_map=True)
+        for lote in parte.to_batches(max_chunksize=50000):
+            valores = [lote.column(presentes.index(c)).to_pylist() if c in presentes else [None] * lote.num_rows
+                       for c in colunas]
+            cursor.executemany(insert, zip(*valores))
+
+    cursor.execute(f"DROP VIEW IF EXISTS temp.historico_{fato}")
+    cursor.execute(f"""
+        CREATE TEMP VIEW historico_{fato} AS
+        SELECT {colunas_sql} FROM {schema}.{fato} WHERE {coluna} >= {int(congelado_ate)} OR {coluna} IS NULL
+        UNION ALL
+        SELECT {colunas_sql} FROM temp.frio_{tabela}
+    """)
+
+    # A view do arquivo, reescrita sobre o histórico e com as dimensões qualificadas pelo schema
+    cursor.execute(f"SELECT sql FROM {schema}.sqlite_master WHERE type = 'view' AND name = ?", (tabela,))
+    row = cursor.fetchone()
+    if row:
+        corpo = re.sub(r'^\s*CREATE\s+VIEW\s+\S+\s+AS\s+', '', row[0], flags=re.IGNORECASE)
+        corpo = re.sub(rf'\b{fato}\b', f'temp.historico_{fato}', corpo)
+        corpo = re.sub(r'(?<![.\w])(dim_\w+)\b', rf'{schema}.\1', corpo)
+        cursor.execute(f"DROP VIEW IF EXISTS temp.{tabela}")
+        cursor.execute(f"CREATE TEMP VIEW {tabela} AS {corpo}")
+    return True
@@ -0,0 +1,178 @@
+# COMPARAR_ESTOQUE.PY - CONFERE E MEDE O CÁLCULO VETORIZADO DAS MÉTRICAS DO ESTOQUE
+# Gera estoque e vendas sintéticos, roda metricas_estoque.calcular_metricas e a versão linha a linha anterior
+# (process_dataframe_linhas, abaixo) sobre os mesmos dados, compara o resultado coluna a coluna e mostra os tempos.
+# A versão anterior ainda monta o detail_data, que hoje vem do /detalhe_estoque sob demanda: fica fora da comparação.
+# Uso: python comparar_estoque.py [produtos] [vendas]  -> sai com código 1 se os resultados forem diferentes.
+import datetime
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from metricas_estoque import calcular_metricas
+
+def dados_sinteticos(produtos=5000, vendas=200000, semente=42):
+    """(estoque, vendas) no formato de fetch_estoque_data e fetch_sales_data_for_current_year."""
+    rng = np.random.default_rng(semente)
+    hoje = datetime.date.today()
+    codigos = np.arange(1, produtos + 1)
+    dias_ultima_venda = rng.integers(0, 120, produtos).astype(float)
+    dias_ultima_venda[rng.random(produtos) < 0.1] = np.nan
+    estoque = pd.DataFrame({
+        'NOMES_PRODUTO': [f'PRODUTO {c}' for c in codigos],
+        'CODFILIAL': rng.integers(1, 4, produtos),
+        'CODPROD': codigos,
+        'FORNECEDOR': [f'FORNECEDOR {c % 97}' for c in codigos],
+        'CODFORNECEDOR': codigos % 97,
+        'CATEGORIA': rng.choice(['BEBIDAS', 'MERCEARIA', None], produtos),
+        'ULTIMA_VENDA': [None if np.isnan(d) else (hoje - datetime.timedelta(days=int(d))).isoformat() for d in dias_ultima_venda],
+        'DTULTENT': None, 'DTULTSAIDA': None, 'DTULTPEDCOMPRA': None,
+    })
+    for coluna in ['QTULTENT', 'QT_ESTOQUE', 'QTRESERV', 'QTINDENIZ', 'BLOQUEADA',
+                   'QTVENDSEMANA', 'QTVENDSEMANA1', 'QTVENDSEMANA2', 'QTVENDSEMANA3',
+                   'QTVENDMES', 'QTVENDMES1', 'QTVENDMES2', 'QTVENDMES3', 'QTGIRODIA',
+                   'QTDEVOLMES', 'QTDEVOLMES1', 'QTDEVOLMES2', 'QTDEVOLMES3']:
+        valores = rng.integers(0, 200, produtos).astype(float)
+        valores[rng.random(produtos) < 0.2] = 0
+        estoque[coluna] = valores
+    vendas_df = pd.DataFrame({
+        'CODPROD': rng.integers(1, produtos + 1, vendas),
+        'QT': rng.integers(1, 20, vendas).astype(float),
+        'PVENDA': rng.uniform(1, 300, vendas).round(2),
+        'CODOPER': rng.choice(['S', 'ED', None], vendas, p=[0.9, 0.08, 0.02]),
+        'DATA': [(hoje - datetime.timedelta(days=int(d))).isoformat() for d in rng.integers(0, 90, vendas)],
+    })
+    return estoque, vendas_df
+
+def process_dataframe_linhas(df, df_sales):
+    """Versão anterior do cálculo do Estoque.py (apply linha a linha), mantida só como referência."""
+    # Renomeação e limpeza inicial do df de estoque
+    df = df.rename(columns={
+        'CODPROD': 'Código Produto', 'NOMES_PRODUTO': 'Nome do Produto', 'QTULTENT': 'Qtde. Últ. Entrada',
+        'QT_ESTOQUE': 'Estoque Disponível', 'QTRESERV': 'Qtde. Reservada', 'QTINDENIZ': 'Qtde. Avariada',
+        'DTULTENT': 'Data Últ. Entrada', 'DTULTSAIDA': 'Data Últ. Saída', 'CODFILIAL': 'Filial',
+        'DTULTPEDCOMPRA': 'Data Últ. Ped. Compra', 'BLOQUEADA': 'Qtde. Bloqueada', 'CODFORNECEDOR': 'Cód. Fornecedor',
+        'FORNECEDOR': 'Fornecedor', 'CATEGORIA': 'Categoria', 'QTVENDSEMANA': 'Vendas Sem. Atual',
+        'QTVENDSEMANA1': 'Vendas Sem. -1', 'QTVENDSEMANA2': 'Vendas Sem. -2', 'QTVENDSEMANA3': 'Vendas Sem. -3',
+        'QTVENDMES': 'Vendas Mês Atual', 'QTVENDMES1': 'Vendas Mês -1', 'QTVENDMES2': 'Vendas Mês -2',
+        'QTVENDMES3': 'Vendas Mês -3', 'QTGIRODIA': 'Giro Diário', 'QTDEVOLMES': 'Dev. Mês Atual',
+        'QTDEVOLMES1': 'Dev. Mês -1', 'QTDEVOLMES2': 'Dev. Mês -2', 'QTDEVOLMES3': 'Dev. Mês -3',
+    })
+    numeric_cols = ['Estoque Disponível', 'Qtde. Reservada', 'Qtde. Bloqueada', 'Qtde. Avariada','Qtde. Últ. Entrada', 'Vendas Sem. Atual', 'Vendas Sem. -1', 'Vendas Sem. -2', 'Vendas Sem. -3','Vendas Mês Atual', 'Vendas Mês -1', 'Vendas Mês -2', 'Vendas Mês -3', 'Giro Diário', 'Dev. Mês Atual', 'Dev. Mês -1', 'Dev. Mês -2', 'Dev. Mês -3']
+    for col in numeric_cols:
+        if col in df.columns:
+            df[col] = pd.to_numeric(df[col], errors='coerce').fillna(0)
+    
+    # #### INÍCIO DA NOVA LÓGICA DE CLASSIFICAÇÃO ABC ####
+
+    # 1. Prepara os dados de vendas
+    if not df_sales.empty:
+        df_sales['DATA'] = pd.to_datetime(df_sales['DATA'], errors='coerce')
+        df_sales['VALOR_VENDA'] = df_sales.apply(
+            lambda row: row['QT'] if row['CODOPER'] == 'S' else -row['QT'], axis=1
+        ) * df_sales['PVENDA']
+        df_sales = df_sales.rename(columns={'CODPROD': 'Código Produto'})
+        df_sales['Código Produto'] = df_sales['Código Produto'].astype(str)
+    
+    df['Código Produto'] = df['Código Produto'].astype(str)
+    today = pd.to_datetime(datetime.date.today())
+
+    # 2. Determina produtos Curva A (Pareto sobre vendas dos últimos 15 dias)
+    class_A_products = set()
+    if not df_sales.empty:
+        # O filtro de 15 dias agora é aplicado em um dataframe já muito menor
+        sales_15_days_df = df_sales[(today - df_sales['DATA']).dt.days <= 15]
+        if not sales_15_days_df.empty:
+            sales_value_15 = sales_15_days_df.groupby('Código Produto')['VALOR_VENDA'].sum().reset_index()
+            sales_value_15 = sales_value_15[sales_value_15['VALOR_VENDA'] > 0]
+            if not sales_value_15.empty:
+                sales_value_15 = sales_value_15.sort_values(by='VALOR_VENDA', ascending=False)
+                total_value_15 = sales_value_15['VALOR_VENDA'].sum()
+                sales_value_15['CUM_PERC'] = (sales_value_15['VALOR_VENDA'].cumsum() / total_value_15) * 100
+                class_A_products = set(sales_value_15[sales_value_15['CUM_PERC'] <= 80]['Código Produto'])
+
+    # 3. Data da última venda de cada produto
+    if 'ULTIMA_VENDA' in df.columns:
+        # Já veio do JOIN no SQLite (fetch_estoque_data)
+        df['ULTIMA_VENDA'] = pd.to_datetime(df['ULTIMA_VENDA'], errors='coerce')
+    else:
+        last_sale_dates = pd.DataFrame()
+        if not df_sales.empty:
+            last_sale_dates = df_sales.groupby('Código Produto')['DATA'].max().reset_index()
+            last_sale_dates = last_sale_dates.rename(columns={'DATA': 'ULTIMA_VENDA'})
+
+        # 4. Junta a data da última venda ao dataframe principal
+        if not last_sale_dates.empty:
+            df = df.merge(last_sale_dates, on='Código Produto', how='left')
+        else:
+            df['ULTIMA_VENDA'] = pd.NaT
+
+    # 5. Define e aplica a função de classificação
+    def classify_recency(row, class_A_set, today_date):
+        if row['Código Produto'] in class_A_set:
+            return 'A'
+        last_sale = row['ULTIMA_VENDA']
+        if pd.isna(last_sale):
+            return 'C'
+        days_since_sale = (today_date - last_sale).days
+        if days_since_sale <= 30:
+            return 'B'
+        else:
+            return 'C'
+
+    df['Classe ABC'] = df.apply(classify_recency, axis=1, args=(class_A_products, today))
+    
+    # #### FIM DA NOVA LÓGICA DE CLASSIFICAÇÃO ABC ####
+
+    # Cálculos restantes (dependentes do df principal)
+    df['Giro Diário'] = df['Giro Diário'].replace(0, pd.NA)
+    df['Dias de Estoque'] = (df['Estoque Disponível'] / df['Giro Diário']).fillna(0).round(0)
+    df['Taxa de Devolução (%)'] = df.apply(lambda row: (row['Dev. Mês Atual'] / row['Vendas Mês Atual'] * 100) if row['Vendas Mês Atual'] > 0 else 0, axis=1).round(2)
+    bins = [-1, 7, 30, 90, float('inf')]
+    labels = ['Crítico', 'Atenção', 'Saudável', 'Excesso']
+    df['Status Estoque'] = pd.cut(df['Dias de Estoque'], bins=bins, labels=labels, right=True)
+
+    def create_detail_data(row):
+          return [
+              {'Métrica': 'Vendas Semanais', 'Atual': row['Vendas Sem. Atual'], 'Semana -1': row['Vendas Sem. -1'], 'Semana -2': row['Vendas Sem. -2'], 'Semana -3': row['Vendas Sem. -3']},
+              {'Métrica': 'Vendas Mensais', 'Atual': row['Vendas Mês Atual'], 'Mês -1': row['Vendas Mês -1'], 'Mês -2': row['Vendas Mês -2'], 'Mês -3': row['Vendas Mês -3']},
+              {'Métrica': 'Devoluções Mensais', 'Atual': row['Dev. Mês Atual'], 'Mês -1': row['Dev. Mês -1'], 'Mês -2': row['Dev. Mês -2'], 'Mês -3': row['Dev. Mês -3']},
+              {'Métrica': 'Outras Qtde.', 'Reservada': row['Qtde. Reservada'], 'Bloqueada': row['Qtde. Bloqueada'], 'Avariada': row['Qtde. Avariada'], 'Últ. Entrada': row['Qtde. Últ. Entrada']}
+          ]
+    df['detail_data'] = df.apply(create_detail_data, axis=1)
+    
+    return df
+
+def medir(funcao, estoque, vendas_df, repeticoes=3):
+    """(melhor tempo em segundos, resultado) de funcao sobre cópias dos dados."""
+    melhor, resultado = float('inf'), None
+    for _ in range(repeticoes):
+        inicio = time.perf_counter()
+        resultado = funcao(estoque.copy(), vendas_df.copy())
+        melhor = min(melhor, time.perf_counter() - inicio)
+    return melhor, resultado
+
+if __name__ == '__main__':
+    produtos = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    vendas = int(sys.argv[2]) if len(sys.argv) > 2 else 200000
+    estoque, vendas_df = dados_sinteticos(produtos, vendas)
+
+    tempo_linhas, esperado = medir(process_dataframe_linhas, estoque, vendas_df)
+    tempo_vetorizado, obtido = medir(calcular_metricas, estoque, vendas_df)
+
+    iguais = True
+    try:
+        # Classe ABC: o apply devolvia object, o np.select devolve texto; o conteúdo é o que importa
+        pd.testing.assert_frame_equal(obtido.drop(columns=['Classe ABC']),
+                                      esperado.drop(columns=['detail_data', 'Classe ABC']))
+        pd.testing.assert_series_equal(obtido['Classe ABC'].astype(object), esperado['Classe ABC'].astype(object))
+    except AssertionError as e:
+        iguais = False
+        print(f"Resultados diferentes: {e}")
+
+    print(f"{produtos} produtos, {vendas} vendas")
+    print(f"  linha a linha: {tempo_linhas * 1000:.1f} ms")
+    print(f"  vetorizado:    {tempo_vetorizado * 1000:.1f} ms ({tempo_linhas / tempo_vetorizado:.0f}x)")
+    print("  resultados iguais" if iguais else "  RESULTADOS DIFERENTES")
+    sys.exit(0 if iguais else 1)
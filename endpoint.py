@@ -1,17 +1,26 @@
 import json
-from flask import Flask, jsonify, request
+from flask import Flask, Response, jsonify, request
 import cx_Oracle
-from datetime import datetime, date
+from datetime import datetime, date, timedelta
 from dateutil.relativedelta import relativedelta
 from apscheduler.schedulers.background import BackgroundScheduler
 from apscheduler.events import EVENT_JOB_EXECUTED, EVENT_JOB_ERROR
 import hashlib
-from concurrent.futures import ThreadPoolExecutor
-from tenacity import retry, stop_after_attempt, wait_exponential
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from tenacity import retry, retry_if_exception_type, stop_after_attempt, wait_exponential
 import logging
 import os
 import sqlite3
+from registro_consultas import conectar
+from snapshot_parquet import PARQUET_DISPONIVEL, publicar_snapshot
+from camada_fria import anexar_camada_fria, carregar_manifesto_frio, congelar_meses
+from busca_produtos import atualizar_indice
+from metricas_estoque import METRICAS_TABELA, gravar_metricas
+from grade_servidor import ler_bloco
+from arvore_fornecedor import ler_filhos
+from acesso import CABECALHO as CABECALHO_ACESSO, validar_token
 import sys
+import threading
 
 app = Flask(__name__)
 
@@ -25,6 +34,22 @@ ORACLE_PASSWORD = 'C0BAT4D1T'
 ORACLE_HOST = '192.168.0.254'
 ORACLE_PORT = 1523
 ORACLE_SID = 'WINT'
+# Tempo máximo de cada ida ao Oracle (ms); uma consulta travada não prende o ThreadPoolExecutor
+ORACLE_CALL_TIMEOUT_MS = 10 * 60 * 1000
+# Linhas por ida ao Oracle no fetch (arraysize) e já enviadas junto com o execute (prefetchrows)
+ORACLE_ARRAYSIZE = 5000
+ORACLE_PREFETCHROWS = 5000
+
+# --- CIRCUIT BREAKER DO ORACLE ---
+# Após CIRCUIT_FAILURE_THRESHOLD falhas seguidas de conexão o circuito abre e as buscas falham na hora.
+# Passados CIRCUIT_OPEN_SECONDS, uma única conexão de teste (meio-aberto) decide se fecha ou reabre.
+CIRCUIT_FAILURE_THRESHOLD = 3
+CIRCUIT_OPEN_SECONDS = 5 * 60
+
+# --- BACKOFF POR TABELA ---
+# Tabela que falhou espera 5 min, 10 min, 20 min... até 1 hora antes de ser buscada de novo
+TABLE_BACKOFF_BASE_MINUTES = 5
+TABLE_BACKOFF_MAX_MINUTES = 60
 
 if not all([ORACLE_USERNAME, ORACLE_PASSWORD, ORACLE_HOST]):
     logger.critical("ERRO CRÍTICO: As variáveis de ambiente ORACLE_USERNAME, ORACLE_PASSWORD e ORACLE_HOST devem ser definidas.")
@@ -48,249 +73,881 @@ TABLE_DATE_COLUMNS = {
     'pcpedc_posicao': 'DATA',
 }
 
+# --- CHAVES PRIMÁRIAS (para o modo de escrita por diferença) ---
+TABLE_PRIMARY_KEYS = {
+    'vwsomelier': ['NUMPED', 'CODPROD'],
+    'pcpedc': ['NUMPED', 'CODPROD'],
+    'pceest': ['CODPROD', 'NOMES_PRODUTO', 'CODFILIAL'],
+    'pcpedi_fornecedor': ['NUMPED', 'CODPROD'],
+    'pcmovendpend': ['NUMOS', 'NUMPED'],
+    'pcpedi': ['NUMPED', 'CODPROD'],
+    'pcvendedor': ['PEDIDO', 'CODPRODUTO'],
+    'pcvendedor2': ['NUMPED', 'CODPROD', 'CODIGOVENDEDOR', 'CODCLI', 'DATA'],
+    'pcpedc_posicao': ['ROTA', 'DATA'],
+}
+
+# 'merge': aplica só INSERT/UPDATE/DELETE das linhas que mudaram (comparando ROW_HASH por chave primária)
+# 'replace': comportamento antigo, apaga a janela inteira e reinsere tudo
+SYNC_WRITE_MODE = 'merge'
+
+# Hash das linhas em processos separados (I/O continua nas threads). Só lotes acima de
+# SYNC_PROCESS_CHUNK_ROWS vão para o pool; abaixo disso o custo de serializar não compensa.
+SYNC_PROCESS_POOL = False
+SYNC_PROCESS_WORKERS = 4
+SYNC_PROCESS_CHUNK_ROWS = 20000
+
+# --- ARMAZENAMENTO TIPADO: TABELAS 'fato_<tabela>' + VIEWS COM O NOME ORIGINAL ---
+# Os dados ficam em 'fato_<tabela>' com datas como número do dia (dias desde 1970-01-01, INTEGER) e
+# chaves INTEGER. O nome original é uma VIEW que devolve as datas em 'YYYY-MM-DD' e os tipos antigos,
+# mantendo o contrato dos endpoints e páginas; a coluna '<data>_DIA' expõe o número do dia para filtros
+# que usam o índice. Nas tabelas do modelo estrela a VIEW também junta as dimensões locais.
+TABLE_STORAGE = {db_name: f'fato_{db_name}' for db_name in TABLE_DATE_COLUMNS}
+
+# Versão do esquema de cada arquivo (PRAGMA user_version). 1: modelo estrela; 2: armazenamento tipado
+SCHEMA_VERSION = 2
+
+# Conversão ISO <-> número do dia (julianday de 1970-01-01 = 2440587.5)
+DAY_FROM_ISO_SQL = "CAST(julianday({}) - 2440587.5 AS INTEGER)"
+
+# Colunas de data gravadas como número do dia
+TABLE_DAY_COLUMNS = {
+    'vwsomelier': ['DATA', 'DTCANCEL'],
+    'pcpedc': ['DATA', 'DATA_DEVOLUCAO'],
+    'pceest': ['DTULTENT', 'DTULTSAIDA', 'DTULTPEDCOMPRA'],
+    'pcpedi_fornecedor': ['DATA_PEDIDO'],
+    'pcmovendpend': ['DATA', 'DTINICIOOS', 'DTFIMOS'],
+    'pcpedi': ['DATA'],
+    'pcvendedor': ['DATAPEDIDO'],
+    'pcvendedor2': ['DATA'],
+    'pcpedc_posicao': ['DATA'],
+}
+
+# DDL das tabelas de armazenamento: (colunas, WITHOUT ROWID). WITHOUT ROWID só onde a chave
+# primária é curta, nunca nula (NUMPED/CODPROD do PCPEDI) e as linhas são pequenas.
+STORAGE_SCHEMAS = {
+    'vwsomelier': ('''
+        DESCRICAO_1 TEXT, DESCRICAO_2 TEXT, CODPROD INTEGER, DATA INTEGER, QT REAL, PVENDA REAL,
+        VLCUSTOFIN REAL, CONDVENDA INTEGER, NUMPED INTEGER, CODOPER TEXT, DTCANCEL INTEGER, ROW_HASH TEXT,
+        PRIMARY KEY (NUMPED, CODPROD)
+    ''', False),
+    'pcpedc': ('''
+        CODPROD INTEGER, QT_SAIDA REAL, QT_VENDIDA_LIQUIDA REAL, PVENDA REAL, VALOR_VENDIDO_BRUTO REAL,
+        VALOR_VENDIDO_LIQUIDO REAL, VALOR_DEVOLVIDO REAL, NUMPED INTEGER, DATA INTEGER, DATA_DEVOLUCAO INTEGER,
+        CONDVENDA INTEGER, NOME TEXT, CODUSUR INTEGER, CODFILIAL INTEGER, CODPRACA INTEGER, CODCLI INTEGER,
+        NOME_EMITENTE TEXT, DEVOLUCAO TEXT, ROW_HASH TEXT, PRIMARY KEY (NUMPED, CODPROD)
+    ''', False),
+    'pceest': ('''
+        NOMES_PRODUTO TEXT, QTULTENT REAL, DTULTENT INTEGER, DTULTSAIDA INTEGER, CODFILIAL INTEGER, QTVENDSEMANA REAL,
+        QTVENDSEMANA1 REAL, QTVENDSEMANA2 REAL, QTVENDSEMANA3 REAL, QTVENDMES REAL, QTVENDMES1 REAL,
+        QTVENDMES2 REAL, QTVENDMES3 REAL, QTGIRODIA REAL, QTDEVOLMES REAL, QTDEVOLMES1 REAL, QTDEVOLMES2 REAL,
+        QTDEVOLMES3 REAL, CODPROD INTEGER, QT_ESTOQUE REAL, QTRESERV REAL, QTINDENIZ REAL, DTULTPEDCOMPRA INTEGER,
+        BLOQUEADA REAL, CODFORNECEDOR INTEGER, FORNECEDOR TEXT, CATEGORIA TEXT, ROW_HASH TEXT,
+        PRIMARY KEY (CODPROD, NOMES_PRODUTO, CODFILIAL)
+    ''', False),
+    'pcpedi_fornecedor': ('''
+        CODPROD INTEGER NOT NULL, NUMPED INTEGER NOT NULL, DATA_PEDIDO INTEGER, ROW_HASH TEXT,
+        PRIMARY KEY (NUMPED, CODPROD)
+    ''', True),
+    'pcmovendpend': ('''
+        NUMOS INTEGER, QTDITENS INTEGER, TIPOOS INTEGER, NUMCAR TEXT, CODCLIENTE INTEGER, CLIENTE TEXT,
+        CODOPER TEXT, NUMPED INTEGER, DESCRICAO TEXT, NUMTRANSWMS TEXT, NUMPALETE INTEGER, PESO REAL,
+        VOLUME REAL, TEMPOSEP TEXT, TEMPOCONF TEXT, TOTVOL INTEGER, TOTPECAS INTEGER, STATUS TEXT,
+        DEPOSITOORIG INTEGER, DEPOSITODEST INTEGER, MOVIMENT TEXT, DATA INTEGER, CONFERENTE TEXT, ROTA TEXT,
+        DTINICIOOS INTEGER, DTFIMOS INTEGER, ROW_HASH TEXT, PRIMARY KEY (NUMOS, NUMPED)
+    ''', False),
+    'pcpedi': ('''
+        NUMPED INTEGER, NUMCAR INTEGER, DATA INTEGER, CODCLI INTEGER, QT REAL, CODPROD INTEGER, PVENDA REAL,
+        POSICAO TEXT, CODIGO_VENDEDOR INTEGER, NUMNOTA TEXT, OBS TEXT, OBS1 TEXT, OBS2 TEXT, CODFILIAL INTEGER,
+        CODPRACA INTEGER, ROW_HASH TEXT, PRIMARY KEY (NUMPED, CODPROD)
+    ''', False),
+    'pcvendedor': ('''
+        CODIGOVENDA INTEGER, CUSTOPRODUTO REAL, CODPRODUTO INTEGER NOT NULL, CODUSUR INTEGER, CODCLIENTE INTEGER,
+        DATAPEDIDO INTEGER, PEDIDO INTEGER NOT NULL, QUANTIDADE REAL, VALOR REAL, VLBONIFIC REAL, BONIFIC TEXT,
+        ROW_HASH TEXT, PRIMARY KEY (PEDIDO, CODPRODUTO)
+    ''', True),
+    'pcvendedor2': ('''
+        CODIGOVENDEDOR INTEGER, CODPROD INTEGER, PVENDA REAL, QT REAL, NUMPED INTEGER, CODCLI INTEGER, DATA INTEGER,
+        VLBONIFIC REAL, CONDVENDA INTEGER, CODOPER TEXT, ROW_HASH TEXT,
+        PRIMARY KEY (NUMPED, CODPROD, CODIGOVENDEDOR, CODCLI, DATA)
+    ''', False),
+    'pcpedc_posicao': ('''
+        ROTA INTEGER, M_COUNT INTEGER, L_COUNT INTEGER, F_COUNT INTEGER, DESCRICAO TEXT, DATA INTEGER, ROW_HASH TEXT,
+        PRIMARY KEY (ROTA, DATA)
+    ''', False),
+}
+
+# Intervalo mínimo entre sincronizações completas das dimensões (cadastros mudam pouco)
+DIMENSION_SYNC_INTERVAL_MINUTES = 60
+# Intervalo mínimo entre ressincronizações forçadas de uma dimensão por chave sem cadastro local
+DIMENSION_RESYNC_MIN_MINUTES = 15
+# Chaves que nunca existem no cadastro (ex.: COALESCE(CODUSUR, 0) da pcvendedor) e não forçam ressincronização
+DIMENSION_SENTINEL_KEYS = {'0'}
+
+DIMENSION_TABLES = {
+    'dim_produto': {
+        'key': 'CODPROD',
+        'fields': ['CODPROD', 'DESCRICAO', 'CODFORNEC'],
+        'ddl': 'CODPROD INTEGER PRIMARY KEY, DESCRICAO TEXT, CODFORNEC INTEGER',
+        'query': "SELECT CODPROD, DESCRICAO, CODFORNEC FROM PCPRODUT ORDER BY CODPROD",
+    },
+    'dim_fornecedor': {
+        'key': 'CODFORNEC',
+        'fields': ['CODFORNEC', 'FORNECEDOR'],
+        'ddl': 'CODFORNEC INTEGER PRIMARY KEY, FORNECEDOR TEXT',
+        'query': "SELECT CODFORNEC, FORNECEDOR FROM PCFORNEC ORDER BY CODFORNEC",
+    },
+    'dim_cliente': {
+        'key': 'CODCLI',
+        'fields': ['CODCLI', 'CLIENTE', 'FANTASIA', 'ENDERENT', 'BAIRROENT', 'MUNICENT', 'MUNICCOB', 'BLOQUEIO',
+                   'CODCIDADE', 'NOMECIDADE', 'RAMO', 'DIASEMANA', 'PERIODICIDADE'],
+        'ddl': ('CODCLI INTEGER PRIMARY KEY, CLIENTE TEXT, FANTASIA TEXT, ENDERENT TEXT, BAIRROENT TEXT, MUNICENT TEXT, '
+                'MUNICCOB TEXT, BLOQUEIO TEXT, CODCIDADE INTEGER, NOMECIDADE TEXT, RAMO TEXT, DIASEMANA TEXT, PERIODICIDADE TEXT'),
+        'query': """
+            SELECT C.CODCLI, C.CLIENTE, C.FANTASIA, C.ENDERENT, C.BAIRROENT, C.MUNICENT, C.MUNICCOB, C.BLOQUEIO,
+                   CID.CODCIDADE, CID.NOMECIDADE, A.RAMO, R.DIASEMANA, R.PERIODICIDADE
+            FROM PCCLIENT C
+            LEFT JOIN PCCIDADE CID ON C.CODCIDADE = CID.CODCIDADE
+            LEFT JOIN PCATIVI A ON C.CODATV1 = A.CODATIV
+            LEFT JOIN (SELECT CODCLI, DIASEMANA, PERIODICIDADE, ROW_NUMBER() OVER (PARTITION BY CODCLI ORDER BY DIASEMANA) AS rn_rota FROM PCROTACLI) R
+                ON C.CODCLI = R.CODCLI AND R.rn_rota = 1
+            ORDER BY C.CODCLI
+        """,
+    },
+    'dim_usuario': {
+        'key': 'CODUSUR',
+        'fields': ['CODUSUR', 'NOME', 'SUPERVISOR'],
+        'ddl': 'CODUSUR INTEGER PRIMARY KEY, NOME TEXT, SUPERVISOR TEXT',
+        'query': """
+            SELECT U.CODUSUR, U.NOME, S.NOME AS SUPERVISOR
+            FROM PCUSUARI U LEFT JOIN PCSUPERV S ON U.CODSUPERVISOR = S.CODSUPERVISOR
+            ORDER BY U.CODUSUR
+        """,
+    },
+    'dim_praca': {
+        'key': 'CODPRACA',
+        'fields': ['CODPRACA', 'PRACA', 'ROTA'],
+        'ddl': 'CODPRACA INTEGER PRIMARY KEY, PRACA TEXT, ROTA INTEGER',
+        'query': "SELECT CODPRACA, PRACA, ROTA FROM PCPRACA ORDER BY CODPRACA",
+    },
+    'dim_rotaexp': {
+        'key': 'CODROTA',
+        'fields': ['CODROTA', 'DESCRICAO'],
+        'ddl': 'CODROTA INTEGER PRIMARY KEY, DESCRICAO TEXT',
+        'query': "SELECT CODROTA, DESCRICAO FROM PCROTAEXP ORDER BY CODROTA",
+    },
+    'dim_emitente': {
+        'key': 'MATRICULA',
+        'fields': ['MATRICULA', 'NOME'],
+        'ddl': 'MATRICULA INTEGER PRIMARY KEY, NOME TEXT',
+        'query': "SELECT MATRICULA, NOME FROM PCEMPR ORDER BY MATRICULA",
+    },
+}
+
+# Dimensões replicadas em cada arquivo que as junta localmente (VIEWs do SQLite não enxergam bancos anexados)
+FACT_DIMENSIONS = {
+    'pcpedc': ['dim_usuario', 'dim_praca', 'dim_emitente'],
+    'pcpedc_posicao': ['dim_praca', 'dim_rotaexp'],
+    'pcpedi': ['dim_cliente', 'dim_produto', 'dim_usuario', 'dim_praca', 'dim_rotaexp'],
+    'pcpedi_fornecedor': ['dim_produto', 'dim_fornecedor'],
+    'pcvendedor': ['dim_cliente', 'dim_produto', 'dim_fornecedor', 'dim_usuario'],
+    'pcvendedor2': ['dim_cliente', 'dim_produto', 'dim_fornecedor', 'dim_usuario'],
+}
+
+# Coluna da fato -> dimensão referenciada (usado para detectar chaves ainda sem cadastro local)
+FACT_DIMENSION_KEYS = {
+    'pcpedi': {'CODCLI': 'dim_cliente', 'CODPROD': 'dim_produto', 'CODIGO_VENDEDOR': 'dim_usuario', 'CODPRACA': 'dim_praca'},
+    'pcpedi_fornecedor': {'CODPROD': 'dim_produto'},
+    'pcvendedor': {'CODCLIENTE': 'dim_cliente', 'CODPRODUTO': 'dim_produto', 'CODUSUR': 'dim_usuario'},
+    'pcvendedor2': {'CODCLI': 'dim_cliente', 'CODPROD': 'dim_produto', 'CODIGOVENDEDOR': 'dim_usuario'},
+}
+
+# VIEWs com o nome e as colunas originais de cada tabela (datas em 'YYYY-MM-DD' + '<data>_DIA')
+STORAGE_VIEWS = {
+    'vwsomelier': """
+        SELECT f.DESCRICAO_1, f.DESCRICAO_2, f.CODPROD, date(f.DATA + 2440587.5) AS DATA, f.QT, f.PVENDA, f.VLCUSTOFIN,
+               f.CONDVENDA, f.NUMPED, f.CODOPER, date(f.DTCANCEL + 2440587.5) AS DTCANCEL, f.DATA AS DATA_DIA
+        FROM fato_vwsomelier f
+    """,
+    'pcpedc': """
+        SELECT f.CODPROD, f.QT_SAIDA, f.QT_VENDIDA_LIQUIDA, f.PVENDA, f.VALOR_VENDIDO_BRUTO, f.VALOR_VENDIDO_LIQUIDO,
+               f.VALOR_DEVOLVIDO, f.NUMPED, date(f.DATA + 2440587.5) AS DATA, date(f.DATA_DEVOLUCAO + 2440587.5) AS DATA_DEVOLUCAO,
+               f.CONDVENDA, f.NOME, f.CODUSUR, f.CODFILIAL, f.CODPRACA, f.CODCLI, f.NOME_EMITENTE, f.DEVOLUCAO,
+               f.DATA AS DATA_DIA
+        FROM fato_pcpedc f
+    """,
+    'pceest': """
+        SELECT f.NOMES_PRODUTO, f.QTULTENT, date(f.DTULTENT + 2440587.5) AS DTULTENT, date(f.DTULTSAIDA + 2440587.5) AS DTULTSAIDA,
+               f.CODFILIAL, f.QTVENDSEMANA, f.QTVENDSEMANA1, f.QTVENDSEMANA2, f.QTVENDSEMANA3, f.QTVENDMES, f.QTVENDMES1,
+               f.QTVENDMES2, f.QTVENDMES3, f.QTGIRODIA, f.QTDEVOLMES, f.QTDEVOLMES1, f.QTDEVOLMES2, f.QTDEVOLMES3,
+               f.CODPROD, f.QT_ESTOQUE, f.QTRESERV, f.QTINDENIZ, date(f.DTULTPEDCOMPRA + 2440587.5) AS DTULTPEDCOMPRA,
+               f.BLOQUEADA, CAST(f.CODFORNECEDOR AS REAL) AS CODFORNECEDOR, f.FORNECEDOR, f.CATEGORIA,
+               f.DTULTSAIDA AS DTULTSAIDA_DIA
+        FROM fato_pceest f
+    """,
+    'pcpedi_fornecedor': """
+        SELECT f.CODPROD, p.DESCRICAO AS NOME_PRODUTO, f.NUMPED, date(f.DATA_PEDIDO + 2440587.5) AS DATA_PEDIDO, fo.FORNECEDOR,
+               f.DATA_PEDIDO AS DATA_PEDIDO_DIA
+        FROM fato_pcpedi_fornecedor f
+        LEFT JOIN dim_produto p ON p.CODPROD = f.CODPROD
+        LEFT JOIN dim_fornecedor fo ON fo.CODFORNEC = p.CODFORNEC
+    """,
+    'pcmovendpend': """
+        SELECT f.NUMOS, f.QTDITENS, f.TIPOOS, f.NUMCAR, f.CODCLIENTE, f.CLIENTE, f.CODOPER, f.NUMPED, f.DESCRICAO,
+               f.NUMTRANSWMS, f.NUMPALETE, f.PESO, f.VOLUME, f.TEMPOSEP, f.TEMPOCONF, f.TOTVOL, f.TOTPECAS, f.STATUS,
+               f.DEPOSITOORIG, f.DEPOSITODEST, f.MOVIMENT, date(f.DATA + 2440587.5) AS DATA, f.CONFERENTE, f.ROTA,
+               date(f.DTINICIOOS + 2440587.5) AS DTINICIOOS, date(f.DTFIMOS + 2440587.5) AS DTFIMOS,
+               f.DATA AS DATA_DIA, f.DTFIMOS AS DTFIMOS_DIA
+        FROM fato_pcmovendpend f
+    """,
+    'pcpedi': """
+        SELECT f.NUMPED, f.NUMCAR, date(f.DATA + 2440587.5) AS DATA, f.CODCLI, f.QT, f.CODPROD, f.PVENDA, f.POSICAO, c.CLIENTE,
+               p.DESCRICAO AS DESCRICAO_PRODUTO, f.CODIGO_VENDEDOR, u.NOME AS NOME_VENDEDOR,
+               f.NUMNOTA, f.OBS, f.OBS1, f.OBS2, f.CODFILIAL, COALESCE(c.MUNICCOB, 0) AS MUNICIPIO,
+               pr.CODPRACA, pr.PRACA, re.CODROTA, re.DESCRICAO AS DESCRICAO_ROTA, f.DATA AS DATA_DIA
+        FROM fato_pcpedi f
+        LEFT JOIN dim_cliente c ON c.CODCLI = f.CODCLI
+        LEFT JOIN dim_produto p ON p.CODPROD = f.CODPROD
+        LEFT JOIN dim_usuario u ON u.CODUSUR = f.CODIGO_VENDEDOR
+        LEFT JOIN dim_praca pr ON pr.CODPRACA = f.CODPRACA
+        LEFT JOIN dim_rotaexp re ON re.CODROTA = pr.ROTA
+    """,
+    'pcvendedor': """
+        SELECT f.CODIGOVENDA, u.SUPERVISOR, f.CUSTOPRODUTO, c.CODCIDADE, f.CODPRODUTO, f.CODUSUR,
+               COALESCE(u.NOME, '0') AS VENDEDOR, COALESCE(c.DIASEMANA, '0') AS ROTA, COALESCE(c.PERIODICIDADE, '0') AS PERIODO,
+               f.CODCLIENTE, c.CLIENTE, c.FANTASIA, date(f.DATAPEDIDO + 2440587.5) AS DATAPEDIDO, p.DESCRICAO AS PRODUTO,
+               f.PEDIDO, fo.FORNECEDOR, f.QUANTIDADE, c.BLOQUEIO AS BLOQUEADO, f.VALOR, fo.CODFORNEC AS CODFORNECEDOR, c.RAMO,
+               c.ENDERENT AS ENDERECO, c.BAIRROENT AS BAIRRO, c.MUNICENT AS MUNICIPIO, c.NOMECIDADE AS CIDADE,
+               f.VLBONIFIC, f.BONIFIC, f.DATAPEDIDO AS DATAPEDIDO_DIA
+        FROM fato_pcvendedor f
+        LEFT JOIN dim_usuario u ON u.CODUSUR = f.CODUSUR
+        LEFT JOIN dim_cliente c ON c.CODCLI = f.CODCLIENTE
+        LEFT JOIN dim_produto p ON p.CODPROD = f.CODPRODUTO
+        LEFT JOIN dim_fornecedor fo ON fo.CODFORNEC = p.CODFORNEC
+    """,
+    # pcvendedor2 expunha chaves como TEXT; o CAST mantém o contrato (JSON e comparações das páginas).
+    # VLBONIFIC sai como número: o TO_CHAR do Oracle ('12,5') nem convertia no pandas/SQLite das páginas
+    'pcvendedor2': """
+        SELECT f.CODIGOVENDEDOR, CAST(f.CODPROD AS TEXT) AS CODPROD, f.PVENDA, f.QT, CAST(f.NUMPED AS TEXT) AS NUMPED,
+               CAST(f.CODCLI AS TEXT) AS CODCLI, date(f.DATA + 2440587.5) AS DATA,
+               COALESCE(CAST(p.CODFORNEC AS TEXT), '') AS CODFORNECEDOR, COALESCE(fo.FORNECEDOR, '') AS FORNECEDOR,
+               f.VLBONIFIC, CAST(f.CONDVENDA AS TEXT) AS CONDVENDA,
+               COALESCE(p.DESCRICAO, '') AS PRODUTO, COALESCE(u.NOME, '') AS VENDEDOR,
+               COALESCE(c.CLIENTE, '') AS CLIENTE, f.CODOPER, f.DATA AS DATA_DIA
+        FROM fato_pcvendedor2 f
+        LEFT JOIN dim_produto p ON p.CODPROD = f.CODPROD
+        LEFT JOIN dim_fornecedor fo ON fo.CODFORNEC = p.CODFORNEC
+        LEFT JOIN dim_usuario u ON u.CODUSUR = f.CODIGOVENDEDOR
+        LEFT JOIN dim_cliente c ON c.CODCLI = f.CODCLI
+    """,
+    'pcpedc_posicao': """
+        SELECT f.ROTA, f.M_COUNT, f.L_COUNT, f.F_COUNT, f.DESCRICAO, date(f.DATA + 2440587.5) AS DATA, f.DATA AS DATA_DIA
+        FROM fato_pcpedc_posicao f
+    """,
+}
+
+# --- ÍNDICES SECUNDÁRIOS (por arquivo) ---
+# Ficam fora do CREATE TABLE para poderem ser adiados durante a carga inicial em massa.
+# Os compostos/cobertos seguem as consultas registradas em banco_local.py (python banco_local.py verifica os planos).
+SECONDARY_INDEXES = {
+    'vwsomelier': [('idx_vwsomelier_data', 'fato_vwsomelier', 'DATA')],
+    'pcpedc': [('idx_pcpedc_data', 'fato_pcpedc', 'DATA')],
+    'pceest': [('idx_pceest_dtultsaida', 'fato_pceest', 'DTULTSAIDA')],
+    'pcpedi_fornecedor': [('idx_pcpedi_fornecedor_data_pedido', 'fato_pcpedi_fornecedor', 'DATA_PEDIDO')],
+    'pcmovendpend': [
+        # Cobre a consulta de separação do Pedidos (filtro por DATA, ordem por DTFIMOS)
+        ('idx_pcmovendpend_data_conferencia', 'fato_pcmovendpend', 'DATA, DTFIMOS, DTINICIOOS, CONFERENTE, STATUS'),
+        ('idx_pcmovendpend_status', 'fato_pcmovendpend', 'STATUS'),
+    ],
+    'pcpedi': [('idx_pcpedi_data', 'fato_pcpedi', 'DATA')],
+    'pcvendedor': [('idx_pcvendedor_datapedido', 'fato_pcvendedor', 'DATAPEDIDO')],
+    'pcvendedor2': [
+        # Cobre a consulta de vendas do ano do Estoque (DATA + filtros + colunas lidas)
+        ('idx_pcvendedor2_data_vendas', 'fato_pcvendedor2', 'DATA, CONDVENDA, CODCLI, CODIGOVENDEDOR, CODPROD, QT, PVENDA, CODOPER'),
+        ('idx_pcvendedor2_numped', 'fato_pcvendedor2', 'NUMPED'),
+        ('idx_pcvendedor2_codprod', 'fato_pcvendedor2', 'CODPROD'),
+    ],
+    'pcpedc_posicao': [('idx_pcpedc_posicao_data', 'fato_pcpedc_posicao', 'DATA')],
+    # Os índices do staging são usados pelas derivações e nunca são adiados
+    'staging': [
+        ('idx_stg_pcpedi_data', 'stg_pcpedi', 'DATA'),
+        ('idx_stg_pcpedi_numped', 'stg_pcpedi', 'NUMPED, CODPROD'),
+        ('idx_stg_pcpedc_data', 'stg_pcpedc', 'DATA'),
+        ('idx_stg_pcmov_numped', 'stg_pcmov', 'NUMPED, CODPROD'),
+        ('idx_stg_pcmov_dtmov', 'stg_pcmov', 'DTMOV'),
+    ],
+}
+
+# Índices substituídos pelos compostos acima (mesma coluna inicial); removidos em create_secondary_indexes
+SUPERSEDED_INDEXES = {
+    'pcmovendpend': ['idx_pcmovendpend_data'],
+    'pcvendedor2': ['idx_pcvendedor2_data'],
+}
+
+# --- SNAPSHOTS PARQUET (snapshot_parquet.py) ---
+# Publicados por tabela depois de cada sincronização com sucesso, só para exportação; exigem o pyarrow
+PARQUET_SNAPSHOTS = PARQUET_DISPONIVEL
+
+# --- JANELA DE SINCRONIZAÇÃO E CAMADA FRIA (camada_fria.py) ---
+# Cada ciclo revisa os últimos SYNC_WINDOW_MONTHS meses no Oracle
+SYNC_WINDOW_MONTHS = 13
+# Meses fechados anteriores à janela saem do SQLite para o Parquet. Só entram aqui tabelas cujos leitores
+# passam pela camada fria (banco_local.conectar_historico, motor_analitico, endpoints abaixo).
+COLD_TIER_TABLES = ['pcpedc', 'pcvendedor'] if PARQUET_DISPONIVEL else []
+
+# --- CARGA INICIAL RETOMÁVEL ---
+INITIAL_LOAD_START = date(2024, 1, 1)
+# Banco de controle do sincronizador (checkpoints da carga inicial)
+CONTROL_DB = 'controle'
+# Ligado durante a carga inicial: conexões abertas com PRAGMA synchronous=OFF
+_carga_em_massa = threading.Event()
+
+# --- VERSÕES DAS TABELAS (sync_state no controle.db) ---
+# Cada tabela tem uma versão que só sobe quando a sincronização muda alguma linha (ou um cadastro da VIEW).
+# As páginas usam a versão como chave de cache (banco_local.versoes_sync) e /eventos avisa quem escuta.
+SSE_HEARTBEAT_SECONDS = 25
+# Contador em memória: acorda os fluxos de /eventos logo depois de cada registrar_versao
+_versoes_cond = threading.Condition()
+_versoes_seq = 0
+
+# --- ROTAS CHAMADAS DIRETO DO NAVEGADOR ---
+# Os grids (AgGrid) das páginas do Streamlit buscam o detalhe sob demanda em outra origem (porta 5000).
+# Essas rotas exigem o token do login das páginas (acesso.py) e só liberam CORS para as origens de
+# CORS_ORIGENS ('http://servidor:8501,...'); vazio = a página do Streamlit no mesmo host (STREAMLIT_PORTA).
+CORS_ORIGENS = [origem.strip() for origem in os.environ.get('CORS_ORIGENS', '').split(',') if origem.strip()]
+STREAMLIT_PORTA = os.environ.get('STREAMLIT_PORTA', '8501')
+# Prefixos das rotas liberadas
+ROTAS_CORS = ('/detalhe_estoque', '/grade/', '/arvore_fornecedor')
+
+# Dimensões que receberam chave sem cadastro local (ressincronizadas no próximo ciclo, respeitando
+# DIMENSION_RESYNC_MIN_MINUTES) e chaves já reportadas, que não voltam a forçar a ressincronização
+_dimensoes_pendentes = set()
+_chaves_reportadas = {}
+_dimensoes_lock = threading.Lock()
+_ultima_sync_dimensoes = None
+_ultima_sync_por_dimensao = {}
+
 def connect_to_sqlite(db_name):
-    return sqlite3.connect(f'{db_dir}/{db_name}.db', timeout=10)
+    conn = conectar(f'{db_dir}/{db_name}.db', timeout=10)
+    if _carga_em_massa.is_set():
+        conn.execute('PRAGMA synchronous = OFF')
+        conn.execute('PRAGMA temp_store = MEMORY')
+    return conn
 
-def create_sqlite_tables():
-    # Tabela para vwsomelier
-    with connect_to_sqlite('vwsomelier') as conn:
-        cursor = conn.cursor()
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS vwsomelier (
-                DESCRICAO_1 TEXT, DESCRICAO_2 TEXT, CODPROD INTEGER, DATA TEXT, QT REAL, PVENDA REAL,
-                VLCUSTOFIN REAL, CONDVENDA INTEGER, NUMPED INTEGER, CODOPER TEXT, DTCANCEL TEXT,
-                PRIMARY KEY (NUMPED, CODPROD)
-            )
-        ''')
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_vwsomelier_data ON vwsomelier (DATA)')
-        conn.commit()
+def create_secondary_indexes(db_names=None):
+    for db_name in db_names or SECONDARY_INDEXES:
+        with connect_to_sqlite(db_name) as conn:
+            cursor = conn.cursor()
+            for index_name in SUPERSEDED_INDEXES.get(db_name, []):
+                cursor.execute(f'DROP INDEX IF EXISTS {index_name}')
+            for index_name, table_name, columns in SECONDARY_INDEXES[db_name]:
+                cursor.execute(f'CREATE INDEX IF NOT EXISTS {index_name} ON {table_name} ({columns})')
+            conn.commit()
 
-    # Tabela para pcpedc
-    with connect_to_sqlite('pcpedc') as conn:
-        cursor = conn.cursor()
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS pcpedc (
-                CODPROD INTEGER, QT_SAIDA REAL, QT_VENDIDA_LIQUIDA REAL, PVENDA REAL, VALOR_VENDIDO_BRUTO REAL,
-                VALOR_VENDIDO_LIQUIDO REAL, VALOR_DEVOLVIDO REAL, NUMPED INTEGER, DATA TEXT, DATA_DEVOLUCAO TEXT,
-                CONDVENDA INTEGER, NOME TEXT, CODUSUR INTEGER, CODFILIAL INTEGER, CODPRACA INTEGER, CODCLI INTEGER,
-                NOME_EMITENTE TEXT, DEVOLUCAO TEXT, PRIMARY KEY (NUMPED, CODPROD)
-            )
-        ''')
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_pcpedc_data ON pcpedc (DATA)')
-        conn.commit()
+def drop_secondary_indexes(db_names):
+    for db_name in db_names:
+        with connect_to_sqlite(db_name) as conn:
+            cursor = conn.cursor()
+            for index_name, _, _ in SECONDARY_INDEXES[db_name]:
+                cursor.execute(f'DROP INDEX IF EXISTS {index_name}')
+            conn.commit()
 
-    # Tabela para pceest
-    with connect_to_sqlite('pceest') as conn:
-        cursor = conn.cursor()
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS pceest (
-                NOMES_PRODUTO TEXT, QTULTENT REAL, DTULTENT TEXT, DTULTSAIDA TEXT, CODFILIAL INTEGER, QTVENDSEMANA REAL,
-                QTVENDSEMANA1 REAL, QTVENDSEMANA2 REAL, QTVENDSEMANA3 REAL, QTVENDMES REAL, QTVENDMES1 REAL,
-                QTVENDMES2 REAL, QTVENDMES3 REAL, QTGIRODIA REAL, QTDEVOLMES REAL, QTDEVOLMES1 REAL, QTDEVOLMES2 REAL,
-                QTDEVOLMES3 REAL, CODPROD INTEGER, QT_ESTOQUE REAL, QTRESERV REAL, QTINDENIZ REAL, DTULTPEDCOMPRA TEXT,
-                BLOQUEADA REAL, CODFORNECEDOR REAL, FORNECEDOR TEXT, CATEGORIA TEXT,
-                PRIMARY KEY (CODPROD, NOMES_PRODUTO, CODFILIAL)
-            )
-        ''')
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_pceest_dtultsaida ON pceest (DTULTSAIDA)')
-        conn.commit()
+def create_dimension_tables(cursor, db_name):
+    """Cria as dimensões usadas pela fato deste arquivo e a tabela de controle de hash."""
+    for dimension_name in FACT_DIMENSIONS[db_name]:
+        cursor.execute(f"CREATE TABLE IF NOT EXISTS {dimension_name} ({DIMENSION_TABLES[dimension_name]['ddl']})")
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS dim_controle (
+            DIMENSAO TEXT PRIMARY KEY, HASH TEXT, ATUALIZADO_EM TEXT
+        )
+    ''')
 
-    # Tabela para pcpedi_fornecedor
-    with connect_to_sqlite('pcpedi_fornecedor') as conn:
-        cursor = conn.cursor()
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS pcpedi_fornecedor (
-                CODPROD INTEGER, NOME_PRODUTO TEXT, NUMPED INTEGER, DATA_PEDIDO TEXT, FORNECEDOR TEXT,
-                PRIMARY KEY (NUMPED, CODPROD)
-            )
-        ''')
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_pcpedi_fornecedor_data_pedido ON pcpedi_fornecedor (DATA_PEDIDO)')
-        conn.commit()
+def create_storage_table(cursor, db_name):
+    """Cria (ou migra) a tabela de armazenamento do arquivo e a VIEW com o nome original."""
+    cursor.execute("PRAGMA user_version")
+    migrated = cursor.fetchone()[0] < SCHEMA_VERSION and migrate_storage(cursor, db_name)
+    columns, without_rowid = STORAGE_SCHEMAS[db_name]
+    cursor.execute(f"CREATE TABLE IF NOT EXISTS {TABLE_STORAGE[db_name]} ({columns}){' WITHOUT ROWID' if without_rowid else ''}")
+    # A view é refeita quando o SQL de STORAGE_VIEWS mudou (arquivos criados por uma versão anterior)
+    cursor.execute("SELECT sql FROM sqlite_master WHERE type = 'view' AND name = ?", (db_name,))
+    row = cursor.fetchone()
+    if row and row[0].split(' AS ', 1)[-1].strip() != STORAGE_VIEWS[db_name].strip():
+        cursor.execute(f"DROP VIEW {db_name}")
+    cursor.execute(f"CREATE VIEW IF NOT EXISTS {db_name} AS {STORAGE_VIEWS[db_name]}")
+    cursor.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+    return migrated
 
-    # Tabela para pcmovendpend
-    with connect_to_sqlite('pcmovendpend') as conn:
-        cursor = conn.cursor()
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS pcmovendpend (
-                NUMOS INTEGER, QTDITENS INTEGER, TIPOOS INTEGER, NUMCAR TEXT, CODCLIENTE INTEGER, CLIENTE TEXT,
-                CODOPER TEXT, NUMPED INTEGER, DESCRICAO TEXT, NUMTRANSWMS TEXT, NUMPALETE INTEGER, PESO REAL,
-                VOLUME REAL, TEMPOSEP TEXT, TEMPOCONF TEXT, TOTVOL INTEGER, TOTPECAS INTEGER, STATUS TEXT,
-                DEPOSITOORIG INTEGER, DEPOSITODEST INTEGER, MOVIMENT TEXT, DATA TEXT, CONFERENTE TEXT, ROTA TEXT,
-                DTINICIOOS TEXT, DTFIMOS TEXT, PRIMARY KEY (NUMOS, NUMPED)
-            )
-        ''')
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_pcmovendpend_data ON pcmovendpend (DATA)')
-        conn.commit()
+def migrate_storage(cursor, db_name):
+    """
+    Migra para o armazenamento tipado (versão 2). A origem pode ser a fato da versão 1 ou a tabela
+    desnormalizada anterior ao modelo estrela; as datas 'YYYY-MM-DD' viram número do dia.
+    Tudo roda em uma transação: se falhar, o arquivo fica como estava. Retorna True se havia dados a migrar.
+    """
+    storage_table = TABLE_STORAGE[db_name]
+    if not cursor.connection.in_transaction:
+        cursor.execute("BEGIN")
+
+    sources = []
+    for name in (storage_table, db_name):
+        cursor.execute("SELECT type FROM sqlite_master WHERE name = ?", (name,))
+        existing = cursor.fetchone()
+        if existing and existing[0] == 'view':
+            cursor.execute(f"DROP VIEW {name}")
+        elif existing and existing[0] == 'table':
+            cursor.execute(f"ALTER TABLE {name} RENAME TO {name}_v1")
+            sources.append(f"{name}_v1")
+    if not sources:
+        return False
+
+    logger.info(f"Migrando '{db_name}' para o armazenamento tipado (datas como número do dia)...")
+    columns, without_rowid = STORAGE_SCHEMAS[db_name]
+    cursor.execute(f"CREATE TABLE {storage_table} ({columns}){' WITHOUT ROWID' if without_rowid else ''}")
+    cursor.execute(f"PRAGMA table_info({storage_table})")
+    target_columns = [col[1] for col in cursor.fetchall()]
+    day_columns = TABLE_DAY_COLUMNS[db_name]
+    # Tabelas WITHOUT ROWID não aceitam chave nula
+    key_filter = ' AND '.join(f"{key} IS NOT NULL" for key in TABLE_PRIMARY_KEYS[db_name]) if without_rowid else '1 = 1'
+
+    for source in sources:
+        cursor.execute(f"PRAGMA table_info({source})")
+        source_columns = {col[1] for col in cursor.fetchall()}
+        copied = [col for col in target_columns if col in source_columns]
+        select = [DAY_FROM_ISO_SQL.format(col) if col in day_columns else col for col in copied]
+        cursor.execute(
+            f"INSERT OR REPLACE INTO {storage_table} ({', '.join(copied)}) "
+            f"SELECT {', '.join(select)} FROM {source} WHERE {key_filter}"
+        )
+        logger.info(f"'{source}': {cursor.rowcount} linhas copiadas para '{storage_table}'.")
+        cursor.execute(f"DROP TABLE {source}")
+    return True
+
+def storage_placeholders(db_name, columns):
+    """Placeholders do INSERT: colunas de data recebem 'YYYY-MM-DD' e gravam o número do dia."""
+    day_columns = TABLE_DAY_COLUMNS.get(db_name, [])
+    return ', '.join(DAY_FROM_ISO_SQL.format('?') if col in day_columns else '?' for col in columns)
+
+def create_control_tables(cursor):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS carga_inicial (
+            ID INTEGER PRIMARY KEY CHECK (ID = 1), INICIADA_EM TEXT, CONCLUIDA_EM TEXT
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS carga_checkpoint (
+            TABELA TEXT, MES TEXT, CONCLUIDO_EM TEXT, PRIMARY KEY (TABELA, MES)
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS sync_state (
+            TABELA TEXT PRIMARY KEY, VERSAO INTEGER NOT NULL, CONFIRMADO_EM TEXT, LINHAS INTEGER
+        )
+    ''')
+
+def ensure_row_hash_column(cursor, table_name):
+    cursor.execute(f"PRAGMA table_info({table_name})")
+    if 'ROW_HASH' not in [col[1] for col in cursor.fetchall()]:
+        cursor.execute(f"ALTER TABLE {table_name} ADD COLUMN ROW_HASH TEXT")
 
-    # Tabela para pcpedi
-    with connect_to_sqlite('pcpedi') as conn:
+def create_sqlite_tables(create_indexes=True):
+    # Um arquivo por tabela: armazenamento tipado, VIEW com o nome original e dimensões do modelo estrela
+    for db_name in TABLE_DATE_COLUMNS:
+        with connect_to_sqlite(db_name) as conn:
+            cursor = conn.cursor()
+            if db_name in FACT_DIMENSIONS:
+                create_dimension_tables(cursor, db_name)
+            migrated = create_storage_table(cursor, db_name)
+            conn.commit()
+            if migrated:
+                # Devolve ao disco o espaço das tabelas antigas
+                conn.execute("VACUUM")
+
+    # Staging: espelho da janela de PCPEDI, PCPEDC e PCMOV usado pelas tabelas derivadas
+    with connect_to_sqlite(STAGING_DB) as conn:
         cursor = conn.cursor()
         cursor.execute('''
-            CREATE TABLE IF NOT EXISTS pcpedi (
-                NUMPED INTEGER, NUMCAR INTEGER, DATA TEXT, CODCLI INTEGER, QT REAL, CODPROD INTEGER, PVENDA REAL,
-                POSICAO TEXT, CLIENTE TEXT, DESCRICAO_PRODUTO TEXT, CODIGO_VENDEDOR INTEGER, NOME_VENDEDOR TEXT,
-                NUMNOTA TEXT, OBS TEXT, OBS1 TEXT, OBS2 TEXT, CODFILIAL INTEGER, MUNICIPIO INTEGER, CODPRACA INTEGER,
-                PRACA TEXT, CODROTA INTEGER, DESCRICAO_ROTA TEXT, PRIMARY KEY (NUMPED, CODPROD)
+            CREATE TABLE IF NOT EXISTS stg_pcpedi (
+                RID TEXT PRIMARY KEY, NUMPED INTEGER, CODPROD INTEGER, CODCLI INTEGER, CODUSUR INTEGER, DATA TEXT,
+                QT REAL, PVENDA REAL, NUMCAR INTEGER, POSICAO TEXT, VLCUSTOFIN REAL, VLBONIFIC REAL, BONIFIC TEXT
             )
         ''')
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_pcpedi_data ON pcpedi (DATA)')
-        conn.commit()
-
-    # Tabela para pcvendedor
-    with connect_to_sqlite('pcvendedor') as conn:
-        cursor = conn.cursor()
         cursor.execute('''
-            CREATE TABLE IF NOT EXISTS pcvendedor (
-                CODIGOVENDA INTEGER, SUPERVISOR TEXT, CUSTOPRODUTO REAL, CODCIDADE INTEGER, CODPRODUTO INTEGER,
-                CODUSUR INTEGER, VENDEDOR TEXT, ROTA TEXT, PERIODO TEXT, CODCLIENTE INTEGER, CLIENTE TEXT, FANTASIA TEXT,
-                DATAPEDIDO TEXT, PRODUTO TEXT, PEDIDO INTEGER, FORNECEDOR TEXT, QUANTIDADE REAL, BLOQUEADO TEXT, VALOR REAL,
-                CODFORNECEDOR INTEGER, RAMO TEXT, ENDERECO TEXT, BAIRRO TEXT, MUNICIPIO TEXT, CIDADE TEXT, VLBONIFIC REAL,
-                BONIFIC TEXT, PRIMARY KEY (PEDIDO, CODPRODUTO)
+            CREATE TABLE IF NOT EXISTS stg_pcpedc (
+                NUMPED INTEGER PRIMARY KEY, DATA TEXT, CODCLI INTEGER, CONDVENDA INTEGER, CODFILIAL INTEGER,
+                CODPRACA INTEGER, CODEMITENTE INTEGER, POSICAO TEXT, NUMNOTA TEXT, OBS TEXT, OBS1 TEXT, OBS2 TEXT,
+                DTCANCEL TEXT
             )
         ''')
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_pcvendedor_datapedido ON pcvendedor (DATAPEDIDO)')
-        conn.commit()
-
-    # Tabela para pcvendedor2
-    with connect_to_sqlite('pcvendedor2') as conn:
-        cursor = conn.cursor()
         cursor.execute('''
-            CREATE TABLE IF NOT EXISTS pcvendedor2 (
-                CODIGOVENDEDOR INTEGER, CODPROD TEXT, PVENDA REAL, QT REAL, NUMPED TEXT, CODCLI TEXT, DATA TEXT,
-                CODFORNECEDOR TEXT, FORNECEDOR TEXT, VLBONIFIC TEXT, CONDVENDA TEXT, PRODUTO TEXT, VENDEDOR TEXT,
-                CLIENTE TEXT, CODOPER TEXT,
-                PRIMARY KEY (NUMPED, CODPROD, CODIGOVENDEDOR, CODCLI, DATA)
+            CREATE TABLE IF NOT EXISTS stg_pcmov (
+                RID TEXT PRIMARY KEY, NUMPED INTEGER, CODPROD INTEGER, CODOPER TEXT, DTMOV TEXT, QT REAL,
+                CODUSUR INTEGER, CODFILIAL INTEGER
             )
         ''')
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_pcvendedor2_data ON pcvendedor2 (DATA)')
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_pcvendedor2_fornecedor ON pcvendedor2 (FORNECEDOR)')
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_pcvendedor2_numped ON pcvendedor2 (NUMPED)')
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_pcvendedor2_codprod ON pcvendedor2 (CODPROD)')
+        for table_name in STAGING_TABLES:
+            ensure_row_hash_column(cursor, table_name)
         conn.commit()
 
-    # Tabela para pcpedc_posicao
-    with connect_to_sqlite('pcpedc_posicao') as conn:
+    # Checkpoints da carga inicial
+    with connect_to_sqlite(CONTROL_DB) as conn:
         cursor = conn.cursor()
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS pcpedc_posicao (
-                ROTA INTEGER, M_COUNT INTEGER, L_COUNT INTEGER, F_COUNT INTEGER, DESCRICAO TEXT, DATA TEXT,
-                PRIMARY KEY (ROTA, DATA)
-            )
-        ''')
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_pcpedc_posicao_data ON pcpedc_posicao (DATA)')
+        create_control_tables(cursor)
         conn.commit()
 
-@retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=4, max=10))
+    create_secondary_indexes(None if create_indexes else ['staging'])
+
+class OracleIndisponivel(cx_Oracle.DatabaseError):
+    """Circuito aberto: a busca falha sem tentar conectar. Herda de DatabaseError para cair no except das buscas."""
+
+_circuito_oracle = {'estado': 'fechado', 'falhas': 0, 'aberto_em': None}
+_circuito_lock = threading.Lock()
+
+def liberar_acesso_oracle():
+    """
+    Consulta o circuito antes de conectar. Levanta OracleIndisponivel se estiver aberto;
+    retorna True quando esta chamada é a conexão de teste do estado meio-aberto.
+    """
+    with _circuito_lock:
+        if _circuito_oracle['estado'] == 'fechado':
+            return False
+        if _circuito_oracle['estado'] == 'aberto':
+            elapsed = (datetime.now() - _circuito_oracle['aberto_em']).total_seconds()
+            if elapsed < CIRCUIT_OPEN_SECONDS:
+                raise OracleIndisponivel(f"Circuito do Oracle aberto. Nova tentativa em {int(CIRCUIT_OPEN_SECONDS - elapsed)}s.")
+            _circuito_oracle['estado'] = 'meio-aberto'
+            logger.info("Circuito do Oracle meio-aberto. Enviando conexão de teste.")
+            return True
+        # Meio-aberto com teste já em andamento: as demais buscas não esperam
+        raise OracleIndisponivel("Circuito do Oracle meio-aberto. Aguardando a conexão de teste.")
+
+def registrar_resultado_oracle(sucesso):
+    with _circuito_lock:
+        if sucesso:
+            if _circuito_oracle['estado'] != 'fechado':
+                logger.info("Oracle respondeu. Circuito fechado.")
+            _circuito_oracle.update(estado='fechado', falhas=0, aberto_em=None)
+            return
+        _circuito_oracle['falhas'] += 1
+        if _circuito_oracle['estado'] == 'meio-aberto' or _circuito_oracle['falhas'] >= CIRCUIT_FAILURE_THRESHOLD:
+            if _circuito_oracle['estado'] != 'aberto':
+                logger.warning(f"Circuito do Oracle aberto após {_circuito_oracle['falhas']} falha(s). Buscas suspensas por {CIRCUIT_OPEN_SECONDS}s.")
+            _circuito_oracle.update(estado='aberto', aberto_em=datetime.now())
+
+def _abrir_conexao_oracle():
+    dsn = cx_Oracle.makedsn(ORACLE_HOST, ORACLE_PORT, sid=ORACLE_SID)
+    return cx_Oracle.connect(ORACLE_USERNAME, ORACLE_PASSWORD, dsn)
+
+_abrir_conexao_oracle_com_retry = retry(
+    stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=4, max=10),
+    retry=retry_if_exception_type(cx_Oracle.DatabaseError), reraise=True
+)(_abrir_conexao_oracle)
+
 def connect_to_oracle():
+    # A conexão de teste do meio-aberto é uma tentativa só, sem retry
+    probe = liberar_acesso_oracle()
     try:
-        dsn = cx_Oracle.makedsn(ORACLE_HOST, ORACLE_PORT, sid=ORACLE_SID)
-        return cx_Oracle.connect(ORACLE_USERNAME, ORACLE_PASSWORD, dsn)
-    except cx_Oracle.DatabaseError as e:
+        connection = _abrir_conexao_oracle() if probe else _abrir_conexao_oracle_com_retry()
+    except Exception as e:
+        registrar_resultado_oracle(False)
         logger.error(f"Erro ao conectar com o banco de dados Oracle: {e}")
         raise
+    registrar_resultado_oracle(True)
+    connection.call_timeout = ORACLE_CALL_TIMEOUT_MS
+    configure_oracle_session(connection)
+    return connection
+
+def date_output_type_handler(cursor, name, default_type, size, precision, scale):
+    # DATE/TIMESTAMP chegam como texto 'YYYY-MM-DD' (formato da sessão), sem conversão linha a linha no Python
+    if default_type in (cx_Oracle.DB_TYPE_DATE, cx_Oracle.DB_TYPE_TIMESTAMP):
+        return cursor.var(str, 10, arraysize=cursor.arraysize)
+
+def configure_oracle_session(connection):
+    cursor = connection.cursor()
+    try:
+        cursor.execute("ALTER SESSION SET NLS_DATE_FORMAT = 'YYYY-MM-DD' NLS_TIMESTAMP_FORMAT = 'YYYY-MM-DD'")
+    finally:
+        cursor.close()
+    connection.outputtypehandler = date_output_type_handler
+
+def oracle_cursor(connection):
+    cursor = connection.cursor()
+    cursor.arraysize = ORACLE_ARRAYSIZE
+    cursor.prefetchrows = ORACLE_PREFETCHROWS
+    return cursor
+
+def check_missing_dimension_keys(cursor, db_name, fields, new_data):
+    """
+    Marca para ressincronizar as dimensões que receberam chaves ainda sem cadastro local. Chaves sentinela e
+    chaves já reportadas (ex.: produto excluído do PCPRODUT, que continua faltando depois da ressincronização)
+    não marcam de novo; elas entram na sincronização completa de DIMENSION_SYNC_INTERVAL_MINUTES.
+    """
+    for field, dimension_name in FACT_DIMENSION_KEYS.get(db_name, {}).items():
+        if field not in fields:
+            continue
+        position = fields.index(field)
+        incoming_keys = {str(row[position]) for row in new_data if row[position] not in (None, '')} - DIMENSION_SENTINEL_KEYS
+        if not incoming_keys:
+            continue
+        cursor.execute(f"SELECT {DIMENSION_TABLES[dimension_name]['key']} FROM {dimension_name}")
+        known_keys = {str(row[0]) for row in cursor.fetchall()}
+        with _dimensoes_lock:
+            reportadas = _chaves_reportadas.setdefault(dimension_name, set())
+            missing = incoming_keys - known_keys - reportadas
+            if not missing:
+                continue
+            reportadas.update(missing)
+            _dimensoes_pendentes.add(dimension_name)
+        logger.info(f"'{db_name}' recebeu {len(missing)} chave(s) de '{dimension_name}' sem cadastro local. A dimensão será ressincronizada.")
+
+def row_hash(values):
+    return hashlib.md5(repr(tuple(values)).encode()).hexdigest()
+
+def row_hashes(rows):
+    # Função de módulo para poder ser enviada ao ProcessPoolExecutor
+    return [row_hash(values) for values in rows]
+
+_process_pool = None
+_process_pool_lock = threading.Lock()
+
+def get_process_pool():
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is None:
+            _process_pool = ProcessPoolExecutor(max_workers=SYNC_PROCESS_WORKERS)
+        return _process_pool
+
+def hash_rows(rows):
+    """
+    Acrescenta o ROW_HASH ao fim de cada linha e devolve (linhas, hash do lote).
+    Com SYNC_PROCESS_POOL ligado, lotes grandes são divididos entre processos.
+    """
+    if SYNC_PROCESS_POOL and len(rows) > SYNC_PROCESS_CHUNK_ROWS:
+        chunks = [rows[i:i + SYNC_PROCESS_CHUNK_ROWS] for i in range(0, len(rows), SYNC_PROCESS_CHUNK_ROWS)]
+        hashes = [h for chunk_hashes in get_process_pool().map(row_hashes, chunks) for h in chunk_hashes]
+    else:
+        hashes = row_hashes(rows)
+    data_hash = hashlib.md5(''.join(hashes).encode()).hexdigest()
+    return [(*values, h) for values, h in zip(rows, hashes)], data_hash
+
+def merge_rows(cursor, table_name, fields, key_fields, rows, window_sql='1 = 1', window_params=(), placeholders=None,
+               batched=False):
+    """
+    Aplica as linhas recebidas (já com ROW_HASH no fim, ver hash_rows) sobre a tabela por diferença: INSERT das chaves novas, UPDATE só das
+    linhas cujo ROW_HASH mudou e DELETE das chaves da janela que não vieram mais.
+    As linhas passam por uma tabela temporária com as mesmas afinidades de tipo da tabela destino,
+    assim a comparação de chaves segue a mesma conversão que o SQLite faria no INSERT.
+    'placeholders' permite converter valores no INSERT (ex.: datas para número do dia).
+    Com batched=True, 'rows' é um iterável de lotes (ver fetch_batches), gravados um a um na tabela temporária.
+    Retorna (inseridos, atualizados, removidos).
+    """
+    columns = fields + ['ROW_HASH']
+    placeholders = placeholders or ', '.join('?' for _ in columns)
+    key_match = ' AND '.join(f"i.{key} = t.{key}" for key in key_fields)
+
+    cursor.execute("DROP TABLE IF EXISTS temp.merge_entrada")
+    cursor.execute(f"CREATE TEMP TABLE merge_entrada AS SELECT {', '.join(columns)} FROM main.{table_name} WHERE 0")
+    cursor.execute(f"CREATE UNIQUE INDEX temp.idx_merge_entrada ON merge_entrada ({', '.join(key_fields)})")
+    for batch in (rows if batched else [rows]):
+        cursor.executemany(
+            f"INSERT OR REPLACE INTO temp.merge_entrada ({', '.join(columns)}) VALUES ({placeholders})",
+            batch
+        )
+
+    cursor.execute(
+        f"DELETE FROM main.{table_name} AS t WHERE ({window_sql}) "
+        f"AND NOT EXISTS (SELECT 1 FROM temp.merge_entrada i WHERE {key_match})",
+        window_params
+    )
+    deleted = cursor.rowcount
+
+    cursor.execute(
+        f"UPDATE main.{table_name} AS t SET {', '.join(f'{col} = i.{col}' for col in columns)} "
+        f"FROM temp.merge_entrada AS i WHERE {key_match} AND t.ROW_HASH IS NOT i.ROW_HASH"
+    )
+    updated = cursor.rowcount
+
+    cursor.execute(
+        f"INSERT INTO main.{table_name} ({', '.join(columns)}) "
+        f"SELECT {', '.join(columns)} FROM temp.merge_entrada i "
+        f"WHERE NOT EXISTS (SELECT 1 FROM main.{table_name} t WHERE {key_match})"
+    )
+    inserted = cursor.rowcount
+
+    cursor.execute("DROP TABLE temp.merge_entrada")
+    return inserted, updated, deleted
+
+def registrar_versao(db_name, linhas=None):
+    """Sobe a versão da tabela no sync_state (LINHAS = linhas da fato quente, se informado) e acorda /eventos."""
+    global _versoes_seq
+    try:
+        with connect_to_sqlite(CONTROL_DB) as conn:
+            conn.execute('''
+                INSERT INTO sync_state (TABELA, VERSAO, CONFIRMADO_EM, LINHAS) VALUES (?, 1, ?, ?)
+                ON CONFLICT (TABELA) DO UPDATE SET
+                    VERSAO = VERSAO + 1, CONFIRMADO_EM = excluded.CONFIRMADO_EM, LINHAS = COALESCE(excluded.LINHAS, LINHAS)
+            ''', (db_name, datetime.now().strftime('%Y-%m-%d %H:%M:%S'), linhas))
+            conn.commit()
+    except sqlite3.Error as e:
+        logger.error(f"Erro ao registrar a versão de '{db_name}': {e}")
+        return
+    with _versoes_cond:
+        _versoes_seq += 1
+        _versoes_cond.notify_all()
+
+def ler_versoes():
+    """{tabela: versão} do sync_state."""
+    with connect_to_sqlite(CONTROL_DB) as conn:
+        return dict(conn.execute("SELECT TABELA, VERSAO FROM sync_state").fetchall())
 
 def review_and_update_data(db_name, fetch_function, fields, start_date, end_date, is_initial_load):
     try:
         log_prefix = f"[{'CARGA INICIAL' if is_initial_load else 'ATUALIZAÇÃO'}]"
         logger.info(f"{log_prefix} Buscando dados para '{db_name}' de {start_date} a {end_date}")
-        new_data, _ = fetch_function(start_date, end_date, 1, 999999999)
+        new_data, data_hash = fetch_function(start_date, end_date, 1, 999999999)
 
-        if not new_data and not is_initial_load:
+        if data_hash is None:
+            logger.warning(f"{log_prefix} Busca de '{db_name}' falhou. Tabela mantida como está.")
+            return False
+
+        if not new_data:
             logger.info(f"{log_prefix} Nenhum dado novo retornado do Oracle para '{db_name}' no período. Nenhuma ação necessária.")
-            return
+            return True
+
+        # Tabelas do modelo estrela são gravadas na fato; o nome original é uma VIEW
+        storage_table = TABLE_STORAGE[db_name]
+        date_column = TABLE_DATE_COLUMNS.get(db_name)
+        columns = fields + ['ROW_HASH']
+        placeholders = storage_placeholders(db_name, columns)
+        window_sql = f"{date_column} BETWEEN {DAY_FROM_ISO_SQL.format('?')} AND {DAY_FROM_ISO_SQL.format('?')}"
+        # Buscas devolvem tuplas já na ordem de 'fields', com o ROW_HASH no fim
+        insert_values = new_data
+        # Derivadas trazem linhas de pedidos antigos com movimento na janela (pcvendedor filtra por DTMOV):
+        # as de meses já congelados ficam de fora, senão voltam à fato e o congelamento as apaga de novo
+        manifesto_frio = carregar_manifesto_frio(db_name, db_dir) if db_name in COLD_TIER_TABLES else None
+        if manifesto_frio and manifesto_frio['congelado_ate'] is not None:
+            congelado_ate = date.fromordinal(manifesto_frio['congelado_ate'] + 719163).isoformat()
+            posicao = fields.index(date_column)
+            insert_values = [row for row in new_data if row[posicao] is None or str(row[posicao])[:10] >= congelado_ate]
+            if len(insert_values) < len(new_data):
+                logger.info(f"{log_prefix} '{db_name}': {len(new_data) - len(insert_values)} linha(s) de meses congelados ignorada(s).")
 
         with connect_to_sqlite(db_name) as conn:
             cursor = conn.cursor()
 
-            if is_initial_load:
-                logger.info(f"{log_prefix} Limpando a tabela '{db_name}' para carga inicial completa...")
-                cursor.execute(f"DELETE FROM {db_name}")
+            if SYNC_WRITE_MODE == 'merge' and not is_initial_load and date_column:
+                inserted, updated, deleted = merge_rows(
+                    cursor, storage_table, fields, TABLE_PRIMARY_KEYS[db_name], insert_values,
+                    f"t.{window_sql}", (start_date.strftime('%Y-%m-%d'), end_date.strftime('%Y-%m-%d')), placeholders
+                )
+                logger.info(f"{log_prefix} Merge em '{storage_table}': {inserted} inseridos, {updated} atualizados, {deleted} removidos.")
+                alterada = inserted + updated + deleted > 0
             else:
-                date_column = TABLE_DATE_COLUMNS.get(db_name)
-                if date_column:
-                    logger.info(f"{log_prefix} Limpando dados da janela de 13 meses da tabela '{db_name}'...")
-                    cursor.execute(
-                        f"DELETE FROM {db_name} WHERE {date_column} BETWEEN ? AND ?",
-                        (start_date.strftime('%Y-%m-%d'), end_date.strftime('%Y-%m-%d'))
-                    )
-                else:
-                    logger.warning(f"{log_prefix} Coluna de data não mapeada para '{db_name}'. Pulando delete otimizado.")
+                alterada = True
+                # Na carga inicial não há limpeza: cada bloco mensal é uma transação e o INSERT OR REPLACE
+                # torna a repetição de um bloco interrompido idempotente
+                if not is_initial_load:
+                    if date_column:
+                        logger.info(f"{log_prefix} Limpando dados da janela de 13 meses da tabela '{storage_table}'...")
+                        cursor.execute(
+                            f"DELETE FROM {storage_table} WHERE {window_sql}",
+                            (start_date.strftime('%Y-%m-%d'), end_date.strftime('%Y-%m-%d'))
+                        )
+                    else:
+                        logger.warning(f"{log_prefix} Coluna de data não mapeada para '{db_name}'. Pulando delete otimizado.")
 
-            if new_data:
-                placeholders = ', '.join('?' for _ in fields)
-                insert_query = f"INSERT OR REPLACE INTO {db_name} ({', '.join(fields)}) VALUES ({placeholders})"
-                insert_values = [[row.get(field) for field in fields] for row in new_data]
-                
-                cursor.executemany(insert_query, insert_values)
-                logger.info(f"{log_prefix} Inseridos/Atualizados {len(insert_values)} registros na tabela '{db_name}'")
-            else:
-                logger.info(f"{log_prefix} Nenhum dado novo para inserir em '{db_name}'.")
+                if insert_values:
+                    insert_query = f"INSERT OR REPLACE INTO {storage_table} ({', '.join(columns)}) VALUES ({placeholders})"
+                    cursor.executemany(insert_query, insert_values)
+                    logger.info(f"{log_prefix} Inseridos/Atualizados {len(insert_values)} registros na tabela '{storage_table}'")
+
+            check_missing_dimension_keys(cursor, db_name, fields, new_data)
 
+            linhas = None
+            if alterada:
+                cursor.execute(f"SELECT COUNT(*) FROM {storage_table}")
+                linhas = cursor.fetchone()[0]
             conn.commit()
             logger.info(f"{log_prefix} Sincronização da tabela '{db_name}' concluída com sucesso.")
+        if alterada:
+            registrar_versao(db_name, linhas)
+        return True
 
     except sqlite3.Error as e:
         logger.error(f"Erro de SQLite ao recarregar dados de '{db_name}': {e}")
     except Exception as e:
         logger.error(f"Erro inesperado em review_and_update_data para '{db_name}': {e}")
+    return False
 
-# --- FUNÇÕES DE BUSCA DE DADOS DO ORACLE (ORIGINAIS) ---
+# --- SINCRONIZAÇÃO DAS DIMENSÕES (CADASTROS) ---
 
-def get_oracle_data_paginated_vwsomelier(data_inicial, data_final, pagina, limite, last_update=None):
+def get_oracle_dimension(dimension_name):
+    """Busca a dimensão completa no Oracle. Retorna (linhas, hash) ou (None, None) em caso de erro."""
     try:
         connection = connect_to_oracle()
-        if connection is None: return [], None
-        cursor = connection.cursor()
-        offset = (pagina - 1) * limite
-        query = """
-            WITH base_filtrada AS (
-            SELECT 
-                VS.DESCRICAO, VS.CODPROD, VS.DATA, VS.QT, VS.PVENDA, VS.VLCUSTOFIN, VS.CONDVENDA, VS.NUMPED,
-                PM.CODOPER, PC.DTCANCEL,
-                ROW_NUMBER() OVER (ORDER BY VS.DATA) AS row_num
-            FROM VW_SOMELIER VS
-            LEFT JOIN PCMOV PM ON VS.NUMPED = PM.NUMPED AND VS.CODPROD = PM.CODPROD
-            LEFT JOIN PCPEDC PC ON PM.NUMPED = PC.NUMPED
-            WHERE TRUNC(VS.DATA) BETWEEN :data_inicial AND :data_final 
-                AND VS.CONDVENDA = 1
-                AND VS.CODUSUR NOT IN (219, 3, 63, 100, 12, 104, 186, 217, 172, 173, 73, 144, 107, 207, 174, 149, 167, 199, 191, 218, 196, 214, 96) 
-                AND (PM.CODOPER IN ('S', 'ED') OR PM.CODOPER IS NULL)
-                AND VS.CODFILIAL IN (1, 2)
-            ),
-            validos AS (
-                SELECT * FROM base_filtrada bf
-                WHERE (bf.CODOPER IS NULL OR bf.CODOPER = 'S')
-                AND NOT EXISTS (
-                    SELECT 1 FROM PCMOV pm2
-                    WHERE pm2.NUMPED = bf.NUMPED AND pm2.CODPROD = bf.CODPROD AND pm2.CODOPER = 'ED'
-                )
-            )
-            SELECT DISTINCT 
-                DESCRICAO AS DESCRICAO_1, DESCRICAO AS DESCRICAO_2, CODPROD, DATA, QT, PVENDA, VLCUSTOFIN,
-                CONDVENDA, NUMPED, CODOPER, DTCANCEL 
-            FROM validos
-            WHERE row_num > :offset AND row_num <= :offset_plus_limit AND DTCANCEL IS NULL
-            ORDER BY DATA
-        """
-        params = {'data_inicial': data_inicial, 'data_final': data_final, 'offset': offset, 'offset_plus_limit': offset + limite}
-        cursor.execute(query, params)
+        if connection is None: return None, None
+        cursor = oracle_cursor(connection)
+        cursor.execute(DIMENSION_TABLES[dimension_name]['query'])
         rows = cursor.fetchall()
         data_hash = hashlib.md5(str(rows).encode()).hexdigest()
-        results = [{'DESCRICAO_1': row[0], 'DESCRICAO_2': row[1], 'CODPROD': row[2], 'DATA': row[3].strftime('%Y-%m-%d') if isinstance(row[3], (date, datetime)) else None, 'QT': row[4], 'PVENDA': row[5], 'VLCUSTOFIN': row[6], 'CONDVENDA': row[7], 'NUMPED': row[8], 'CODOPER': row[9], 'DTCANCEL': row[10].strftime('%Y-%m-%d') if isinstance(row[10], (date, datetime)) else None} for row in rows]
-        return results, data_hash
+        return rows, data_hash
     except cx_Oracle.DatabaseError as e:
-        logger.error(f"Ocorreu um erro ao executar a consulta vwsomelier: {e}")
-        return [], None
+        logger.error(f"Ocorreu um erro ao buscar a dimensão {dimension_name}: {e}")
+        return None, None
     finally:
         if 'cursor' in locals() and cursor: cursor.close()
         if 'connection' in locals() and connection: connection.close()
 
+def sincronizar_dimensoes(dimensoes=None):
+    """
+    Copia os cadastros (produto, fornecedor, cliente, usuário, praça, rota) para cada arquivo de fato;
+    com 'dimensoes', só as listadas. Só regrava a dimensão local quando o hash do conteúdo mudou.
+    """
+    global _ultima_sync_dimensoes
+    for dimension_name in dimensoes or DIMENSION_TABLES:
+        config = DIMENSION_TABLES[dimension_name]
+        rows, data_hash = get_oracle_dimension(dimension_name)
+        with _dimensoes_lock:
+            # Tentativa conta para o intervalo mínimo mesmo se o Oracle falhou; a pendência só sai com sucesso
+            _ultima_sync_por_dimensao[dimension_name] = datetime.now()
+            if rows is not None:
+                _dimensoes_pendentes.discard(dimension_name)
+        if rows is None:
+            continue
+
+        for db_name in [name for name, dims in FACT_DIMENSIONS.items() if dimension_name in dims]:
+            try:
+                with connect_to_sqlite(db_name) as conn:
+                    cursor = conn.cursor()
+                    cursor.execute("SELECT HASH FROM dim_controle WHERE DIMENSAO = ?", (dimension_name,))
+                    stored = cursor.fetchone()
+                    if stored and stored[0] == data_hash:
+                        continue
+
+                    placeholders = ', '.join('?' for _ in config['fields'])
+                    cursor.execute(f"DELETE FROM {dimension_name}")
+                    cursor.executemany(
+                        f"INSERT OR REPLACE INTO {dimension_name} ({', '.join(config['fields'])}) VALUES ({placeholders})", rows
+                    )
+                    cursor.execute(
+                        "INSERT OR REPLACE INTO dim_controle (DIMENSAO, HASH, ATUALIZADO_EM) VALUES (?, ?, ?)",
+                        (dimension_name, data_hash, datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
+                    )
+                    conn.commit()
+                    logger.info(f"Dimensão '{dimension_name}' atualizada em '{db_name}' ({len(rows)} registros).")
+                # A VIEW da tabela mostra o cadastro: nova versão para as páginas recarregarem
+                registrar_versao(db_name)
+            except sqlite3.Error as e:
+                logger.error(f"Erro de SQLite ao gravar a dimensão '{dimension_name}' em '{db_name}': {e}")
+
+    if dimensoes is None:
+        _ultima_sync_dimensoes = datetime.now()
+
+# --- FUNÇÕES DE BUSCA DE DADOS DO ORACLE (ORIGINAIS) ---
+
 def get_oracle_data_paginated_vwsomelier(data_inicial, data_final, pagina, limite, last_update=None):
     try:
         connection = connect_to_oracle()
         if connection is None:
             return [], None
-        cursor = connection.cursor()
+        cursor = oracle_cursor(connection)
         offset = (pagina - 1) * limite
         query = """
             WITH base_filtrada AS (
@@ -353,91 +1010,18 @@ def get_oracle_data_paginated_vwsomelier(data_inicial, data_final, pagina, limit
         }
         cursor.execute(query, params)
         rows = cursor.fetchall()
-        data_hash = hashlib.md5(str(rows).encode()).hexdigest()
-        results = [
-            {
-                'DESCRICAO_1': row[0], 'DESCRICAO_2': row[1], 'CODPROD': row[2],
-                'DATA': row[3].strftime('%Y-%m-%d') if isinstance(row[3], (date, datetime)) else None,
-                'QT': row[4], 'PVENDA': row[5], 'VLCUSTOFIN': row[6], 'CONDVENDA': row[7],
-                'NUMPED': row[8], 'CODOPER': row[9],
-                'DTCANCEL': row[10].strftime('%Y-%m-%d') if isinstance(row[10], (date, datetime)) else None
-            } for row in rows
-        ]
-        return results, data_hash
+        return hash_rows(rows)
     except cx_Oracle.DatabaseError as e:
         logger.error(f"Ocorreu um erro ao executar a consulta vwsomelier: {e}")
         return [], None
     finally:
         if 'cursor' in locals() and cursor: cursor.close()
         if 'connection' in locals() and connection: connection.close()
-def get_oracle_data_paginated_pcpedc(data_inicial, data_final, pagina, limite, last_update=None):
-    try:
-        connection = connect_to_oracle()
-        if connection is None: return [], None
-        cursor = connection.cursor()
-        offset = (pagina - 1) * limite
-        query = """
-            SELECT DISTINCT
-                PC.CODPROD, PC.QT_SAIDA, (PC.QT_SAIDA - COALESCE(PM.QT_DEVOLUCAO, 0)) AS QT_VENDIDA_LIQUIDA,
-                PC.PVENDA, (PC.QT_SAIDA * PC.PVENDA) AS VALOR_VENDIDO_BRUTO,
-                ((PC.QT_SAIDA - COALESCE(PM.QT_DEVOLUCAO, 0)) * PC.PVENDA) AS VALOR_VENDIDO_LIQUIDO,
-                -(COALESCE(PM.QT_DEVOLUCAO, 0) * PC.PVENDA) AS VALOR_DEVOLVIDO, PC.NUMPED, PC.DATA,
-                DATA_DEVOLUCAO, PCC.CONDVENDA, PU.NOME AS NOME, PC.CODUSUR, PCC.CODFILIAL,
-                PR.PRACA AS CODPRACA, PCC.CODCLI, EM.NOME AS NOME_EMITENTE,
-                CASE WHEN PM.QT_DEVOLUCAO > 0 THEN 'S/ED' ELSE 'S' END AS DEVOLUCAO
-            FROM (
-                SELECT DISTINCT CODPROD, QT AS QT_SAIDA, NUMPED, DATA, PVENDA, CODUSUR, CODCLI,
-                    ROW_NUMBER() OVER (ORDER BY DATA) AS row_num
-                FROM PCPEDI
-                WHERE CODCLI NOT IN (91530, 111564, 112598, 1, 3)
-                    AND CODUSUR NOT IN (219, 3, 63, 100, 12, 104, 217, 172, 173, 73, 144, 107, 207, 174, 149, 167, 199, 191, 196, 214, 96)
-            ) PC
-            LEFT JOIN PCPEDC PCC ON PC.NUMPED = PCC.NUMPED
-            LEFT JOIN PCPRACA PR ON PCC.CODPRACA = PR.CODPRACA
-            LEFT JOIN PCUSUARI PU ON PC.CODUSUR = PU.CODUSUR
-            LEFT JOIN PCEMPR EM ON PCC.CODEMITENTE = EM.MATRICULA
-            LEFT JOIN (
-                SELECT NUMPED, CODPROD, SUM(QT) AS QT_DEVOLUCAO, MAX(DTMOV) AS DATA_DEVOLUCAO
-                FROM PCMOV WHERE CODOPER = 'ED' GROUP BY NUMPED, CODPROD
-            ) PM ON PC.NUMPED = PM.NUMPED AND PC.CODPROD = PM.CODPROD
-            WHERE PC.DATA BETWEEN :data_inicial AND :data_final
-                AND PCC.CONDVENDA = 1
-                AND PCC.CODFILIAL IN (1, 2)
-                AND PCC.DTCANCEL IS NULL
-                AND (PC.QT_SAIDA - COALESCE(PM.QT_DEVOLUCAO, 0)) >= 0
-                AND PC.row_num > :offset
-                AND PC.row_num <= :offset_plus_limit
-            ORDER BY PC.DATA
-        """
-        params = {
-            'data_inicial': data_inicial, 'data_final': data_final,
-            'offset': offset, 'offset_plus_limit': offset + limite
-        }
-        cursor.execute(query, params)
-        rows = cursor.fetchall()
-        data_hash = hashlib.md5(str(rows).encode()).hexdigest()
-        results = [
-            {
-                'CODPROD': row[0], 'QT_SAIDA': row[1], 'QT_VENDIDA_LIQUIDA': row[2], 'PVENDA': row[3],
-                'VALOR_VENDIDO_BRUTO': row[4], 'VALOR_VENDIDO_LIQUIDO': row[5], 'VALOR_DEVOLVIDO': row[6],
-                'NUMPED': row[7], 'DATA': row[8].strftime('%Y-%m-%d') if row[8] else None,
-                'DATA_DEVOLUCAO': row[9].strftime('%Y-%m-%d') if row[9] else None,
-                'CONDVENDA': row[10], 'NOME': row[11], 'CODUSUR': row[12], 'CODFILIAL': row[13],
-                'CODPRACA': row[14], 'CODCLI': row[15], 'NOME_EMITENTE': row[16], 'DEVOLUCAO': row[17]
-            } for row in rows
-        ]
-        return results, data_hash
-    except cx_Oracle.DatabaseError as e:
-        logger.error(f"Ocorreu um erro ao executar a consulta pcpedc: {e}")
-        return [], None
-    finally:
-        if 'cursor' in locals() and cursor: cursor.close()
-        if 'connection' in locals() and connection: connection.close()
 def get_oracle_data_paginated_pcest(data_inicial, data_final, pagina, limite, last_update=None):
     try:
         connection = connect_to_oracle()
         if connection is None: return [], None
-        cursor = connection.cursor()
+        cursor = oracle_cursor(connection)
         offset = (pagina - 1) * limite
         query = """
             SELECT NOMES_PRODUTO, QTULTENT, DTULTENT, DTULTSAIDA, CODFILIAL, QTVENDSEMANA, QTVENDSEMANA1, QTVENDSEMANA2,
@@ -466,65 +1050,19 @@ def get_oracle_data_paginated_pcest(data_inicial, data_final, pagina, limite, la
             'offset': offset, 'offset_plus_limit': offset + limite
         }
         cursor.execute(query, params)
-        colnames = [desc[0] for desc in cursor.description]
         rows = cursor.fetchall()
-        data_hash = hashlib.md5(str(rows).encode()).hexdigest()
-        results = []
-        for row in rows:
-            row_dict = dict(zip(colnames, row))
-            for key in ['DTULTENT', 'DTULTSAIDA', 'DTULTPEDCOMPRA']:
-                if row_dict.get(key) and isinstance(row_dict[key], (date, datetime)):
-                    row_dict[key] = row_dict[key].strftime('%Y-%m-%d')
-            results.append(row_dict)
-        return results, data_hash
+        return hash_rows(rows)
     except cx_Oracle.DatabaseError as e:
         logger.error(f"Ocorreu um erro ao executar a consulta pceest: {e}")
         return [], None
     finally:
         if 'cursor' in locals() and cursor: cursor.close()
         if 'connection' in locals() and connection: connection.close()
-def get_oracle_data_with_supplier(data_inicial, data_final, pagina, limite, last_update=None):
-    try:
-        connection = connect_to_oracle()
-        if connection is None: return [], None
-        cursor = connection.cursor()
-        offset = (pagina - 1) * limite
-        query = """
-            SELECT PE.CODPROD, PR.DESCRICAO AS NOME_PRODUTO, PE.NUMPED, PE.DATA AS DATA_PEDIDO, F.FORNECEDOR
-            FROM (
-                SELECT CODPROD, NUMPED, DATA, ROW_NUMBER() OVER (ORDER BY DATA) AS row_num
-                FROM PCPEDI WHERE TRUNC(DATA) BETWEEN :data_inicial AND :data_final
-            ) PE
-            LEFT JOIN PCPRODUT PR ON PE.CODPROD = PR.CODPROD
-            LEFT JOIN PCFORNEC F ON PR.CODFORNEC = F.CODFORNEC
-            WHERE PE.row_num > :offset AND PE.row_num <= :offset_plus_limit
-        """
-        params = {
-            'data_inicial': data_inicial, 'data_final': data_final,
-            'offset': offset, 'offset_plus_limit': offset + limite
-        }
-        cursor.execute(query, params)
-        rows = cursor.fetchall()
-        data_hash = hashlib.md5(str(rows).encode()).hexdigest()
-        results = [
-            {
-                'CODPROD': row[0], 'NOME_PRODUTO': row[1], 'NUMPED': row[2],
-                'DATA_PEDIDO': row[3].strftime('%Y-%m-%d') if row[3] else None,
-                'FORNECEDOR': row[4]
-            } for row in rows
-        ]
-        return results, data_hash
-    except cx_Oracle.DatabaseError as e:
-        logger.error(f"Ocorreu um erro ao executar a consulta pcpedi_fornecedor: {e}")
-        return [], None
-    finally:
-        if 'cursor' in locals() and cursor: cursor.close()
-        if 'connection' in locals() and connection: connection.close()
 def get_oracle_data_pcmovendpend(data_inicial, data_final, pagina, limite, last_update=None):
     try:
         connection = connect_to_oracle()
         if connection is None: return [], None
-        cursor = connection.cursor()
+        cursor = oracle_cursor(connection)
         offset = (pagina - 1) * limite
         query = """
         SELECT * FROM (
@@ -566,333 +1104,527 @@ def get_oracle_data_pcmovendpend(data_inicial, data_final, pagina, limite, last_
             'offset': offset, 'offset_plus_limit': offset + limite
         }
         cursor.execute(query, params)
-        colnames = [desc[0] for desc in cursor.description][1:]
+        # Descarta a coluna rn da paginação já no driver
+        cursor.rowfactory = lambda rn, *row: row
         rows = cursor.fetchall()
-        data_hash = hashlib.md5(str(rows).encode()).hexdigest()
-        results = []
-        for row in rows:
-            row_dict = dict(zip(colnames, row[1:]))
-            for key in ['DATA', 'DTINICIOOS', 'DTFIMOS']:
-                if row_dict.get(key) and isinstance(row_dict[key], (date, datetime)):
-                    row_dict[key] = row_dict[key].strftime('%Y-%m-%d')
-            results.append(row_dict)
-        return results, data_hash
+        return hash_rows(rows)
     except cx_Oracle.DatabaseError as e:
         logger.error(f"Ocorreu um erro ao executar a consulta pcmovendpend: {e}")
         return [], None
     finally:
         if 'cursor' in locals() and cursor: cursor.close()
         if 'connection' in locals() and connection: connection.close()
-def get_oracle_data_paginated_pcpedi(data_inicial, data_final, pagina, limite, last_update=None):
+# --- EXTRAÇÃO BASE (STAGING) E TABELAS DERIVADAS ---
+# PCPEDI, PCPEDC e PCMOV são lidos do Oracle UMA vez por ciclo para o banco 'staging'.
+# pcpedc, pcpedi, pcpedi_fornecedor, pcvendedor, pcvendedor2 e pcpedc_posicao são derivados
+# localmente por SQL sobre o staging (anexado como 'stg') + dimensões do próprio arquivo.
+
+STAGING_DB = 'staging'
+
+STAGING_TABLES = {
+    'stg_pcpedi': {
+        'key': ['RID'],
+        'fields': ['RID', 'NUMPED', 'CODPROD', 'CODCLI', 'CODUSUR', 'DATA', 'QT', 'PVENDA', 'NUMCAR', 'POSICAO',
+                   'VLCUSTOFIN', 'VLBONIFIC', 'BONIFIC'],
+        # Itens da janela + itens (de qualquer data) com movimentação na janela
+        'query': """
+            SELECT ROWIDTOCHAR(P.ROWID) AS RID, P.NUMPED, P.CODPROD, P.CODCLI, P.CODUSUR,
+                   TO_CHAR(TRUNC(P.DATA), 'YYYY-MM-DD') AS DATA, P.QT, P.PVENDA, P.NUMCAR, P.POSICAO,
+                   P.VLCUSTOFIN, P.VLBONIFIC, P.BONIFIC
+            FROM PCPEDI P
+            WHERE (P.DATA >= :data_inicial AND P.DATA < :data_final + 1)
+               OR P.NUMPED IN (SELECT M.NUMPED FROM PCMOV M WHERE M.DTMOV >= :data_inicial AND M.DTMOV < :data_final + 1)
+        """,
+    },
+    'stg_pcpedc': {
+        'key': ['NUMPED'],
+        'fields': ['NUMPED', 'DATA', 'CODCLI', 'CONDVENDA', 'CODFILIAL', 'CODPRACA', 'CODEMITENTE', 'POSICAO',
+                   'NUMNOTA', 'OBS', 'OBS1', 'OBS2', 'DTCANCEL'],
+        'query': """
+            SELECT C.NUMPED, TO_CHAR(TRUNC(C.DATA), 'YYYY-MM-DD') AS DATA, C.CODCLI, C.CONDVENDA, C.CODFILIAL,
+                   C.CODPRACA, C.CODEMITENTE, C.POSICAO, C.NUMNOTA, C.OBS, C.OBS1, C.OBS2,
+                   TO_CHAR(TRUNC(C.DTCANCEL), 'YYYY-MM-DD') AS DTCANCEL
+            FROM PCPEDC C
+            WHERE (C.DATA >= :data_inicial AND C.DATA < :data_final + 1)
+               OR C.NUMPED IN (SELECT P.NUMPED FROM PCPEDI P WHERE P.DATA >= :data_inicial AND P.DATA < :data_final + 1)
+               OR C.NUMPED IN (SELECT M.NUMPED FROM PCMOV M WHERE M.DTMOV >= :data_inicial AND M.DTMOV < :data_final + 1)
+        """,
+    },
+    'stg_pcmov': {
+        'key': ['RID'],
+        'fields': ['RID', 'NUMPED', 'CODPROD', 'CODOPER', 'DTMOV', 'QT', 'CODUSUR', 'CODFILIAL'],
+        # Movimentos da janela + todos os movimentos dos pedidos da janela (devoluções posteriores)
+        'query': """
+            SELECT ROWIDTOCHAR(M.ROWID) AS RID, M.NUMPED, M.CODPROD, M.CODOPER,
+                   TO_CHAR(TRUNC(M.DTMOV), 'YYYY-MM-DD') AS DTMOV, M.QT, M.CODUSUR, M.CODFILIAL
+            FROM PCMOV M
+            WHERE M.NUMPED IS NOT NULL
+              AND ((M.DTMOV >= :data_inicial AND M.DTMOV < :data_final + 1)
+                   OR M.NUMPED IN (SELECT P.NUMPED FROM PCPEDI P WHERE P.DATA >= :data_inicial AND P.DATA < :data_final + 1))
+        """,
+    },
+}
+
+CODUSUR_EXCLUIDOS = "219, 3, 63, 100, 12, 104, 186, 217, 172, 173, 73, 144, 107, 207, 174, 149, 167, 199, 191, 218, 196, 214, 96"
+
+DERIVED_QUERIES = {
+    'pcpedc': """
+        SELECT DISTINCT
+            PC.CODPROD, PC.QT_SAIDA, (PC.QT_SAIDA - COALESCE(PM.QT_DEVOLUCAO, 0)) AS QT_VENDIDA_LIQUIDA,
+            PC.PVENDA, (PC.QT_SAIDA * PC.PVENDA) AS VALOR_VENDIDO_BRUTO,
+            ((PC.QT_SAIDA - COALESCE(PM.QT_DEVOLUCAO, 0)) * PC.PVENDA) AS VALOR_VENDIDO_LIQUIDO,
+            -(COALESCE(PM.QT_DEVOLUCAO, 0) * PC.PVENDA) AS VALOR_DEVOLVIDO, PC.NUMPED, PC.DATA,
+            PM.DATA_DEVOLUCAO, PCC.CONDVENDA, PU.NOME AS NOME, PC.CODUSUR, PCC.CODFILIAL,
+            PR.PRACA AS CODPRACA, PCC.CODCLI, EM.NOME AS NOME_EMITENTE,
+            CASE WHEN PM.QT_DEVOLUCAO > 0 THEN 'S/ED' ELSE 'S' END AS DEVOLUCAO
+        FROM (
+            SELECT DISTINCT CODPROD, QT AS QT_SAIDA, NUMPED, DATA, PVENDA, CODUSUR, CODCLI
+            FROM stg.stg_pcpedi
+            WHERE DATA BETWEEN :data_inicial AND :data_final
+                AND CODCLI NOT IN (91530, 111564, 112598, 1, 3)
+                AND CODUSUR NOT IN (219, 3, 63, 100, 12, 104, 217, 172, 173, 73, 144, 107, 207, 174, 149, 167, 199, 191, 196, 214, 96)
+        ) PC
+        JOIN stg.stg_pcpedc PCC ON PC.NUMPED = PCC.NUMPED
+        LEFT JOIN dim_praca PR ON PCC.CODPRACA = PR.CODPRACA
+        LEFT JOIN dim_usuario PU ON PC.CODUSUR = PU.CODUSUR
+        LEFT JOIN dim_emitente EM ON PCC.CODEMITENTE = EM.MATRICULA
+        LEFT JOIN (
+            SELECT NUMPED, CODPROD, SUM(QT) AS QT_DEVOLUCAO, MAX(DTMOV) AS DATA_DEVOLUCAO
+            FROM stg.stg_pcmov WHERE CODOPER = 'ED' GROUP BY NUMPED, CODPROD
+        ) PM ON PC.NUMPED = PM.NUMPED AND PC.CODPROD = PM.CODPROD
+        WHERE PCC.CONDVENDA = 1
+            AND PCC.CODFILIAL IN (1, 2)
+            AND PCC.DTCANCEL IS NULL
+            AND (PC.QT_SAIDA - COALESCE(PM.QT_DEVOLUCAO, 0)) >= 0
+        ORDER BY PC.DATA
+    """,
+    'pcpedi': """
+        SELECT PC.NUMPED, PC.NUMCAR, PC.DATA, PC.CODCLI, PC.QT, PC.CODPROD, PC.PVENDA, PC.POSICAO,
+               PC.CODUSUR AS CODIGO_VENDEDOR, PDC.NUMNOTA, PDC.OBS, PDC.OBS1, PDC.OBS2, PDC.CODFILIAL, PDC.CODPRACA
+        FROM stg.stg_pcpedi PC
+        LEFT JOIN stg.stg_pcpedc PDC ON PC.NUMPED = PDC.NUMPED AND PDC.DTCANCEL IS NULL
+        WHERE PC.DATA BETWEEN :data_inicial AND :data_final
+    """,
+    'pcpedi_fornecedor': """
+        SELECT CODPROD, NUMPED, DATA AS DATA_PEDIDO
+        FROM stg.stg_pcpedi
+        WHERE DATA BETWEEN :data_inicial AND :data_final
+    """,
+    'pcvendedor': f"""
+        WITH pedidos_filtrados AS (
+            SELECT DISTINCT PCP.CONDVENDA AS CODIGOVENDA, PED.VLCUSTOFIN AS CUSTOPRODUTO, PED.CODPROD AS CODPRODUTO,
+                PED.CODUSUR AS CODUSUR, PED.CODCLI AS CODCLIENTE, PED.DATA AS DATAPEDIDO, PED.NUMPED AS PEDIDO,
+                PED.QT AS QUANTIDADE_ORIGINAL, PED.PVENDA AS VALOR, PED.VLBONIFIC AS VLBONIFIC, PED.BONIFIC AS BONIFIC,
+                PM.CODOPER
+            FROM stg.stg_pcpedi PED
+            LEFT JOIN stg.stg_pcpedc PCP ON PED.NUMPED = PCP.NUMPED
+            LEFT JOIN stg.stg_pcmov PM ON PED.NUMPED = PM.NUMPED AND PED.CODPROD = PM.CODPROD
+            WHERE (PED.DATA BETWEEN :data_inicial AND :data_final OR PM.DTMOV BETWEEN :data_inicial AND :data_final)
+                AND PED.CODUSUR NOT IN ({CODUSUR_EXCLUIDOS})
+                AND PCP.DTCANCEL IS NULL
+        ),
+        produtos_a_excluir AS (
+            SELECT PEDIDO, CODPRODUTO FROM pedidos_filtrados WHERE CODOPER IN ('S', 'ED')
+            GROUP BY PEDIDO, CODPRODUTO HAVING COUNT(DISTINCT CODOPER) = 2
+        ),
+        pedidos_validos AS (
+            SELECT pf.CODIGOVENDA, pf.CUSTOPRODUTO, pf.CODPRODUTO, pf.CODUSUR, pf.CODCLIENTE, pf.DATAPEDIDO, pf.PEDIDO,
+                   CASE WHEN pf.CODOPER = 'ED' THEN -1 * pf.QUANTIDADE_ORIGINAL ELSE pf.QUANTIDADE_ORIGINAL END AS QUANTIDADE,
+                   pf.VALOR, pf.VLBONIFIC, pf.BONIFIC
+            FROM pedidos_filtrados pf
+            LEFT JOIN produtos_a_excluir pae ON pf.PEDIDO = pae.PEDIDO AND pf.CODPRODUTO = pae.CODPRODUTO
+            WHERE (pf.CODOPER IS NULL OR pf.CODOPER IN ('S', 'ED', 'SB')) AND pae.PEDIDO IS NULL
+        )
+        SELECT DISTINCT CODIGOVENDA, CUSTOPRODUTO, CODPRODUTO, COALESCE(CODUSUR, 0) AS CODUSUR, CODCLIENTE, DATAPEDIDO,
+               COALESCE(PEDIDO, 0) AS PEDIDO, QUANTIDADE, COALESCE(VALOR, 0) AS VALOR, VLBONIFIC, BONIFIC
+        FROM pedidos_validos
+        ORDER BY DATAPEDIDO, PEDIDO
+    """,
+    # LISTAGG(CODOPER, ', ') WITHIN GROUP (ORDER BY CODOPER) montado pela contagem de cada operação com a função
+    # operacoes_envolvidas (ver make_staging_fetcher): o group_concat do SQLite não garante a ordem e mudaria o ROW_HASH
+    'pcvendedor2': f"""
+        WITH transacoes_no_periodo AS (
+            SELECT PED.CODUSUR AS CODIGOVENDEDOR, PED.CODPROD, PED.PVENDA, PM.QT, PED.NUMPED, PED.CODCLI,
+                   PM.DTMOV AS DATA_TRANSACAO, PED.VLBONIFIC, PDC.CONDVENDA, PM.CODOPER
+            FROM stg.stg_pcpedi PED
+            LEFT JOIN stg.stg_pcpedc PDC ON PED.NUMPED = PDC.NUMPED
+            JOIN stg.stg_pcmov PM ON PED.NUMPED = PM.NUMPED AND PED.CODPROD = PM.CODPROD
+            WHERE PM.DTMOV BETWEEN :data_inicial AND :data_final
+                AND PM.CODOPER IN ('S', 'ED')
+                AND PED.CODCLI NOT IN (3, 91503, 111564, 1)
+                AND PDC.CONDVENDA = 1
+                AND PDC.DTCANCEL IS NULL
+                AND PM.CODUSUR NOT IN ({CODUSUR_EXCLUIDOS})
+                AND PM.CODFILIAL = 1
+        ),
+        pedidos_agregados AS (
+            SELECT CODIGOVENDEDOR, CODPROD, PVENDA, NUMPED, CODCLI, DATA_TRANSACAO, VLBONIFIC, CONDVENDA,
+                   SUM(CASE WHEN CODOPER = 'S' THEN QT WHEN CODOPER = 'ED' THEN -QT ELSE 0 END) AS QT_LIQUIDA,
+                   operacoes_envolvidas(SUM(CODOPER = 'ED'), SUM(CODOPER = 'S')) AS OPERACOES_ENVOLVIDAS
+            FROM transacoes_no_periodo
+            GROUP BY CODIGOVENDEDOR, CODPROD, PVENDA, NUMPED, CODCLI, DATA_TRANSACAO, VLBONIFIC, CONDVENDA
+        )
+        SELECT CODIGOVENDEDOR, COALESCE(CAST(CODPROD AS TEXT), '') AS CODPROD, PVENDA, QT_LIQUIDA AS QT,
+               COALESCE(CAST(NUMPED AS TEXT), '') AS NUMPED, COALESCE(CAST(CODCLI AS TEXT), '') AS CODCLI,
+               DATA_TRANSACAO AS DATA, VLBONIFIC,
+               COALESCE(CAST(CONDVENDA AS TEXT), '') AS CONDVENDA, OPERACOES_ENVOLVIDAS AS CODOPER
+        FROM pedidos_agregados
+        WHERE QT_LIQUIDA <> 0
+    """,
+    'pcpedc_posicao': """
+        SELECT PR.ROTA,
+               COUNT(CASE WHEN PC.POSICAO = 'M' THEN 1 END) AS M_COUNT,
+               COUNT(CASE WHEN PC.POSICAO = 'L' THEN 1 END) AS L_COUNT,
+               COUNT(CASE WHEN PC.POSICAO = 'F' THEN 1 END) AS F_COUNT,
+               RE.DESCRICAO, PC.DATA
+        FROM stg.stg_pcpedc PC
+        JOIN dim_praca PR ON PC.CODPRACA = PR.CODPRACA
+        JOIN dim_rotaexp RE ON PR.ROTA = RE.CODROTA
+        WHERE PC.DATA BETWEEN :data_inicial AND :data_final
+            AND PC.CODFILIAL IN (1, 3)
+        GROUP BY PC.DATA, PR.ROTA, RE.DESCRICAO
+    """,
+}
+
+def fetch_batches(cursor):
+    """Lê o resultado do cursor Oracle em lotes de ORACLE_ARRAYSIZE linhas, já com o ROW_HASH (ver hash_rows)."""
+    while True:
+        rows = cursor.fetchmany(ORACLE_ARRAYSIZE)
+        if not rows:
+            break
+        yield hash_rows(rows)[0]
+
+def extract_staging(start_date, end_date):
+    """
+    Lê PCPEDI, PCPEDC e PCMOV da janela em uma única passada e substitui o conteúdo do staging.
+    As linhas vão do Oracle para o SQLite em lotes (fetchmany), sem juntar a janela inteira na memória;
+    as três tabelas são gravadas numa única transação, desfeita se a leitura falhar no meio.
+    Retorna False se a extração falhar (as tabelas derivadas não são recalculadas nesse ciclo).
+    """
+    params = {'data_inicial': start_date, 'data_final': end_date}
     try:
         connection = connect_to_oracle()
-        if connection is None: return [], None
-        cursor = connection.cursor()
-        offset = (pagina - 1) * limite
-        query = """
-            SELECT 
-                PC.NUMPED, PC.NUMCAR, PC.DATA, PC.CODCLI, PC.QT, PC.CODPROD, PC.PVENDA, PC.POSICAO, CL.CLIENTE,
-                PR.DESCRICAO AS DESCRICAO_PRODUTO, PC.CODUSUR AS CODIGO_VENDEDOR, PU.NOME AS NOME_VENDEDOR,
-                PDC.NUMNOTA, PDC.OBS, PDC.OBS1, PDC.OBS2, PDC.CODFILIAL, NVL(PCC.MUNICCOB, 0) AS MUNICIPIO,
-                PRP.CODPRACA, PRP.PRACA, PRE.CODROTA, PRE.DESCRICAO AS DESCRICAO_ROTA
-            FROM (
-                SELECT NUMPED, NUMCAR, DATA, CODCLI, QT, CODPROD, PVENDA, POSICAO, CODUSUR,
-                       ROW_NUMBER() OVER (ORDER BY DATA) AS row_num
-                FROM PCPEDI WHERE TRUNC(DATA) BETWEEN :data_inicial AND :data_final
-            ) PC
-            LEFT JOIN PCCLIENT CL ON PC.CODCLI = CL.CODCLI
-            LEFT JOIN PCPRODUT PR ON PC.CODPROD = PR.CODPROD
-            LEFT JOIN PCUSUARI PU ON PC.CODUSUR = PU.CODUSUR
-            LEFT JOIN PCCLIENT PCC ON PC.CODCLI = PCC.CODCLI
-            LEFT JOIN PCPEDC PDC ON PC.NUMPED = PDC.NUMPED AND PDC.DTCANCEL IS NULL
-            LEFT JOIN PCPRACA PRP ON PDC.CODPRACA = PRP.CODPRACA
-            LEFT JOIN PCROTAEXP PRE ON PRP.ROTA = PRE.CODROTA
-            WHERE PC.row_num > :offset AND PC.row_num <= :offset_plus_limit
-        """
-        params = {
-            'data_inicial': data_inicial, 'data_final': data_final,
-            'offset': offset, 'offset_plus_limit': offset + limite
-        }
-        cursor.execute(query, params)
-        columns = [desc[0] for desc in cursor.description]
-        rows = cursor.fetchall()
-        data_hash = hashlib.md5(str(rows).encode()).hexdigest()
-        results = []
-        for row in rows:
-            row_dict = dict(zip(columns, row))
-            if row_dict.get('DATA') and isinstance(row_dict['DATA'], (date, datetime)):
-                row_dict['DATA'] = row_dict['DATA'].strftime('%Y-%m-%d')
-            results.append(row_dict)
-        return results, data_hash
+        if connection is None: return False
+        cursor = oracle_cursor(connection)
+        with connect_to_sqlite(STAGING_DB) as conn:
+            sqlite_cursor = conn.cursor()
+            for table_name, config in STAGING_TABLES.items():
+                cursor.execute(config['query'], params)
+                inserted, updated, deleted = merge_rows(
+                    sqlite_cursor, table_name, config['fields'], config['key'], fetch_batches(cursor), batched=True
+                )
+                logger.info(f"[STAGING] '{table_name}' retornou {cursor.rowcount} linhas do Oracle. "
+                            f"Merge: {inserted} inseridos, {updated} atualizados, {deleted} removidos.")
+            conn.commit()
+        return True
     except cx_Oracle.DatabaseError as e:
-        logger.error(f"Ocorreu um erro ao executar a consulta pcpedi: {e}")
-        return [], None
-    finally:
-        if 'cursor' in locals() and cursor: cursor.close()
-        if 'connection' in locals() and connection: connection.close()
-def get_oracle_data_pcvendedorpositivacao(data_inicial, data_final, pagina, limite, last_update=None):
-    try:
-        connection = connect_to_oracle()
-        if connection is None: return [], None
-        cursor = connection.cursor()
-        offset = (pagina - 1) * limite
-        query = """
-            WITH pedidos_filtrados AS (
-                SELECT DISTINCT PCP.CONDVENDA AS CODIGOVENDA, PCS.NOME AS SUPERVISOR, PCPEDI.VLCUSTOFIN AS CUSTOPRODUTO,
-                    PDA.CODCIDADE AS CODCIDADE, PCPEDI.CODPROD AS CODPRODUTO, PCPEDI.CODUSUR AS CODUSUR, PU.NOME AS VENDEDOR,
-                    PR.DIASEMANA AS ROTA, PR.PERIODICIDADE AS PERIODO, PCPEDI.CODCLI AS CODCLIENTE, PCC.CLIENTE AS CLIENTE,
-                    PCC.FANTASIA AS FANTASIA, TRUNC(PCPEDI.DATA) AS DATAPEDIDO, PCPROD.DESCRICAO AS PRODUTO,
-                    PCPEDI.NUMPED AS PEDIDO, PCFORN.FORNECEDOR AS FORNECEDOR, PCPEDI.QT AS QUANTIDADE_ORIGINAL,
-                    PCC.BLOQUEIO AS BLOQUEADO, PCPEDI.PVENDA AS VALOR, PCFORN.CODFORNEC AS CODFORNECEDOR, PCA.RAMO AS RAMO,
-                    PCC.ENDERENT AS ENDERECO, PCC.BAIRROENT AS BAIRRO, PCC.MUNICENT AS MUNICIPIO, PDA.NOMECIDADE AS CIDADE,
-                    PCPEDI.VLBONIFIC AS VLBONIFIC, PCPEDI.BONIFIC AS BONIFIC, PM.CODOPER,
-                    ROW_NUMBER() OVER (ORDER BY PCPEDI.DATA) AS rn
-                FROM PCPEDI
-                LEFT JOIN PCUSUARI PU ON PCPEDI.CODUSUR = PU.CODUSUR
-                LEFT JOIN (SELECT CODCLI, DIASEMANA, PERIODICIDADE, ROW_NUMBER() OVER (PARTITION BY CODCLI ORDER BY DIASEMANA) AS rn_rota FROM PCROTACLI) PR ON PCPEDI.CODCLI = PR.CODCLI AND PR.rn_rota = 1
-                LEFT JOIN PCCLIENT PCC ON PCPEDI.CODCLI = PCC.CODCLI
-                LEFT JOIN PCPRODUT PCPROD ON PCPEDI.CODPROD = PCPROD.CODPROD
-                LEFT JOIN PCFORNEC PCFORN ON PCPROD.CODFORNEC = PCFORN.CODFORNEC
-                LEFT JOIN PCATIVI PCA ON PCC.CODATV1 = PCA.CODATIV
-                LEFT JOIN PCCIDADE PDA ON PCC.CODCIDADE = PDA.CODCIDADE
-                LEFT JOIN PCPEDC PCP ON PCPEDI.NUMPED = PCP.NUMPED
-                LEFT JOIN PCSUPERV PCS ON PU.CODSUPERVISOR = PCS.CODSUPERVISOR
-                LEFT JOIN PCMOV PM ON PCPEDI.NUMPED = PM.NUMPED AND PCPEDI.CODPROD = PM.CODPROD
-                WHERE (TRUNC(PCPEDI.DATA) BETWEEN :data_inicial AND :data_final OR TRUNC(PM.DTMOV) BETWEEN :data_inicial AND :data_final)
-                    AND PCPEDI.CODUSUR NOT IN (219, 3, 63, 100, 12, 104, 186, 217, 172, 173, 73, 144, 107, 207, 174, 149, 167, 199, 191, 218, 196, 214, 96)
-                    AND PCP.DTCANCEL IS NULL
-            ),
-            produtos_a_excluir AS (
-                SELECT PEDIDO, CODPRODUTO FROM pedidos_filtrados WHERE CODOPER IN ('S', 'ED')
-                GROUP BY PEDIDO, CODPRODUTO HAVING COUNT(DISTINCT CODOPER) = 2
-            ),
-            pedidos_validos AS (
-                SELECT pf.CODIGOVENDA, pf.SUPERVISOR, pf.CUSTOPRODUTO, pf.CODCIDADE, pf.CODPRODUTO, pf.CODUSUR,
-                       pf.VENDEDOR, pf.ROTA, pf.PERIODO, pf.CODCLIENTE, pf.CLIENTE, pf.FANTASIA, pf.DATAPEDIDO,
-                       pf.PRODUTO, pf.PEDIDO, pf.FORNECEDOR,
-                       CASE WHEN pf.CODOPER = 'ED' THEN -1 * pf.QUANTIDADE_ORIGINAL ELSE pf.QUANTIDADE_ORIGINAL END AS QUANTIDADE,
-                       pf.BLOQUEADO, pf.VALOR, pf.CODFORNECEDOR, pf.RAMO, pf.ENDERECO, pf.BAIRRO, pf.MUNICIPIO,
-                       pf.CIDADE, pf.VLBONIFIC, pf.BONIFIC, pf.CODOPER, pf.rn
-                FROM pedidos_filtrados pf
-                LEFT JOIN produtos_a_excluir pae ON pf.PEDIDO = pae.PEDIDO AND pf.CODPRODUTO = pae.CODPRODUTO
-                WHERE (pf.CODOPER IS NULL OR pf.CODOPER IN ('S', 'ED', 'SB')) AND pae.PEDIDO IS NULL
-            )
-            SELECT DISTINCT CODIGOVENDA, SUPERVISOR, CUSTOPRODUTO, CODCIDADE, CODPRODUTO, NVL(CODUSUR, 0) AS CODUSUR,
-                   NVL(VENDEDOR, 0) AS VENDEDOR, NVL(ROTA, 0) AS ROTA, NVL(PERIODO, 0) AS PERIODO, CODCLIENTE, CLIENTE,
-                   FANTASIA, DATAPEDIDO, PRODUTO, NVL(PEDIDO, 0) AS PEDIDO, FORNECEDOR, QUANTIDADE, BLOQUEADO,
-                   NVL(VALOR, 0) AS VALOR, CODFORNECEDOR, RAMO, ENDERECO, BAIRRO, MUNICIPIO, CIDADE, VLBONIFIC, BONIFIC
-            FROM pedidos_validos
-            WHERE rn > :offset AND rn <= :offset_plus_limit
-            ORDER BY DATAPEDIDO, PEDIDO
-        """
-        params = {
-            'data_inicial': data_inicial, 'data_final': data_final,
-            'offset': offset, 'offset_plus_limit': offset + limite
-        }
-        cursor.execute(query, params)
-        columns = [col[0] for col in cursor.description]
-        rows = cursor.fetchall()
-        data_hash = hashlib.md5(str(rows).encode()).hexdigest()
-        results = []
-        for row in rows:
-            row_dict = dict(zip(columns, row))
-            if row_dict.get('DATAPEDIDO') and isinstance(row_dict['DATAPEDIDO'], (date, datetime)):
-                row_dict['DATAPEDIDO'] = row_dict['DATAPEDIDO'].strftime('%Y-%m-%d')
-            results.append(row_dict)
-        return results, data_hash
-    except Exception as e:
-        logger.error(f"Erro ao buscar dados pcvendedor: {str(e)}")
-        return [], None
+        logger.error(f"Ocorreu um erro ao extrair a base para o staging: {e}")
+        return False
+    except sqlite3.Error as e:
+        logger.error(f"Erro de SQLite ao gravar o staging: {e}")
+        return False
     finally:
         if 'cursor' in locals() and cursor: cursor.close()
         if 'connection' in locals() and connection: connection.close()
 
-# *** FUNÇÃO CORRIGIDA ***
-def get_oracle_data_pcvendedorpositivacao2(data_inicial, data_final, pagina, limite, last_update=None):
-    try:
-        connection = connect_to_oracle()
-        if connection is None: return [], None
+def operacoes_envolvidas(qt_ed, qt_s):
+    """Operações do grupo como no LISTAGG ordenado do Oracle: cada 'ED' e depois cada 'S' (ex.: 'ED, S, S')."""
+    return ', '.join(['ED'] * (qt_ed or 0) + ['S'] * (qt_s or 0))
 
-        cursor = connection.cursor()
-        
-        # Lógica de paginação foi REMOVIDA da consulta para garantir que todos os dados sejam retornados.
-        query = """
-            WITH transacoes_no_periodo AS (
-                SELECT
-                    PED.CODUSUR AS CODIGOVENDEDOR,
-                    PED.CODPROD,
-                    PED.PVENDA,
-                    PM.QT,
-                    PED.NUMPED,
-                    PED.CODCLI,
-                    TRUNC(PM.DTMOV) AS DATA_TRANSACAO,
-                    PROD.CODFORNEC AS CODFORNECEDOR,
-                    FORN.FORNECEDOR,
-                    PED.VLBONIFIC,
-                    PDC.CONDVENDA,
-                    PROD.DESCRICAO AS PRODUTO,
-                    PCUSUARI.NOME AS VENDEDOR,
-                    PCCLIENT.CLIENTE,
-                    PM.CODOPER
-                FROM PCPEDI PED
-                LEFT JOIN PCUSUARI ON PED.CODUSUR = PCUSUARI.CODUSUR
-                LEFT JOIN PCPRODUT PROD ON PED.CODPROD = PROD.CODPROD
-                LEFT JOIN PCFORNEC FORN ON PROD.CODFORNEC = FORN.CODFORNEC
-                LEFT JOIN PCPEDC PDC ON PED.NUMPED = PDC.NUMPED
-                LEFT JOIN PCCLIENT ON PED.CODCLI = PCCLIENT.CODCLI
-                INNER JOIN PCMOV PM ON PED.NUMPED = PM.NUMPED AND PED.CODPROD = PM.CODPROD
-                WHERE TRUNC(PM.DTMOV) BETWEEN :data_inicial AND :data_final
-                    AND PM.CODOPER IN ('S', 'ED')
-                    AND PED.CODCLI NOT IN (3, 91503, 111564, 1)
-                    AND PDC.CONDVENDA = 1
-                    AND PDC.DTCANCEL IS NULL
-                    AND PM.CODUSUR NOT IN (219, 3, 63, 100, 12, 104, 186, 217, 172, 173, 73, 144, 107, 207, 174, 149, 167, 199, 191, 218, 196, 214, 96)
-                    AND PM.CODFILIAL = 1
-            ),
-            pedidos_agregados AS (
-                SELECT
-                    CODIGOVENDEDOR, CODPROD, PVENDA, NUMPED, CODCLI,
-                    DATA_TRANSACAO,
-                    CODFORNECEDOR, FORNECEDOR, VLBONIFIC, CONDVENDA, PRODUTO, VENDEDOR, CLIENTE,
-                    SUM(CASE WHEN CODOPER = 'S' THEN QT WHEN CODOPER = 'ED' THEN -QT ELSE 0 END) AS QT_LIQUIDA,
-                    LISTAGG(CODOPER, ', ') WITHIN GROUP (ORDER BY CODOPER) AS OPERACOES_ENVOLVIDAS
-                FROM transacoes_no_periodo
-                GROUP BY
-                    CODIGOVENDEDOR, CODPROD, PVENDA, NUMPED, CODCLI, DATA_TRANSACAO,
-                    CODFORNECEDOR, FORNECEDOR, VLBONIFIC, CONDVENDA, PRODUTO, VENDEDOR, CLIENTE
-            ),
-            final_results AS (
-                SELECT
-                    CODIGOVENDEDOR, NVL(TO_CHAR(CODPROD), '') AS CODPROD, PVENDA, QT_LIQUIDA AS QT,
-                    NVL(TO_CHAR(NUMPED), '') AS NUMPED, NVL(TO_CHAR(CODCLI), '') AS CODCLI,
-                    DATA_TRANSACAO AS DATA,
-                    NVL(TO_CHAR(CODFORNECEDOR), '') AS CODFORNECEDOR, NVL(FORNECEDOR, '') AS FORNECEDOR,
-                    NVL(TO_CHAR(VLBONIFIC), '') AS VLBONIFIC, NVL(TO_CHAR(CONDVENDA), '') AS CONDVENDA,
-                    NVL(PRODUTO, '') AS PRODUTO, NVL(VENDEDOR, '') AS VENDEDOR, NVL(CLIENTE, '') AS CLIENTE,
-                    OPERACOES_ENVOLVIDAS AS CODOPER
-                FROM pedidos_agregados
-                WHERE QT_LIQUIDA <> 0
-            )
-            SELECT * FROM final_results
-        """
-        # Parâmetros de paginação foram removidos
-        params = {
-            'data_inicial': data_inicial, 'data_final': data_final
-        }
-        cursor.execute(query, params)
-        
-        # Adicionando um log para verificar quantas linhas o Python está recebendo do Oracle
-        rows = cursor.fetchall()
-        logger.info(f"Consulta para pcvendedor2 retornou {len(rows)} linhas do Oracle.")
+def make_staging_fetcher(db_name, fields):
+    """Cria uma função com a mesma assinatura dos fetchers do Oracle, mas que deriva os dados do staging."""
+    query = f"SELECT {', '.join(fields)} FROM ({DERIVED_QUERIES[db_name]})"
+    def fetch_from_staging(data_inicial, data_final, pagina, limite, last_update=None):
+        try:
+            conn = connect_to_sqlite(db_name)
+            conn.create_function('operacoes_envolvidas', 2, operacoes_envolvidas, deterministic=True)
+            conn.execute("ATTACH DATABASE ? AS stg", (f'{db_dir}/{STAGING_DB}.db',))
+            cursor = conn.execute(query, {
+                'data_inicial': data_inicial.strftime('%Y-%m-%d'), 'data_final': data_final.strftime('%Y-%m-%d')
+            })
+            return hash_rows(cursor.fetchall())
+        except sqlite3.Error as e:
+            logger.error(f"Erro ao derivar '{db_name}' a partir do staging: {e}")
+            return [], None
+        finally:
+            if 'conn' in locals() and conn: conn.close()
+    fetch_from_staging.__name__ = f"derive_{db_name}"
+    return fetch_from_staging
 
-        data_hash = hashlib.md5(str(rows).encode()).hexdigest()
-        
-        columns = [col[0] for col in cursor.description]
-        results = []
-        for row in rows:
-            row_dict = dict(zip(columns, row))
-            if row_dict.get('DATA') and isinstance(row_dict['DATA'], (date, datetime)):
-                row_dict['DATA'] = row_dict['DATA'].strftime('%Y-%m-%d')
-            results.append(row_dict)
-
-        return results, data_hash
+# Tabelas lidas diretamente do Oracle (vwsomelier vem de uma view opaca do Oracle).
+# A ordem das colunas do SELECT de cada busca é a ordem de 'fields': as linhas seguem como tuplas até o executemany.
+ORACLE_TASKS = [
+    ('vwsomelier', get_oracle_data_paginated_vwsomelier, ['DESCRICAO_1', 'DESCRICAO_2', 'CODPROD', 'DATA', 'QT', 'PVENDA', 'VLCUSTOFIN', 'CONDVENDA', 'NUMPED', 'CODOPER', 'DTCANCEL']),
+    ('pceest', get_oracle_data_paginated_pcest, ['NOMES_PRODUTO','QTULTENT','DTULTENT','DTULTSAIDA','CODFILIAL','QTVENDSEMANA','QTVENDSEMANA1','QTVENDSEMANA2','QTVENDSEMANA3','QTVENDMES','QTVENDMES1','QTVENDMES2','QTVENDMES3','QTGIRODIA','QTDEVOLMES','QTDEVOLMES1','QTDEVOLMES2','QTDEVOLMES3','CODPROD','QT_ESTOQUE','QTRESERV','QTINDENIZ','DTULTPEDCOMPRA','BLOQUEADA','CODFORNECEDOR','FORNECEDOR','CATEGORIA']),
+    ('pcmovendpend', get_oracle_data_pcmovendpend, ['NUMOS', 'QTDITENS', 'TIPOOS', 'NUMCAR', 'CODCLIENTE', 'CLIENTE', 'CODOPER', 'NUMPED', 'DESCRICAO', 'NUMTRANSWMS', 'NUMPALETE', 'PESO', 'VOLUME', 'TEMPOSEP', 'TEMPOCONF', 'TOTVOL', 'TOTPECAS', 'STATUS', 'DEPOSITOORIG', 'DEPOSITODEST', 'MOVIMENT', 'DATA', 'CONFERENTE', 'ROTA', 'DTINICIOOS', 'DTFIMOS']),
+]
+
+# Tabelas derivadas localmente do staging (PCPEDI/PCPEDC/PCMOV extraídos uma única vez)
+DERIVED_TASKS = [
+    (db_name, make_staging_fetcher(db_name, fields), fields) for db_name, fields in [
+        ('pcpedc', ['CODPROD', 'QT_SAIDA', 'QT_VENDIDA_LIQUIDA', 'PVENDA', 'VALOR_VENDIDO_BRUTO', 'VALOR_VENDIDO_LIQUIDO', 'VALOR_DEVOLVIDO', 'NUMPED', 'DATA', 'DATA_DEVOLUCAO', 'CONDVENDA', 'NOME', 'CODUSUR', 'CODFILIAL', 'CODPRACA', 'CODCLI', 'NOME_EMITENTE', 'DEVOLUCAO']),
+        ('pcpedi_fornecedor', ['CODPROD', 'NUMPED', 'DATA_PEDIDO']),
+        ('pcpedi', ['NUMPED', 'NUMCAR', 'DATA', 'CODCLI', 'QT', 'CODPROD', 'PVENDA', 'POSICAO', 'CODIGO_VENDEDOR', 'NUMNOTA', 'OBS', 'OBS1', 'OBS2', 'CODFILIAL', 'CODPRACA']),
+        ('pcvendedor', ['CODIGOVENDA', 'CUSTOPRODUTO', 'CODPRODUTO', 'CODUSUR', 'CODCLIENTE', 'DATAPEDIDO', 'PEDIDO', 'QUANTIDADE', 'VALOR', 'VLBONIFIC', 'BONIFIC']),
+        ('pcvendedor2', ['CODIGOVENDEDOR', 'CODPROD', 'PVENDA', 'QT', 'NUMPED', 'CODCLI', 'DATA', 'VLBONIFIC', 'CONDVENDA', 'CODOPER']),
+        ('pcpedc_posicao', ['ROTA', 'M_COUNT', 'L_COUNT', 'F_COUNT', 'DESCRICAO', 'DATA']),
+    ]
+]
+
+# Falhas consecutivas e horário da próxima tentativa por tabela (ciclo de atualização)
+_backoff_tabelas = {}
+_backoff_lock = threading.Lock()
+
+def em_backoff(name):
+    with _backoff_lock:
+        state = _backoff_tabelas.get(name)
+        return state is not None and datetime.now() < state['proxima_tentativa']
+
+def registrar_resultado_tabela(name, sucesso):
+    with _backoff_lock:
+        if sucesso:
+            if _backoff_tabelas.pop(name, None):
+                logger.info(f"'{name}' voltou a sincronizar. Backoff encerrado.")
+            return
+        failures = _backoff_tabelas.get(name, {}).get('falhas', 0) + 1
+        wait_minutes = min(TABLE_BACKOFF_BASE_MINUTES * 2 ** (failures - 1), TABLE_BACKOFF_MAX_MINUTES)
+        _backoff_tabelas[name] = {'falhas': failures, 'proxima_tentativa': datetime.now() + timedelta(minutes=wait_minutes)}
+        logger.warning(f"'{name}' falhou {failures} vez(es) seguida(s). Próxima tentativa em {wait_minutes} min.")
+
+def publicar_snapshot_tabela(db_name, start_date=None, end_date=None):
+    """Publica o snapshot Parquet da tabela (só os meses da janela, quando informada). Falha não afeta a sincronização."""
+    if not PARQUET_SNAPSHOTS:
+        return
+    try:
+        manifesto_frio = carregar_manifesto_frio(db_name, db_dir)
+        publicar_snapshot(
+            db_name, TABLE_STORAGE[db_name], TABLE_DATE_COLUMNS[db_name], TABLE_DAY_COLUMNS[db_name],
+            db_dir, start_date, end_date, manifesto_frio['congelado_ate'] if manifesto_frio else None
+        )
     except Exception as e:
-        logger.error(f"Erro ao buscar dados pcvendedor2: {str(e)}")
-        return [], None
-    finally:
-        if 'cursor' in locals() and cursor: cursor.close()
-        if 'connection' in locals() and connection: connection.close()
+        logger.error(f"Falha ao publicar snapshot Parquet de '{db_name}': {e}", exc_info=True)
 
+def congelar_historico(db_name, start_date):
+    """Congela na camada fria os meses fechados antes do mês de start_date (início da janela sincronizada)."""
+    if db_name not in COLD_TIER_TABLES:
+        return
+    try:
+        congelar_meses(db_name, TABLE_STORAGE[db_name], TABLE_DATE_COLUMNS[db_name], start_date.replace(day=1), db_dir)
+    except Exception as e:
+        logger.error(f"Falha ao congelar o histórico de '{db_name}': {e}", exc_info=True)
 
-def get_data_pcpedc_por_posicao(data_inicial, data_final, pagina, limite, last_update=None):
+def atualizar_indice_busca(desde=None):
+    """Refaz o índice de busca de produtos (busca_produtos.py) se as fontes mudaram. Falha não afeta a sincronização."""
     try:
-        connection = connect_to_oracle()
-        if connection is None: return [], None
-        cursor = connection.cursor()
-        offset = (pagina - 1) * limite
-        query = """
-            SELECT ROTA, M_COUNT, L_COUNT, F_COUNT, DESCRICAO, DATA
-            FROM (
-                SELECT PC.DATA, PR.ROTA,
-                       COUNT(CASE WHEN PC.POSICAO = 'M' THEN 1 END) AS M_COUNT,
-                       COUNT(CASE WHEN PC.POSICAO = 'L' THEN 1 END) AS L_COUNT,
-                       COUNT(CASE WHEN PC.POSICAO = 'F' THEN 1 END) AS F_COUNT,
-                       RE.DESCRICAO,
-                       ROW_NUMBER() OVER (ORDER BY PR.ROTA) AS row_num
-                FROM PCPEDC PC
-                JOIN PCPRACA PR ON PC.CODPRACA = PR.CODPRACA
-                JOIN PCROTAEXP RE ON PR.ROTA = RE.CODROTA
-                WHERE TRUNC(PC.DATA) BETWEEN :data_inicial AND :data_final
-                    AND PC.CODFILIAL IN (1, 3)
-                GROUP BY PC.DATA, PR.ROTA, RE.DESCRICAO
-            )
-            WHERE row_num > :offset AND row_num <= :offset_plus_limit
-        """
-        params = {
-            'data_inicial': data_inicial, 'data_final': data_final,
-            'offset': offset, 'offset_plus_limit': offset + limite
-        }
-        cursor.execute(query, params)
-        rows = cursor.fetchall()
-        data_hash = hashlib.md5(str(rows).encode()).hexdigest()
-        
-        results = [
-            {
-                'ROTA': row[0], 'M_COUNT': row[1], 'L_COUNT': row[2], 'F_COUNT': row[3],
-                'DESCRICAO': row[4], 'DATA': row[5].strftime('%Y-%m-%d') if row[5] else None
-            } for row in rows
-        ]
-        return results, data_hash
-    except cx_Oracle.DatabaseError as e:
-        logger.error(f"Ocorreu um erro ao executar a consulta pcpedc_por_posicao: {e}")
-        return [], None
-    finally:
-        if 'cursor' in locals() and cursor: cursor.close()
-        if 'connection' in locals() and connection: connection.close()
+        atualizar_indice(desde, db_dir)
+    except Exception as e:
+        logger.error(f"Falha ao atualizar o índice de busca de produtos: {e}", exc_info=True)
 
+def atualizar_metricas_estoque():
+    """Recalcula a Curva ABC/cobertura do estoque (metricas_estoque.py) e sobe a versão lida pelo Estoque.py."""
+    try:
+        if gravar_metricas(db_dir):
+            registrar_versao(METRICAS_TABELA)
+    except Exception as e:
+        logger.error(f"Falha ao atualizar as métricas do estoque: {e}", exc_info=True)
 
 # Função de orquestração para ser usada com o ThreadPool
 def orchestrate_update(config, start_date, end_date, is_initial_load):
     db_name, fetch_function, fields = config
+    # Na carga inicial o controle de repetição é o checkpoint mensal
+    if not is_initial_load and em_backoff(db_name):
+        logger.info(f"'{db_name}' em backoff. Pulando neste ciclo.")
+        return False
     logger.info(f"Iniciando orquestração para a tabela: {db_name}")
     try:
-        review_and_update_data(db_name, fetch_function, fields, start_date, end_date, is_initial_load)
+        result = review_and_update_data(db_name, fetch_function, fields, start_date, end_date, is_initial_load)
     except Exception as e:
         logger.error(f"Falha na orquestração para '{db_name}': {e}", exc_info=True)
+        result = False
+    if not is_initial_load:
+        registrar_resultado_tabela(db_name, result)
+        if result:
+            congelar_historico(db_name, start_date)
+            publicar_snapshot_tabela(db_name, start_date, end_date)
+    return result
+
+def sincronizar_dimensoes_se_necessario():
+    # Cadastros: todos na partida e a cada DIMENSION_SYNC_INTERVAL_MINUTES; fora disso, só as dimensões que
+    # receberam chave nova, no máximo uma vez a cada DIMENSION_RESYNC_MIN_MINUTES
+    agora = datetime.now()
+    dimensoes_vencidas = (
+        _ultima_sync_dimensoes is None
+        or agora - _ultima_sync_dimensoes >= timedelta(minutes=DIMENSION_SYNC_INTERVAL_MINUTES)
+    )
+    if dimensoes_vencidas:
+        sincronizar_dimensoes()
+        return
+    with _dimensoes_lock:
+        pendentes = [
+            dimension_name for dimension_name in DIMENSION_TABLES if dimension_name in _dimensoes_pendentes
+            and agora - _ultima_sync_por_dimensao.get(dimension_name, datetime.min) >= timedelta(minutes=DIMENSION_RESYNC_MIN_MINUTES)
+        ]
+    if pendentes:
+        sincronizar_dimensoes(pendentes)
 
 def atualizar_dados(is_initial_load=False):
-    today = date.today()
     if is_initial_load:
-        start_date = date(2024, 1, 1)
-        end_date = today
-        logger.info(f"MODO CARGA INICIAL: Buscando todos os dados de {start_date} até {end_date}.")
-    else:
-        start_date = today - relativedelta(months=13)
-        end_date = today
-        logger.info(f"MODO ATUALIZAÇÃO: Buscando dados na janela de {start_date} a {end_date}.")
+        carga_inicial()
+        return
+    if carga_inicial_pendente():
+        # Blocos da carga inicial que falharam são retomados pelo job agendado; o ciclo normal segue depois
+        logger.info("Carga inicial incompleta: retomando os blocos pendentes antes da atualização.")
+        carga_inicial()
+
+    today = date.today()
+    start_date = today - relativedelta(months=SYNC_WINDOW_MONTHS)
+    end_date = today
+    logger.info(f"MODO ATUALIZAÇÃO: Buscando dados na janela de {start_date} a {end_date}.")
     
     create_sqlite_tables()
-    
-    # Esta lista deve conter TODAS as suas tabelas e funções de busca
-    tasks_config = [
-        ('vwsomelier', get_oracle_data_paginated_vwsomelier, ['DESCRICAO_1', 'DESCRICAO_2', 'CODPROD', 'DATA', 'QT', 'PVENDA', 'VLCUSTOFIN', 'CONDVENDA', 'NUMPED', 'CODOPER', 'DTCANCEL']),
-        ('pcpedc', get_oracle_data_paginated_pcpedc, ['CODPROD', 'QT_SAIDA', 'QT_VENDIDA_LIQUIDA', 'PVENDA', 'VALOR_VENDIDO_BRUTO', 'VALOR_VENDIDO_LIQUIDO', 'VALOR_DEVOLVIDO', 'NUMPED', 'DATA', 'DATA_DEVOLUCAO', 'CONDVENDA', 'NOME', 'CODUSUR', 'CODFILIAL', 'CODPRACA', 'CODCLI', 'NOME_EMITENTE', 'DEVOLUCAO']),
-        ('pceest', get_oracle_data_paginated_pcest, ['NOMES_PRODUTO','QTULTENT','DTULTENT','DTULTSAIDA','CODFILIAL','QTVENDSEMANA','QTVENDSEMANA1','QTVENDSEMANA2','QTVENDSEMANA3','QTVENDMES','QTVENDMES1','QTVENDMES2','QTVENDMES3','QTGIRODIA','QTDEVOLMES','QTDEVOLMES1','QTDEVOLMES2','QTDEVOLMES3','CODPROD','QT_ESTOQUE','QTRESERV','QTINDENIZ','DTULTPEDCOMPRA','BLOQUEADA','CODFORNECEDOR','FORNECEDOR','CATEGORIA']),
-        ('pcpedi_fornecedor', get_oracle_data_with_supplier, ['CODPROD', 'NOME_PRODUTO', 'NUMPED', 'DATA_PEDIDO', 'FORNECEDOR']),
-        ('pcmovendpend', get_oracle_data_pcmovendpend, ['NUMOS', 'QTDITENS', 'TIPOOS', 'NUMCAR', 'CODCLIENTE', 'CLIENTE', 'CODOPER', 'NUMPED', 'DESCRICAO', 'NUMTRANSWMS', 'NUMPALETE', 'PESO', 'VOLUME', 'TEMPOSEP', 'TEMPOCONF', 'TOTVOL', 'TOTPECAS', 'STATUS', 'DEPOSITOORIG', 'DEPOSITODEST', 'MOVIMENT', 'DATA', 'CONFERENTE', 'ROTA', 'DTINICIOOS', 'DTFIMOS']),
-        ('pcpedi', get_oracle_data_paginated_pcpedi, ['NUMPED', 'NUMCAR', 'DATA', 'CODCLI', 'QT', 'CODPROD', 'PVENDA', 'POSICAO', 'CLIENTE', 'DESCRICAO_PRODUTO', 'CODIGO_VENDEDOR', 'NOME_VENDEDOR', 'NUMNOTA', 'OBS', 'OBS1', 'OBS2', 'CODFILIAL', 'MUNICIPIO', 'CODPRACA', 'PRACA', 'CODROTA', 'DESCRICAO_ROTA']),
-        ('pcvendedor', get_oracle_data_pcvendedorpositivacao, ['CODIGOVENDA', 'SUPERVISOR', 'CUSTOPRODUTO', 'CODCIDADE', 'CODPRODUTO', 'CODUSUR', 'VENDEDOR', 'ROTA', 'PERIODO', 'CODCLIENTE', 'CLIENTE', 'FANTASIA', 'DATAPEDIDO', 'PRODUTO', 'PEDIDO', 'FORNECEDOR', 'QUANTIDADE', 'BLOQUEADO', 'VALOR', 'CODFORNECEDOR', 'RAMO', 'ENDERECO', 'BAIRRO', 'MUNICIPIO', 'CIDADE', 'VLBONIFIC', 'BONIFIC']),
-        ('pcvendedor2', get_oracle_data_pcvendedorpositivacao2, ['CODIGOVENDEDOR', 'CODPROD', 'PVENDA', 'QT', 'NUMPED', 'CODCLI', 'DATA', 'CODFORNECEDOR', 'FORNECEDOR', 'VLBONIFIC', 'CONDVENDA', 'PRODUTO', 'VENDEDOR', 'CLIENTE', 'CODOPER']),
-        ('pcpedc_posicao', get_data_pcpedc_por_posicao, ['ROTA', 'M_COUNT', 'L_COUNT', 'F_COUNT', 'DESCRICAO', 'DATA'])
-    ]
+    sincronizar_dimensoes_se_necessario()
 
     with ThreadPoolExecutor(max_workers=5) as executor:
-        futures = [executor.submit(orchestrate_update, config, start_date, end_date, is_initial_load) for config in tasks_config]
+        futures = [executor.submit(orchestrate_update, config, start_date, end_date, False) for config in ORACLE_TASKS]
+
+        if em_backoff(STAGING_DB):
+            logger.info("Staging em backoff. Tabelas derivadas mantidas como estão neste ciclo.")
+        elif extract_staging(start_date, end_date):
+            registrar_resultado_tabela(STAGING_DB, True)
+            futures += [executor.submit(orchestrate_update, config, start_date, end_date, False) for config in DERIVED_TASKS]
+        else:
+            registrar_resultado_tabela(STAGING_DB, False)
+            logger.warning("Extração do staging falhou. Tabelas derivadas mantidas como estão neste ciclo.")
+
         for future in futures:
             future.result()
-    
+
+    atualizar_indice_busca(start_date)
+    atualizar_metricas_estoque()
     logger.info("Ciclo de atualização de todos os bancos de dados concluído.")
 
+# --- CARGA INICIAL EM BLOCOS MENSAIS COM CHECKPOINT ---
+
+def month_chunks(start_date, end_date):
+    """Lista de (primeiro_dia, ultimo_dia) de cada mês entre as datas, limitada a end_date."""
+    chunks = []
+    month_start = start_date.replace(day=1)
+    while month_start <= end_date:
+        next_month = month_start + relativedelta(months=1)
+        chunks.append((max(month_start, start_date), min(next_month - timedelta(days=1), end_date)))
+        month_start = next_month
+    return chunks
+
+def carga_inicial_pendente():
+    """
+    Verdadeiro se a carga inicial ainda não terminou (primeira execução ou execução interrompida).
+    Instalações anteriores ao checkpoint (pcpedc.db já existente) são consideradas carregadas.
+    """
+    legacy_install = os.path.exists(os.path.join(db_dir, 'pcpedc.db'))
+    with connect_to_sqlite(CONTROL_DB) as conn:
+        cursor = conn.cursor()
+        create_control_tables(cursor)
+        cursor.execute("SELECT CONCLUIDA_EM FROM carga_inicial WHERE ID = 1")
+        row = cursor.fetchone()
+        if row is None and legacy_install:
+            now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+            cursor.execute("INSERT INTO carga_inicial (ID, INICIADA_EM, CONCLUIDA_EM) VALUES (1, ?, ?)", (now, now))
+            conn.commit()
+            return False
+        return row is None or row[0] is None
+
+def load_checkpoints():
+    with connect_to_sqlite(CONTROL_DB) as conn:
+        cursor = conn.cursor()
+        create_control_tables(cursor)
+        cursor.execute("SELECT TABELA, MES FROM carga_checkpoint")
+        return set(cursor.fetchall())
+
+def save_checkpoint(db_name, month):
+    with connect_to_sqlite(CONTROL_DB) as conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO carga_checkpoint (TABELA, MES, CONCLUIDO_EM) VALUES (?, ?, ?)",
+            (db_name, month, datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
+        )
+        conn.commit()
+
+def carga_inicial():
+    """
+    Carrega o histórico desde INITIAL_LOAD_START mês a mês. Cada bloco (tabela, mês) é gravado em
+    sua própria transação e registrado em 'carga_checkpoint'; ao retomar (próximo ciclo agendado ou
+    reinício), os blocos já concluídos são pulados. Só a primeira carga (sem nenhum checkpoint) suspende
+    os índices secundários e usa synchronous=OFF; a retomada grava os blocos pendentes com os índices no lugar.
+    """
+    today = date.today()
+    chunks = month_chunks(INITIAL_LOAD_START, today)
+    primeira_carga = not load_checkpoints()
+    logger.info(f"MODO CARGA INICIAL: {len(chunks)} blocos mensais de {INITIAL_LOAD_START} até {today}.")
+
+    if primeira_carga:
+        create_sqlite_tables(create_indexes=False)
+        drop_secondary_indexes(list(TABLE_DATE_COLUMNS))
+        sincronizar_dimensoes()
+    else:
+        # Retomada a cada ciclo enquanto houver bloco pendente: as páginas continuam com os índices
+        create_sqlite_tables()
+        sincronizar_dimensoes_se_necessario()
+
+    with connect_to_sqlite(CONTROL_DB) as conn:
+        conn.execute("INSERT OR IGNORE INTO carga_inicial (ID, INICIADA_EM) VALUES (1, ?)", (datetime.now().strftime('%Y-%m-%d %H:%M:%S'),))
+        conn.commit()
+
+    if primeira_carga:
+        _carga_em_massa.set()
+    try:
+        for chunk_start, chunk_end in chunks:
+            month = chunk_start.strftime('%Y-%m')
+            done = load_checkpoints()
+            pending_oracle = [config for config in ORACLE_TASKS if (config[0], month) not in done]
+            pending_derived = [config for config in DERIVED_TASKS if (config[0], month) not in done]
+            if not pending_oracle and not pending_derived:
+                continue
+
+            logger.info(f"[CARGA INICIAL] Bloco {month}: {len(pending_oracle) + len(pending_derived)} tabela(s) pendente(s).")
+            with ThreadPoolExecutor(max_workers=5) as executor:
+                futures = {executor.submit(orchestrate_update, config, chunk_start, chunk_end, True): config[0] for config in pending_oracle}
+
+                if pending_derived:
+                    if extract_staging(chunk_start, chunk_end):
+                        futures.update({executor.submit(orchestrate_update, config, chunk_start, chunk_end, True): config[0] for config in pending_derived})
+                    else:
+                        logger.warning(f"[CARGA INICIAL] Staging do bloco {month} falhou; tabelas derivadas serão retomadas na próxima execução.")
+
+                for future, db_name in futures.items():
+                    if future.result():
+                        save_checkpoint(db_name, month)
+
+        done = load_checkpoints()
+        remaining = [(config[0], month) for config in ORACLE_TASKS + DERIVED_TASKS
+                     for month in (c[0].strftime('%Y-%m') for c in chunks)
+                     if (config[0], month) not in done]
+    finally:
+        _carga_em_massa.clear()
+
+    if primeira_carga:
+        logger.info("[CARGA INICIAL] Recriando índices secundários...")
+        create_secondary_indexes()
+
+    if remaining:
+        logger.warning(f"[CARGA INICIAL] {len(remaining)} bloco(s) não concluído(s). A carga será retomada no próximo ciclo agendado.")
+        return False
+
+    with connect_to_sqlite(CONTROL_DB) as conn:
+        conn.execute("UPDATE carga_inicial SET CONCLUIDA_EM = ? WHERE ID = 1", (datetime.now().strftime('%Y-%m-%d %H:%M:%S'),))
+        conn.commit()
+    logger.info("[CARGA INICIAL] Concluída.")
+
+    # Primeiro snapshot Parquet com o histórico inteiro
+    for db_name in TABLE_DATE_COLUMNS:
+        publicar_snapshot_tabela(db_name)
+    atualizar_indice_busca()
+    atualizar_metricas_estoque()
+    return True
+
 def setup_scheduler():
     scheduler = BackgroundScheduler(daemon=True)
     scheduler.add_job(atualizar_dados, 'interval', minutes=5, kwargs={'is_initial_load': False})
@@ -928,13 +1660,18 @@ def create_endpoint(endpoint_name, table_name, date_column, columns):
 
         try:
             with connect_to_sqlite(table_name) as conn:
+                if table_name in COLD_TIER_TABLES:
+                    try:
+                        anexar_camada_fria(conn, table_name, data_inicial, data_final, db_dir=db_dir)
+                    except Exception as e:
+                        logger.error(f"Camada fria de {table_name} indisponível em {endpoint_name}: {e}")
                 cursor = conn.cursor()
-                # OTIMIZAÇÃO: Consulta direta na coluna para usar o índice
+                # OTIMIZAÇÃO: filtra e ordena pelo número do dia ('<data>_DIA'), que usa o índice da fato
                 query = f"""
                     SELECT {', '.join(columns)}
                     FROM {table_name}
-                    WHERE {date_column} BETWEEN ? AND ?
-                    ORDER BY {date_column}
+                    WHERE {date_column}_DIA BETWEEN {DAY_FROM_ISO_SQL.format('?')} AND {DAY_FROM_ISO_SQL.format('?')}
+                    ORDER BY {date_column}_DIA
                     LIMIT ? OFFSET ?
                 """
                 params = (data_inicial.strftime('%Y-%m-%d'), data_final.strftime('%Y-%m-%d'), limite, offset)
@@ -953,6 +1690,147 @@ def create_endpoint(endpoint_name, table_name, date_column, columns):
     endpoint.__name__ = endpoint_name
     app.route(f'/{endpoint_name}', methods=['GET'])(endpoint)
 
+@app.route('/eventos', methods=['GET'])
+def eventos():
+    """
+    Server-Sent Events com as versões das tabelas: evento 'versoes' ({tabela: versao}) ao conectar e a cada
+    mudança; comentário de keep-alive a cada SSE_HEARTBEAT_SECONDS. ?tabelas=pcpedc,pcvendedor filtra.
+    """
+    tabelas = {t for t in request.args.get('tabelas', '').split(',') if t}
+
+    def fluxo():
+        enviadas = None
+        yield "retry: 5000\n\n"
+        while True:
+            with _versoes_cond:
+                visto = _versoes_seq
+            try:
+                versoes = ler_versoes()
+            except sqlite3.Error as e:
+                logger.error(f"Erro ao ler sync_state para /eventos: {e}")
+                versoes = enviadas or {}
+            if tabelas:
+                versoes = {tabela: versao for tabela, versao in versoes.items() if tabela in tabelas}
+            if versoes != enviadas:
+                yield f"event: versoes\ndata: {json.dumps(versoes)}\n\n"
+                enviadas = versoes
+            else:
+                yield ": keep-alive\n\n"
+            # Outro processo (ex.: carga manual) também muda o sync_state: o timeout relê o banco
+            with _versoes_cond:
+                _versoes_cond.wait_for(lambda: _versoes_seq != visto, timeout=SSE_HEARTBEAT_SECONDS)
+
+    return Response(fluxo(), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+def origem_liberada(origem):
+    if CORS_ORIGENS:
+        return origem in CORS_ORIGENS
+    return origem == f"{request.scheme}://{request.host.rsplit(':', 1)[0]}:{STREAMLIT_PORTA}"
+
+@app.after_request
+def liberar_cors(resposta):
+    if request.path.startswith(ROTAS_CORS):
+        resposta.headers['Vary'] = 'Origin'
+        origem = request.headers.get('Origin')
+        if origem and origem_liberada(origem):
+            resposta.headers['Access-Control-Allow-Origin'] = origem
+            # O token vai num cabeçalho próprio: o navegador faz o preflight (OPTIONS) antes
+            resposta.headers['Access-Control-Allow-Headers'] = f'Content-Type, {CABECALHO_ACESSO}'
+            resposta.headers['Access-Control-Allow-Methods'] = 'GET, POST'
+            resposta.headers['Access-Control-Max-Age'] = '3600'
+    return resposta
+
+def acesso_negado(permissao=None):
+    """Resposta 401 se o pedido não traz um token válido do login das páginas (com a permissão), senão None."""
+    if validar_token(request.headers.get(CABECALHO_ACESSO), permissao) is None:
+        return jsonify({"error": "Acesso não autorizado."}), 401
+    return None
+
+@app.route('/detalhe_estoque', methods=['GET'])
+def detalhe_estoque():
+    """
+    Detalhe de uma linha do grid do Estoque, buscado quando o usuário a expande: vendas semanais, mensais,
+    devoluções e outras quantidades. ?codprod= obrigatório; &filial= e &nome= restringem à linha (sem eles, soma).
+    """
+    negado = acesso_negado('Estoque')
+    if negado:
+        return negado
+    try:
+        codprod = int(request.args['codprod'])
+        filial = int(request.args['filial']) if request.args.get('filial') else None
+    except (KeyError, ValueError):
+        return jsonify({"error": "Parâmetro 'codprod' (e 'filial', se informado) deve ser inteiro."}), 400
+    nome = request.args.get('nome') or None
+
+    try:
+        with connect_to_sqlite('pceest') as conn:
+            # Busca pelo prefixo da chave primária (CODPROD, NOMES_PRODUTO, CODFILIAL)
+            row = conn.execute("""
+                SELECT COUNT(*),
+                       SUM(COALESCE(QTVENDSEMANA, 0)), SUM(COALESCE(QTVENDSEMANA1, 0)), SUM(COALESCE(QTVENDSEMANA2, 0)), SUM(COALESCE(QTVENDSEMANA3, 0)),
+                       SUM(COALESCE(QTVENDMES, 0)), SUM(COALESCE(QTVENDMES1, 0)), SUM(COALESCE(QTVENDMES2, 0)), SUM(COALESCE(QTVENDMES3, 0)),
+                       SUM(COALESCE(QTDEVOLMES, 0)), SUM(COALESCE(QTDEVOLMES1, 0)), SUM(COALESCE(QTDEVOLMES2, 0)), SUM(COALESCE(QTDEVOLMES3, 0)),
+                       SUM(COALESCE(QTRESERV, 0)), SUM(COALESCE(BLOQUEADA, 0)), SUM(COALESCE(QTINDENIZ, 0)), SUM(COALESCE(QTULTENT, 0))
+                FROM fato_pceest
+                WHERE CODPROD = ? AND (? IS NULL OR CODFILIAL = ?) AND (? IS NULL OR NOMES_PRODUTO = ?)
+            """, (codprod, filial, filial, nome, nome)).fetchone()
+    except sqlite3.Error as e:
+        logger.error(f"Erro ao consultar o detalhe do produto {codprod}: {e}")
+        return jsonify({"error": "Erro interno ao consultar dados."}), 500
+
+    if not row[0]:
+        return jsonify([])
+    s0, s1, s2, s3, m0, m1, m2, m3, d0, d1, d2, d3, reservada, bloqueada, avariada, ult_entrada = row[1:]
+    # Mesmas linhas que o Estoque.py montava para todos os produtos (detail_data)
+    return jsonify([
+        {'Métrica': 'Vendas Semanais', 'Atual': s0, 'Semana -1': s1, 'Semana -2': s2, 'Semana -3': s3},
+        {'Métrica': 'Vendas Mensais', 'Atual': m0, 'Mês -1': m1, 'Mês -2': m2, 'Mês -3': m3},
+        {'Métrica': 'Devoluções Mensais', 'Atual': d0, 'Mês -1': d1, 'Mês -2': d2, 'Mês -3': d3},
+        {'Métrica': 'Outras Qtde.', 'Reservada': reservada, 'Bloqueada': bloqueada, 'Avariada': avariada, 'Últ. Entrada': ult_entrada},
+    ])
+
+@app.route('/grade/<tabela>', methods=['POST'])
+def grade(tabela):
+    """
+    Bloco de linhas do row model 'serverSide' de um grid publicado pela página (grade_servidor.py).
+    Corpo: o pedido do AG Grid em JSON (startRow, endRow, sortModel, filterModel, rowGroupCols, groupKeys).
+    Exige o token de qualquer usuário logado (as grades vêm de várias páginas).
+    """
+    negado = acesso_negado()
+    if negado:
+        return negado
+    try:
+        # O grid manda text/plain: lê o corpo como JSON de qualquer forma
+        pedido = json.loads(request.get_data(as_text=True) or '{}')
+    except ValueError:
+        return jsonify({"error": "Corpo da requisição deve ser JSON."}), 400
+    try:
+        bloco = ler_bloco(tabela, pedido, db_dir)
+    except (sqlite3.Error, ValueError, TypeError, KeyError) as e:
+        logger.error(f"Erro ao ler bloco da grade {tabela}: {e}")
+        return jsonify({"error": "Erro interno ao consultar dados."}), 500
+    if bloco is None:
+        return jsonify({"error": "Grade não encontrada (publicação expirada?)."}), 404
+    return jsonify(bloco)
+
+@app.route('/arvore_fornecedor', methods=['POST'])
+def arvore_fornecedor():
+    """
+    Filhos de um nó da árvore do Fornecedor (arvore_fornecedor.py), pedidos pelo grid quando o nó é expandido.
+    Corpo em JSON: inicio, fim, fornecedores, groupKeys (caminho do nó; vazio = fornecedores), startRow, endRow.
+    """
+    negado = acesso_negado('Fornecedor')
+    if negado:
+        return negado
+    try:
+        pedido = json.loads(request.get_data(as_text=True) or '{}')
+        return jsonify(ler_filhos(pedido, db_dir))
+    except (ValueError, KeyError, TypeError) as e:
+        return jsonify({"error": f"Pedido inválido: {e}"}), 400
+    except sqlite3.Error as e:
+        logger.error(f"Erro ao ler nós da árvore de fornecedores: {e}")
+        return jsonify({"error": "Erro interno ao consultar dados."}), 500
+
 # --- CRIAÇÃO DOS ENDPOINTS ---
 # Certifique-se de que a lista de colunas aqui corresponde exatamente à da tabela SQLite
 create_endpoint('dados_vwsomelier', 'vwsomelier', 'DATA', ['DESCRICAO_1', 'DESCRICAO_2', 'CODPROD', 'DATA', 'QT', 'PVENDA', 'VLCUSTOFIN', 'CONDVENDA', 'NUMPED', 'CODOPER', 'DTCANCEL'])
@@ -966,11 +1844,10 @@ create_endpoint('dados_pcvendedor2', 'pcvendedor2', 'DATA', ['CODIGOVENDEDOR', '
 create_endpoint('dados_pcpedc_por_posicao', 'pcpedc_posicao', 'DATA', ['ROTA', 'M_COUNT', 'L_COUNT', 'F_COUNT', 'DESCRICAO', 'DATA'])
 
 if __name__ == '__main__':
-    db_check_file = os.path.join(db_dir, 'pcpedc.db')
-    is_first_run = not os.path.exists(db_check_file)
+    is_first_run = carga_inicial_pendente()
 
     if is_first_run:
-        logger.info("PRIMEIRA EXECUÇÃO DETECTADA. Iniciando carga inicial completa de 2024...")
+        logger.info("CARGA INICIAL PENDENTE. Iniciando (ou retomando) a carga mensal desde 2024...")
     else:
         logger.info("Execução subsequente. O cache já existe. Iniciando atualização padrão.")
     
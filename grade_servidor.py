@@ -0,0 +1,280 @@
+# GRADE_SERVIDOR.PY - ROW MODEL NO SERVIDOR PARA OS GRIDS (AGGRID) DAS PÁGINAS
+# Em vez de mandar o DataFrame inteiro para o navegador a cada rerun, a página publica o resultado uma vez
+# numa tabela de database/grades.db (nome = proveniência do cache_dados ou hash do conteúdo: o mesmo
+# resultado não é regravado) e o grid usa o row model 'serverSide' do AG Grid: pede blocos de linhas com o
+# modelo de ordenação, filtro e agrupamento ao endpoint.py (/grade/<tabela>), que responde do SQLite
+# com WHERE/ORDER BY/LIMIT.
+# Índices das colunas ordenadas/filtradas são criados na primeira vez que o grid pede.
+# Publicações sem uso há GRADES_RETENCAO_HORAS e as que passam de GRADES_POR_GRADE no mesmo grid (versões
+# e filtros superados) são apagadas. Páginas: exibir_grade(); endpoint: ler_bloco().
+import hashlib
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+from datetime import datetime, timedelta
+
+import pandas as pd
+
+from acesso import cabecalhos_js
+from banco_local import DB_DIR
+from cache_dados import proveniencia
+from registro_consultas import conectar
+
+try:
+    from st_aggrid import AgGrid, JsCode
+except ImportError:
+    # O endpoint.py só lê os blocos e não tem o streamlit-aggrid
+    AgGrid = JsCode = None
+
+GRADES_DB = 'grades'
+GRADES_RETENCAO_HORAS = int(os.environ.get('GRADES_RETENCAO_HORAS', '6'))
+# Publicações mantidas por grid (as usadas mais recentemente): sessões com filtros diferentes ao mesmo tempo
+GRADES_POR_GRADE = int(os.environ.get('GRADES_POR_GRADE', '10'))
+# Linhas por bloco pedido pelo grid e teto aceito pelo endpoint
+TAMANHO_BLOCO = 100
+BLOCO_MAX = 1000
+# Endereço do endpoint.py visto pelo navegador. Vazio: mesmo host da página, porta 5000.
+ENDPOINT_URL = os.environ.get('ENDPOINT_URL', '')
+
+logger = logging.getLogger(__name__)
+
+_publicacao_lock = threading.Lock()
+
+OPERADORES_NUMERO = {
+    'equals': '= ?', 'notEqual': '<> ?', 'lessThan': '< ?', 'lessThanOrEqual': '<= ?',
+    'greaterThan': '> ?', 'greaterThanOrEqual': '>= ?',
+}
+AGREGACOES = {'sum': 'SUM', 'avg': 'AVG', 'min': 'MIN', 'max': 'MAX', 'count': 'COUNT'}
+
+def _caminho(db_dir):
+    return os.path.join(db_dir, f'{GRADES_DB}.db')
+
+def _coluna(nome):
+    return '"' + nome.replace('"', '""') + '"'
+
+def _criar_catalogo(conn):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS grades (
+            TABELA TEXT PRIMARY KEY, GRADE TEXT, COLUNAS TEXT, LINHAS INTEGER, CRIADA_EM TEXT, USADA_EM TEXT
+        )
+    """)
+
+def base_url_js():
+    """Expressão JavaScript com o endereço do endpoint.py (ENDPOINT_URL ou mesmo host, porta 5000)."""
+    return json.dumps(ENDPOINT_URL.rstrip('/')) if ENDPOINT_URL else "window.location.protocol + '//' + window.location.hostname + ':5000'"
+
+def publicar(grade, df, db_dir=DB_DIR):
+    """
+    Grava o DataFrame em grades.db (se ainda não estiver lá) e retorna o nome da tabela, ou None se falhou.
+    O nome vem da proveniência do DataFrame (cache_dados: consulta, versões do sync_state e filtros), sem ler
+    as linhas; sem proveniência, do hash do conteúdo. Reruns com a mesma origem reaproveitam a tabela.
+    """
+    origem = proveniencia(df)
+    if origem is not None:
+        assinatura = hashlib.md5(repr((grade, origem)).encode())
+    else:
+        try:
+            assinatura = hashlib.md5(pd.util.hash_pandas_object(df, index=False).values.tobytes())
+        except TypeError as e:
+            # Coluna com listas/dicts não tem hash nem cabe no SQLite
+            logger.warning(f"Grade '{grade}' não publicada ({e}); dados vão para o navegador.")
+            return None
+    assinatura.update(repr(list(df.columns)).encode())
+    tabela = f'g_{assinatura.hexdigest()[:16]}'
+    agora = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+    with _publicacao_lock:
+        conn = None
+        try:
+            conn = conectar(_caminho(db_dir), timeout=10)
+            _criar_catalogo(conn)
+            if conn.execute("SELECT 1 FROM grades WHERE TABELA = ?", (tabela,)).fetchone():
+                conn.execute("UPDATE grades SET USADA_EM = ? WHERE TABELA = ?", (agora, tabela))
+                conn.commit()
+                return tabela
+
+            # Tipos para o filtro de cada coluna: número, data ou texto (categorias e datas vão como texto)
+            colunas = {}
+            gravar = df.copy(deep=False)
+            for coluna in gravar.columns:
+                serie = gravar[coluna]
+                if pd.api.types.is_bool_dtype(serie) or not pd.api.types.is_numeric_dtype(serie):
+                    if pd.api.types.is_datetime64_any_dtype(serie):
+                        colunas[coluna] = 'data'
+                        gravar[coluna] = serie.dt.strftime('%Y-%m-%d %H:%M:%S')
+                    else:
+                        colunas[coluna] = 'texto'
+                        if isinstance(serie.dtype, pd.CategoricalDtype):
+                            gravar[coluna] = serie.astype(object)
+                else:
+                    colunas[coluna] = 'numero'
+            with conn:
+                gravar.to_sql(tabela, conn, index=False)
+                conn.execute(
+                    "INSERT INTO grades (TABELA, GRADE, COLUNAS, LINHAS, CRIADA_EM, USADA_EM) VALUES (?, ?, ?, ?, ?, ?)",
+                    (tabela, grade, json.dumps(colunas), len(df), agora, agora)
+                )
+            _apagar_antigas(conn, grade)
+            return tabela
+        except (sqlite3.Error, ValueError) as e:
+            logger.error(f"Erro ao publicar a grade '{grade}': {e}")
+            return None
+        finally:
+            if conn:
+                conn.close()
+
+def _apagar_antigas(conn, grade):
+    """Apaga as publicações sem uso há GRADES_RETENCAO_HORAS e as da grade além das GRADES_POR_GRADE mais recentes."""
+    limite = (datetime.now() - timedelta(hours=GRADES_RETENCAO_HORAS)).strftime('%Y-%m-%d %H:%M:%S')
+    antigas = [row[0] for row in conn.execute("SELECT TABELA FROM grades WHERE USADA_EM < ?", (limite,))]
+    antigas += [row[0] for row in conn.execute(
+        "SELECT TABELA FROM grades WHERE GRADE = ? ORDER BY USADA_EM DESC, CRIADA_EM DESC LIMIT -1 OFFSET ?",
+        (grade, GRADES_POR_GRADE)
+    )]
+    for tabela in dict.fromkeys(antigas):
+        with conn:
+            conn.execute(f"DROP TABLE IF EXISTS {tabela}")
+            conn.execute("DELETE FROM grades WHERE TABELA = ?", (tabela,))
+    if antigas:
+        logger.info(f"Grades: {len(antigas)} publicação(ões) sem uso removida(s).")
+
+def exibir_grade(df, grade, grid_options, db_dir=DB_DIR, **kwargs):
+    """
+    AgGrid com row model no servidor: publica o df e manda ao navegador só as definições das colunas.
+    Se a publicação falhar, mostra o grid com os dados no cliente, como antes. kwargs vão para o AgGrid.
+    """
+    tabela = publicar(grade, df, db_dir)
+    if tabela is None:
+        return AgGrid(df, gridOptions=grid_options, allow_unsafe_jscode=True, **kwargs)
+
+    numericas = set(df.select_dtypes('number').columns) - set(df.select_dtypes('bool').columns)
+    for definicao in grid_options.get('columnDefs', []):
+        # Filtro de conjunto (padrão do enterprise) precisaria da lista de valores: texto ou número no lugar
+        if definicao.get('filter') in (None, True):
+            definicao['filter'] = 'agNumberColumnFilter' if definicao.get('field') in numericas else 'agTextColumnFilter'
+    grid_options['rowModelType'] = 'serverSide'
+    grid_options['cacheBlockSize'] = TAMANHO_BLOCO
+    grid_options['maxBlocksInCache'] = 20
+    # Token do login no cabeçalho (acesso.py); o corpo vai como text/plain
+    grid_options['serverSideDatasource'] = JsCode(f"""{{
+        getRows: function(params) {{
+            fetch({base_url_js()} + '/grade/{tabela}', {{method: 'POST', headers: {cabecalhos_js({'Content-Type': 'text/plain'})}, body: JSON.stringify(params.request)}})
+                .then(function(r) {{ if (!r.ok) {{ throw new Error(r.status); }} return r.json(); }})
+                .then(function(res) {{
+                    if (params.success) {{ params.success({{rowData: res.linhas, rowCount: res.total}}); }}
+                    else {{ params.successCallback(res.linhas, res.total); }}
+                }})
+                .catch(function() {{ params.fail(); }});
+        }}
+    }}""")
+    kwargs['enable_enterprise_modules'] = True
+    return AgGrid(df.iloc[:0], gridOptions=grid_options, allow_unsafe_jscode=True, **kwargs)
+
+def _condicao(coluna, tipo, modelo, params):
+    """SQL de um filtro do AG Grid (texto, número, data ou conjunto) sobre a coluna; None se não reconhecido."""
+    if 'conditions' in modelo or 'condition1' in modelo:
+        partes = modelo.get('conditions') or [modelo.get('condition1'), modelo.get('condition2')]
+        sqls = [s for s in (_condicao(coluna, tipo, parte, params) for parte in partes if parte) if s]
+        juncao = ' OR ' if modelo.get('operator') == 'OR' else ' AND '
+        return '(' + juncao.join(sqls) + ')' if sqls else None
+
+    col = _coluna(coluna)
+    operador = modelo.get('type')
+    if modelo.get('filterType') == 'set':
+        valores = modelo.get('values') or []
+        params.extend(valores)
+        return f"{col} IN ({', '.join('?' * len(valores))})" if valores else '0'
+    if operador == 'blank':
+        return f"({col} IS NULL OR {col} = '')"
+    if operador == 'notBlank':
+        return f"({col} IS NOT NULL AND {col} <> '')"
+
+    if modelo.get('filterType') == 'date' or tipo == 'data':
+        # dateFrom/dateTo chegam como 'YYYY-MM-DD hh:mm:ss': compara só o dia
+        col = f"substr({col}, 1, 10)"
+        valor, ate = (modelo.get('dateFrom') or '')[:10], (modelo.get('dateTo') or '')[:10]
+    else:
+        valor, ate = modelo.get('filter'), modelo.get('filterTo')
+
+    if operador == 'inRange':
+        params.extend([valor, ate])
+        return f"{col} BETWEEN ? AND ?"
+    if operador in OPERADORES_NUMERO:
+        params.append(valor)
+        return f"{col} {OPERADORES_NUMERO[operador]}"
+    if operador in ('contains', 'notContains', 'startsWith', 'endsWith'):
+        texto = str(valor or '').replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+        padrao = {'contains': f'%{texto}%', 'notContains': f'%{texto}%', 'startsWith': f'{texto}%', 'endsWith': f'%{texto}'}[operador]
+        params.append(padrao)
+        return f"{col} {'NOT ' if operador == 'notContains' else ''}LIKE ? ESCAPE '\\'"
+    return None
+
+def ler_bloco(tabela, pedido, db_dir=DB_DIR):
+    """
+    Responde a um pedido do row model 'serverSide' (startRow, endRow, sortModel, filterModel, rowGroupCols,
+    groupKeys, valueCols). Retorna {'linhas': [...], 'total': n}, ou None se a tabela não existe.
+    """
+    if not re.fullmatch(r'g_[0-9a-f]{16}', tabela):
+        return None
+    conn = conectar(_caminho(db_dir), timeout=10)
+    try:
+        _criar_catalogo(conn)
+        row = conn.execute("SELECT COLUNAS FROM grades WHERE TABELA = ?", (tabela,)).fetchone()
+        if row is None:
+            return None
+        colunas = json.loads(row[0])
+        conn.execute("UPDATE grades SET USADA_EM = ? WHERE TABELA = ?", (datetime.now().strftime('%Y-%m-%d %H:%M:%S'), tabela))
+        conn.commit()
+
+        condicoes, params, indexar = [], [], []
+        for coluna, modelo in (pedido.get('filterModel') or {}).items():
+            if coluna in colunas:
+                sql = _condicao(coluna, colunas[coluna], modelo, params)
+                if sql:
+                    condicoes.append(sql)
+                    indexar.append(coluna)
+
+        # Agrupamento: enquanto houver nível aberto sem chave, devolve os grupos desse nível
+        grupos = [g.get('field') or g.get('id') for g in pedido.get('rowGroupCols') or []]
+        grupos = [g for g in grupos if g in colunas]
+        chaves = pedido.get('groupKeys') or []
+        for coluna, chave in zip(grupos, chaves):
+            condicoes.append(f"{_coluna(coluna)} IS ?")
+            params.append(chave)
+        where = f"WHERE {' AND '.join(condicoes)}" if condicoes else ''
+
+        ordenacao = [(o['colId'], 'DESC' if o.get('sort') == 'desc' else 'ASC')
+                     for o in pedido.get('sortModel') or [] if o.get('colId') in colunas]
+        if len(grupos) > len(chaves):
+            nivel = grupos[len(chaves)]
+            valores = [(v.get('field') or v.get('id'), AGREGACOES.get(v.get('aggFunc')))
+                       for v in pedido.get('valueCols') or []]
+            # Agregação da própria coluna do nível teria o mesmo nome e cobriria a chave do grupo
+            valores = [(c, funcao) for c, funcao in valores if c in colunas and funcao and c != nivel]
+            selecao = [_coluna(nivel)] + [f"{funcao}({_coluna(c)}) AS {_coluna(c)}" for c, funcao in valores]
+            ordem = ', '.join(f"{_coluna(c)} {d}" for c, d in ordenacao if c == nivel or c in dict(valores)) or _coluna(nivel)
+            origem = f"SELECT {', '.join(selecao)} FROM {tabela} {where} GROUP BY {_coluna(nivel)}"
+            indexar.append(nivel)
+        else:
+            # rowid no fim: ordem estável entre blocos (e a ordem da página quando não há ordenação)
+            ordem = ', '.join([f"{_coluna(c)} {d}" for c, d in ordenacao] + ['rowid'])
+            origem = f"SELECT * FROM {tabela} {where}"
+            indexar.extend(c for c, _ in ordenacao[:1])
+
+        # Índice na primeira vez que a coluna é ordenada/filtrada/agrupada (tabela publicada não muda mais)
+        for coluna in dict.fromkeys(indexar):
+            indice = f"ix_{tabela}_{list(colunas).index(coluna)}"
+            conn.execute(f"CREATE INDEX IF NOT EXISTS {indice} ON {tabela} ({_coluna(coluna)})")
+
+        inicio = max(int(pedido.get('startRow') or 0), 0)
+        fim = int(pedido.get('endRow') or inicio + TAMANHO_BLOCO)
+        limite = max(min(fim - inicio, BLOCO_MAX), 0)
+        total = conn.execute(f"SELECT COUNT(*) FROM ({origem})", params).fetchone()[0]
+        cursor = conn.execute(f"{origem} ORDER BY {ordem} LIMIT ? OFFSET ?", params + [limite, inicio])
+        nomes = [d[0] for d in cursor.description]
+        return {'linhas': [dict(zip(nomes, linha)) for linha in cursor.fetchall()], 'total': total}
+    finally:
+        conn.close()
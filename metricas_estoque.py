@@ -0,0 +1,220 @@
+# METRICAS_ESTOQUE.PY - CURVA ABC E COBERTURA DO ESTOQUE CALCULADAS NA SINCRONIZAÇÃO
+# O endpoint.py chama gravar_metricas() no fim de cada ciclo: com o PCEEST e as vendas (pcvendedor2) do ciclo,
+# grava em database/pceest.db a tabela estoque_metrics, uma linha por (Código Produto, Filial) já com Classe ABC,
+# última venda, Dias de Estoque, Status Estoque e Taxa de Devolução. O Estoque.py só lê a tabela.
+# A tabela só é refeita quando o PCEEST, as vendas, a regra ABC ou o dia mudaram.
+# Regra ABC pelo ambiente: ABC_DIAS_A (janela do Pareto, 15), ABC_PARETO_A (% acumulado da Curva A, 80)
+# e ABC_DIAS_B (dias desde a última venda para a Curva B, 30).
+import datetime
+import json
+import logging
+import os
+import pathlib
+import sqlite3
+
+import numpy as np
+import pandas as pd
+
+from banco_local import CONSULTAS, DB_DIR, conectar_analitico, versoes_sync
+from registro_consultas import conectar
+
+METRICAS_DB = 'pceest'
+METRICAS_TABELA = 'estoque_metrics'
+
+REGRA_ABC = {
+    'dias_a': int(os.environ.get('ABC_DIAS_A', '15')),
+    'pareto_a': float(os.environ.get('ABC_PARETO_A', '80')),
+    'dias_b': int(os.environ.get('ABC_DIAS_B', '30')),
+}
+
+# Faixas de Dias de Estoque do Status Estoque
+FAIXAS_STATUS = [-1, 7, 30, 90, float('inf')]
+ROTULOS_STATUS = ['Crítico', 'Atenção', 'Saudável', 'Excesso']
+
+logger = logging.getLogger(__name__)
+
+# Tudo vetorizado (np.where/np.select, sem apply por linha). comparar_estoque.py confere o resultado
+# contra a versão linha a linha anterior e mede o tempo.
+def calcular_metricas(df, df_sales, hoje=None, regra=None):
+    """
+    Renomeia colunas, limpa dados e calcula as métricas do estoque (Curva ABC, cobertura, devolução).
+    df: estoque (estoque_produtos_ultima_venda); df_sales: vendas válidas do ano (estoque_vendas_ano).
+    """
+    regra = REGRA_ABC if regra is None else regra
+    # Renomeação e limpeza inicial do df de estoque
+    df = df.rename(columns={
+        'CODPROD': 'Código Produto', 'NOMES_PRODUTO': 'Nome do Produto', 'QTULTENT': 'Qtde. Últ. Entrada',
+        'QT_ESTOQUE': 'Estoque Disponível', 'QTRESERV': 'Qtde. Reservada', 'QTINDENIZ': 'Qtde. Avariada',
+        'DTULTENT': 'Data Últ. Entrada', 'DTULTSAIDA': 'Data Últ. Saída', 'CODFILIAL': 'Filial',
+        'DTULTPEDCOMPRA': 'Data Últ. Ped. Compra', 'BLOQUEADA': 'Qtde. Bloqueada', 'CODFORNECEDOR': 'Cód. Fornecedor',
+        'FORNECEDOR': 'Fornecedor', 'CATEGORIA': 'Categoria', 'QTVENDSEMANA': 'Vendas Sem. Atual',
+        'QTVENDSEMANA1': 'Vendas Sem. -1', 'QTVENDSEMANA2': 'Vendas Sem. -2', 'QTVENDSEMANA3': 'Vendas Sem. -3',
+        'QTVENDMES': 'Vendas Mês Atual', 'QTVENDMES1': 'Vendas Mês -1', 'QTVENDMES2': 'Vendas Mês -2',
+        'QTVENDMES3': 'Vendas Mês -3', 'QTGIRODIA': 'Giro Diário', 'QTDEVOLMES': 'Dev. Mês Atual',
+        'QTDEVOLMES1': 'Dev. Mês -1', 'QTDEVOLMES2': 'Dev. Mês -2', 'QTDEVOLMES3': 'Dev. Mês -3',
+    })
+    numeric_cols = ['Estoque Disponível', 'Qtde. Reservada', 'Qtde. Bloqueada', 'Qtde. Avariada','Qtde. Últ. Entrada', 'Vendas Sem. Atual', 'Vendas Sem. -1', 'Vendas Sem. -2', 'Vendas Sem. -3','Vendas Mês Atual', 'Vendas Mês -1', 'Vendas Mês -2', 'Vendas Mês -3', 'Giro Diário', 'Dev. Mês Atual', 'Dev. Mês -1', 'Dev. Mês -2', 'Dev. Mês -3']
+    for col in numeric_cols:
+        if col in df.columns:
+            df[col] = pd.to_numeric(df[col], errors='coerce').fillna(0)
+
+    # #### CLASSIFICAÇÃO ABC ####
+
+    # 1. Prepara os dados de vendas
+    if not df_sales.empty:
+        df_sales['DATA'] = pd.to_datetime(df_sales['DATA'], errors='coerce')
+        df_sales['VALOR_VENDA'] = np.where(df_sales['CODOPER'] == 'S', df_sales['QT'], -df_sales['QT']) * df_sales['PVENDA']
+        # O código continua numérico nas vendas; só as chaves já agrupadas viram texto (mais abaixo)
+        df_sales = df_sales.rename(columns={'CODPROD': 'Código Produto'})
+
+    df['Código Produto'] = df['Código Produto'].astype(str)
+    today = pd.to_datetime(hoje or datetime.date.today())
+
+    # 2. Determina produtos Curva A (Pareto sobre as vendas da janela regra['dias_a'])
+    class_A_products = set()
+    if not df_sales.empty:
+        sales_janela_df = df_sales[(today - df_sales['DATA']).dt.days <= regra['dias_a']]
+        if not sales_janela_df.empty:
+            # Chaves em texto e na ordem do texto, como no agrupamento pelo código em texto (desempate do Pareto)
+            sales_value = sales_janela_df.groupby('Código Produto')['VALOR_VENDA'].sum()
+            sales_value.index = sales_value.index.astype(str)
+            sales_value = sales_value.sort_index().reset_index()
+            sales_value = sales_value[sales_value['VALOR_VENDA'] > 0]
+            if not sales_value.empty:
+                sales_value = sales_value.sort_values(by='VALOR_VENDA', ascending=False)
+                total_value = sales_value['VALOR_VENDA'].sum()
+                sales_value['CUM_PERC'] = (sales_value['VALOR_VENDA'].cumsum() / total_value) * 100
+                class_A_products = set(sales_value[sales_value['CUM_PERC'] <= regra['pareto_a']]['Código Produto'])
+
+    # 3. Data da última venda de cada produto
+    if 'ULTIMA_VENDA' in df.columns:
+        # Já veio do JOIN no SQLite (estoque_produtos_ultima_venda)
+        df['ULTIMA_VENDA'] = pd.to_datetime(df['ULTIMA_VENDA'], errors='coerce')
+    else:
+        last_sale_dates = pd.DataFrame()
+        if not df_sales.empty:
+            last_sale_dates = df_sales.groupby('Código Produto')['DATA'].max()
+            last_sale_dates.index = last_sale_dates.index.astype(str)
+            last_sale_dates = last_sale_dates.reset_index()
+            last_sale_dates = last_sale_dates.rename(columns={'DATA': 'ULTIMA_VENDA'})
+
+        # 4. Junta a data da última venda ao dataframe principal
+        if not last_sale_dates.empty:
+            df = df.merge(last_sale_dates, on='Código Produto', how='left')
+        else:
+            df['ULTIMA_VENDA'] = pd.NaT
+
+    # 5. Classificação: A pelo Pareto, B com venda nos últimos regra['dias_b'] dias, C o resto (sem venda cai em C)
+    days_since_sale = (today - df['ULTIMA_VENDA']).dt.days
+    df['Classe ABC'] = np.select(
+        [df['Código Produto'].isin(class_A_products), days_since_sale <= regra['dias_b']], ['A', 'B'], default='C'
+    )
+
+    # Cálculos restantes (dependentes do df principal)
+    df['Giro Diário'] = df['Giro Diário'].replace(0, pd.NA)
+    df['Dias de Estoque'] = (df['Estoque Disponível'] / df['Giro Diário']).fillna(0).round(0)
+    df['Taxa de Devolução (%)'] = (df['Dev. Mês Atual'] / df['Vendas Mês Atual'] * 100).where(df['Vendas Mês Atual'] > 0, 0).round(2)
+    df['Status Estoque'] = pd.cut(df['Dias de Estoque'], bins=FAIXAS_STATUS, labels=ROTULOS_STATUS, right=True)
+    return df
+
+def ler_entradas(hoje, regra, db_dir=DB_DIR):
+    """
+    (estoque, vendas) como o Estoque.py lia: estoque com a última venda do ano pela conexão analítica e
+    só as vendas que o Pareto usa (janela da Curva A, dentro do ano).
+    """
+    inicio_ano = hoje.replace(month=1, day=1)
+    inicio_janela = max(inicio_ano, hoje - datetime.timedelta(days=regra['dias_a']))
+    conn = None
+    try:
+        conn = conectar_analitico(db_dir)
+        estoque = pd.read_sql_query(CONSULTAS['estoque_produtos_ultima_venda']['sql'], conn, params=(inicio_ano.isoformat(),))
+    finally:
+        if conn:
+            conn.close()
+    conn = None
+    try:
+        conn = conectar(os.path.join(db_dir, 'pcvendedor2.db'), timeout=10)
+        vendas = pd.read_sql_query(CONSULTAS['estoque_vendas_ano']['sql'], conn, params=(inicio_janela.isoformat(),))
+    finally:
+        if conn:
+            conn.close()
+    return estoque, vendas
+
+def gravar_metricas(db_dir=DB_DIR, regra=None):
+    """
+    Recalcula estoque_metrics se o PCEEST, as vendas, a regra ou o dia mudaram.
+    Retorna o número de linhas gravadas, 0 se nada mudou, ou None se a tabela não pôde ser gravada.
+    """
+    regra = REGRA_ABC if regra is None else regra
+    hoje = datetime.date.today()
+    versoes = versoes_sync(db_dir)
+    fontes = json.dumps({
+        'pceest': versoes.get('pceest', 0),
+        'pcvendedor2': versoes.get('pcvendedor2', 0),
+        'dia': hoje.isoformat(),
+        'regra': regra,
+    }, sort_keys=True)
+    conn = None
+    try:
+        conn = conectar(os.path.join(db_dir, f'{METRICAS_DB}.db'), timeout=10)
+        conn.execute(f"""
+            CREATE TABLE IF NOT EXISTS {METRICAS_TABELA}_controle (
+                ID INTEGER PRIMARY KEY CHECK (ID = 1), FONTES TEXT, LINHAS INTEGER, ATUALIZADO_EM TEXT
+            )
+        """)
+        conn.commit()
+        gravada = conn.execute(f"SELECT FONTES FROM {METRICAS_TABELA}_controle WHERE ID = 1").fetchone()
+        if gravada and gravada[0] == fontes:
+            return 0
+
+        estoque, vendas = ler_entradas(hoje, regra, db_dir)
+        df = calcular_metricas(estoque, vendas, hoje, regra)
+        # Data e categoria viram texto no SQLite; ler_metricas() devolve os tipos
+        df['ULTIMA_VENDA'] = df['ULTIMA_VENDA'].dt.strftime('%Y-%m-%d')
+        df['Status Estoque'] = df['Status Estoque'].astype(object)
+
+        # Grava ao lado e troca numa transação: a página nunca vê a tabela pela metade
+        conn.execute(f"DROP TABLE IF EXISTS {METRICAS_TABELA}_nova")
+        conn.commit()
+        df.to_sql(f'{METRICAS_TABELA}_nova', conn, index=False)
+        conn.execute("BEGIN")
+        conn.execute(f"DROP TABLE IF EXISTS {METRICAS_TABELA}")
+        conn.execute(f"ALTER TABLE {METRICAS_TABELA}_nova RENAME TO {METRICAS_TABELA}")
+        conn.execute(f'CREATE INDEX IF NOT EXISTS idx_{METRICAS_TABELA}_produto ON {METRICAS_TABELA} ("Código Produto", "Filial")')
+        conn.execute(
+            f"INSERT OR REPLACE INTO {METRICAS_TABELA}_controle (ID, FONTES, LINHAS, ATUALIZADO_EM) VALUES (1, ?, ?, ?)",
+            (fontes, len(df), datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
+        )
+        conn.commit()
+        logger.info(f"Métricas do estoque recalculadas: {len(df)} linha(s).")
+        return len(df)
+    except (sqlite3.Error, pd.io.sql.DatabaseError) as e:
+        if conn:
+            conn.rollback()
+        logger.error(f"Erro ao gravar as métricas do estoque: {e}")
+        return None
+    finally:
+        if conn:
+            conn.close()
+
+def ler_metricas(db_dir=DB_DIR):
+    """estoque_metrics com os tipos do cálculo (data e Status Estoque), ou None se a tabela ainda não existe."""
+    caminho = pathlib.Path(db_dir, f'{METRICAS_DB}.db')
+    if not caminho.exists():
+        return None
+    conn = None
+    try:
+        conn = sqlite3.connect(f"{caminho.resolve().as_uri()}?mode=ro", uri=True, timeout=10)
+        df = pd.read_sql_query(f"SELECT * FROM {METRICAS_TABELA}", conn)
+    except (sqlite3.Error, pd.io.sql.DatabaseError) as e:
+        logger.warning(f"Métricas do estoque indisponíveis ({e}); calculando na página.")
+        return None
+    finally:
+        if conn:
+            conn.close()
+    df['Código Produto'] = df['Código Produto'].astype(str)
+    # Giro zerado foi gravado como NULL: coluna toda nula volta como object
+    df['Giro Diário'] = pd.to_numeric(df['Giro Diário'], errors='coerce')
+    df['ULTIMA_VENDA'] = pd.to_datetime(df['ULTIMA_VENDA'], errors='coerce')
+    df['Status Estoque'] = pd.Categorical(df['Status Estoque'], categories=ROTULOS_STATUS, ordered=True)
+    return df
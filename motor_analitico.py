@@ -0,0 +1,186 @@
+# MOTOR_ANALITICO.PY - AGREGAÇÕES DOS DASHBOARDS SOBRE O CACHE SQLITE
+# Com o pacote duckdb instalado (pip install duckdb) as agregações rodam no DuckDB: varredura colunar,
+# vetorizada e em todos os núcleos, lendo os arquivos .db direto pela extensão sqlite.
+# Sem o duckdb (ou se ele falhar) a mesma consulta roda na conexão analítica do SQLite (banco_local).
+# As páginas chamam agregar(nome, params) e recebem só o resultado agregado, não as linhas.
+# Meses congelados na camada fria (camada_fria.py) entram pelas tabelas marcadas com HISTORICO().
+import logging
+import os
+import re
+import threading
+from datetime import date
+
+import pandas as pd
+
+from banco_local import BANCOS, DB_DIR, conectar_analitico
+from camada_fria import anexar_camada_fria, arquivos_frios
+
+try:
+    import duckdb
+except ImportError:
+    duckdb = None
+
+# Desliga o DuckDB sem desinstalar (MOTOR_ANALITICO=sqlite)
+USAR_DUCKDB = duckdb is not None and os.environ.get('MOTOR_ANALITICO', 'duckdb') == 'duckdb'
+
+_duckdb_conns = {}
+_duckdb_lock = threading.Lock()
+# Preenchido quando o DuckDB não consegue anexar os bancos (ex.: extensão sqlite sem download possível);
+# a partir daí o processo usa só o SQLite em vez de tentar de novo a cada consulta.
+_duckdb_falha = None
+
+# Funções de data sobre o número do dia gravado nas fatos, escritas uma vez e traduzidas por motor
+FUNCOES_DATA = {
+    'sqlite': {
+        'ANO_MES': "strftime('%Y-%m', {} + 2440587.5)",
+        'MES': "CAST(strftime('%m', {} + 2440587.5) AS INTEGER)",
+    },
+    'duckdb': {
+        'ANO_MES': "strftime(DATE '1970-01-01' + CAST({} AS INTEGER), '%Y-%m')",
+        'MES': "month(DATE '1970-01-01' + CAST({} AS INTEGER))",
+    },
+}
+
+# Agregações registradas. As tabelas são qualificadas pelo arquivo (pcvendedor2.fato_pcvendedor2),
+# que é o nome do schema tanto no ATTACH do DuckDB quanto na conexão analítica do SQLite.
+# HISTORICO(pcvendedor.fato_pcvendedor) lê a fato junto com os meses congelados na camada fria.
+# Parâmetros de data são números do dia (use dia()).
+AGREGACOES = {
+    # Fornecedor: venda e devolução por fornecedor e mês (gráficos de Top 10)
+    'fornecedor_mes': """
+        SELECT COALESCE(fo.FORNECEDOR, '') AS FORNECEDOR, ANO_MES(f.DATA) AS ANO_MES,
+               SUM(COALESCE(f.QT, 0) * COALESCE(f.PVENDA, 0) - COALESCE(f.VLBONIFIC, 0)) AS VALOR_TRANSACAO,
+               SUM(CASE WHEN f.QT < 0 THEN -(f.QT * COALESCE(f.PVENDA, 0) - COALESCE(f.VLBONIFIC, 0)) ELSE 0 END) AS VALOR_DEVOLUCAO
+        FROM pcvendedor2.fato_pcvendedor2 f
+        LEFT JOIN pcvendedor2.dim_produto p ON p.CODPROD = f.CODPROD
+        LEFT JOIN pcvendedor2.dim_fornecedor fo ON fo.CODFORNEC = p.CODFORNEC
+        WHERE f.DATA >= ? AND f.DATA < ?
+        GROUP BY 1, 2
+    """,
+    # Positivação: meses com venda desde a data informada (seletor de mês)
+    'positivacao_meses': """
+        SELECT DISTINCT MES(f.DATAPEDIDO) AS MES
+        FROM HISTORICO(pcvendedor.fato_pcvendedor) f
+        WHERE f.DATAPEDIDO >= ?
+    """,
+    # Positivação: faturamento e custo por vendedor/cliente no mês, sem os pedidos com bonificação.
+    # Cliente sem CLIENTE/FANTASIA/RAMO fica de fora, como no groupby do pandas que esta consulta substitui.
+    'positivacao_resumo_cliente': """
+        WITH bonificados AS (
+            SELECT DISTINCT f.PEDIDO
+            FROM HISTORICO(pcvendedor.fato_pcvendedor) f
+            WHERE f.DATAPEDIDO BETWEEN ? AND ? AND COALESCE(f.CODIGOVENDA, 1) <> 1
+        )
+        SELECT f.CODUSUR, COALESCE(u.NOME, '0') AS VENDEDOR, COALESCE(f.CODCLIENTE, 0) AS CODCLIENTE,
+               c.CLIENTE, c.FANTASIA, c.RAMO,
+               SUM(COALESCE(f.VALOR, 0) * COALESCE(f.QUANTIDADE, 0)) AS FATURAMENTO_CLIENTE,
+               SUM(COALESCE(f.CUSTOPRODUTO, 0) * COALESCE(f.QUANTIDADE, 0)) AS CUSTO_MERCADORIA
+        FROM HISTORICO(pcvendedor.fato_pcvendedor) f
+        LEFT JOIN pcvendedor.dim_usuario u ON u.CODUSUR = f.CODUSUR
+        LEFT JOIN pcvendedor.dim_cliente c ON c.CODCLI = f.CODCLIENTE
+        WHERE f.DATAPEDIDO BETWEEN ? AND ?
+            AND f.PEDIDO NOT IN (SELECT PEDIDO FROM bonificados)
+            AND f.CODUSUR IS NOT NULL
+            AND c.CLIENTE IS NOT NULL AND c.FANTASIA IS NOT NULL AND c.RAMO IS NOT NULL
+        GROUP BY 1, 2, 3, 4, 5, 6
+    """,
+}
+
+def dia(valor):
+    """Data (date/datetime/'YYYY-MM-DD') -> número do dia usado nas colunas de data das fatos."""
+    if isinstance(valor, str):
+        valor = date.fromisoformat(valor[:10])
+    if hasattr(valor, 'date'):
+        valor = valor.date()
+    return valor.toordinal() - date(1970, 1, 1).toordinal()
+
+def traduzir(sql, motor):
+    """Troca ANO_MES(col)/MES(col) pela expressão de data do motor."""
+    for funcao, modelo in FUNCOES_DATA[motor].items():
+        sql = re.sub(rf'\b{funcao}\(([\w.]+)\)', lambda m: modelo.format(m.group(1)), sql)
+    return sql
+
+def expandir_historico(sql, motor, intervalo=(None, None), db_dir=DB_DIR, conn=None):
+    """
+    Troca HISTORICO(banco.fato) pela fato unida aos meses congelados do intervalo (camada_fria.py).
+    DuckDB lê os Parquet direto (read_parquet); no SQLite as linhas do intervalo são carregadas na conexão 'conn'.
+    ValueError se a consulta usa HISTORICO() e o intervalo não tem início.
+    """
+    resolvidos = {}
+
+    def expandir(m):
+        banco, fato = m.groups()
+        if banco in resolvidos:
+            return resolvidos[banco]
+        if motor == 'sqlite':
+            anexada = anexar_camada_fria(conn, banco, *intervalo, schema=banco, db_dir=db_dir)
+            resolvidos[banco] = f"temp.historico_{fato}" if anexada else f"{banco}.{fato}"
+            return resolvidos[banco]
+        camada = arquivos_frios(banco, *intervalo, db_dir=db_dir)
+        if camada is None:
+            resolvidos[banco] = f"{banco}.{fato}"
+            return resolvidos[banco]
+        coluna, congelado_ate, arquivos = camada
+        # Linhas antes da fronteira podem continuar no SQLite por um ciclo: contam só pelo Parquet
+        quente = f"SELECT * EXCLUDE (ROW_HASH) FROM {banco}.{fato} WHERE {coluna} >= {int(congelado_ate)} OR {coluna} IS NULL"
+        if arquivos:
+            lista = ', '.join("'" + arquivo.replace("'", "''") + "'" for arquivo in arquivos)
+            inicio, fim = (dia(valor) if valor is not None else None for valor in intervalo)
+            filtro = f"{coluna} >= {inicio}" + (f" AND {coluna} <= {fim}" if fim is not None else '')
+            quente += f" UNION ALL BY NAME SELECT * FROM read_parquet([{lista}]) WHERE {filtro}"
+        resolvidos[banco] = f"({quente})"
+        return resolvidos[banco]
+
+    return re.sub(r'HISTORICO\((\w+)\.(\w+)\)', expandir, sql)
+
+def _conexao_duckdb(db_dir):
+    """Conexão DuckDB (uma por pasta, reaproveitada) com os arquivos .db anexados pela extensão sqlite."""
+    with _duckdb_lock:
+        conn = _duckdb_conns.get(db_dir)
+        if conn is None:
+            conn = duckdb.connect()
+            try:
+                conn.execute("LOAD sqlite")
+            except duckdb.Error:
+                # Primeira execução na máquina: baixa a extensão
+                conn.execute("INSTALL sqlite")
+                conn.execute("LOAD sqlite")
+            for banco in BANCOS:
+                caminho = os.path.join(db_dir, f'{banco}.db')
+                if os.path.exists(caminho):
+                    conn.execute(f"ATTACH '{caminho}' AS {banco} (TYPE SQLITE, READ_ONLY)")
+            _duckdb_conns[db_dir] = conn
+        # cursor() do DuckDB é uma conexão própria sobre o mesmo banco: seguro entre threads do Streamlit
+        return conn.cursor()
+
+def agregar(nome, params=(), db_dir=DB_DIR, intervalo=(None, None)):
+    """
+    Executa a agregação registrada e devolve o resultado como DataFrame.
+    intervalo (datas; fim None = até hoje) limita as linhas da camada fria lidas por HISTORICO().
+    """
+    global _duckdb_falha
+    if USAR_DUCKDB and _duckdb_falha is None:
+        cursor = None
+        try:
+            cursor = _conexao_duckdb(db_dir)
+        except duckdb.Error as e:
+            _duckdb_falha = str(e)
+            logging.warning(f"DuckDB indisponível ({e}); agregações seguem no SQLite.")
+        try:
+            if cursor is not None:
+                sql = expandir_historico(AGREGACOES[nome], 'duckdb', intervalo, db_dir)
+                return cursor.execute(traduzir(sql, 'duckdb'), list(params)).df()
+        except duckdb.Error as e:
+            logging.warning(f"DuckDB falhou em {nome} ({e}); usando o SQLite.")
+        finally:
+            if cursor is not None:
+                cursor.close()
+
+    conn = None
+    try:
+        conn = conectar_analitico(db_dir)
+        sql = expandir_historico(AGREGACOES[nome], 'sqlite', intervalo, db_dir, conn)
+        return pd.read_sql_query(traduzir(sql, 'sqlite'), conn, params=tuple(params))
+    finally:
+        if conn:
+            conn.close()
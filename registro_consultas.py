@@ -0,0 +1,325 @@
+# REGISTRO_CONSULTAS.PY - REGISTRO OPCIONAL DAS CONSULTAS AO CACHE SQLITE E SUGESTÃO DE ÍNDICES
+# Ligado com a variável de ambiente REGISTRAR_CONSULTAS=1. Desligado, conectar() é só sqlite3.connect.
+# Cada consulta vira uma linha em database/registro_consultas.db: SQL normalizado, duração, linhas e passos da VM.
+# Relatório: python registro_consultas.py [--top N] [--bancos pasta]
+import atexit
+import json
+import logging
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+from datetime import datetime
+
+REGISTRO_ATIVO = os.environ.get('REGISTRAR_CONSULTAS') == '1'
+STATS_DB = os.path.join('database', 'registro_consultas.db')
+
+# O progress handler é chamado a cada N instruções da VM do SQLite; cada chamada soma N passos
+PASSOS_POR_CHAMADA = 1000
+# Registros acumulados em memória antes de gravar no banco de estatísticas
+TAMANHO_LOTE = 50
+
+_buffer = []
+_buffer_lock = threading.Lock()
+
+def normalizar_sql(sql):
+    """Troca literais por ? e compacta espaços, para agrupar a mesma consulta com parâmetros diferentes."""
+    sql = re.sub(r"'(?:[^']|'')*'", '?', sql)
+    sql = re.sub(r'\b\d+(?:\.\d+)?\b', '?', sql)
+    sql = re.sub(r'\(\s*\?(?:\s*,\s*\?)*\s*\)', '(?)', sql)
+    return re.sub(r'\s+', ' ', sql).strip()
+
+def _parametros_json(params):
+    try:
+        return json.dumps(list(params) if not isinstance(params, dict) else params, default=str)
+    except TypeError:
+        return None
+
+def gravar_registros():
+    """Grava no banco de estatísticas os registros acumulados."""
+    with _buffer_lock:
+        registros = _buffer[:]
+        _buffer.clear()
+    if not registros:
+        return
+    conn = None
+    try:
+        os.makedirs(os.path.dirname(STATS_DB), exist_ok=True)
+        conn = sqlite3.connect(STATS_DB, timeout=10)
+        conn.execute('PRAGMA journal_mode = WAL')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS consultas (
+                momento TEXT,
+                origem TEXT,
+                banco TEXT,
+                sql TEXT,
+                duracao_ms REAL,
+                linhas INTEGER,
+                passos INTEGER
+            )
+        ''')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS exemplos (
+                banco TEXT,
+                sql TEXT,
+                sql_original TEXT,
+                parametros TEXT,
+                PRIMARY KEY (banco, sql)
+            )
+        ''')
+        conn.executemany('INSERT INTO consultas VALUES (?, ?, ?, ?, ?, ?, ?)', [r[:7] for r in registros])
+        conn.executemany(
+            'INSERT OR IGNORE INTO exemplos VALUES (?, ?, ?, ?)',
+            [(r[2], r[3], r[7], r[8]) for r in registros]
+        )
+        conn.commit()
+    except sqlite3.Error as e:
+        logging.error(f"Erro ao gravar registro de consultas: {e}")
+    finally:
+        if conn:
+            conn.close()
+
+def _registrar(conexao, sql, params, duracao, linhas, passos):
+    registro = (
+        datetime.now().isoformat(timespec='seconds'), conexao.origem, conexao.banco,
+        normalizar_sql(sql), round(duracao * 1000, 3), linhas, passos,
+        sql, _parametros_json(params),
+    )
+    with _buffer_lock:
+        _buffer.append(registro)
+        cheio = len(_buffer) >= TAMANHO_LOTE
+    if cheio:
+        gravar_registros()
+
+class CursorRegistrado(sqlite3.Cursor):
+    """Cursor que mede o tempo gasto em execute/fetch e conta as linhas devolvidas."""
+
+    _pendente = None
+
+    def _iniciar(self, sql, params):
+        self._finalizar()
+        self._pendente = [sql, params, 0.0, 0]
+        self.connection.passos = 0
+
+    def _finalizar(self):
+        if self._pendente is None:
+            return
+        sql, params, duracao, linhas = self._pendente
+        self._pendente = None
+        if self.description is None and self.rowcount > 0:
+            linhas = self.rowcount
+        _registrar(self.connection, sql, params, duracao, linhas, self.connection.passos)
+
+    def _medir(self, inicio, linhas=0, esgotado=False):
+        if self._pendente is not None:
+            self._pendente[2] += time.perf_counter() - inicio
+            self._pendente[3] += linhas
+            if esgotado:
+                self._finalizar()
+
+    def execute(self, sql, params=()):
+        self._iniciar(sql, params)
+        inicio = time.perf_counter()
+        try:
+            return super().execute(sql, params)
+        finally:
+            # Sem description (INSERT, UPDATE, DDL) o comando já terminou
+            self._medir(inicio, esgotado=self.description is None)
+
+    def executemany(self, sql, seq_params):
+        self._iniciar(sql, ())
+        inicio = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_params)
+        finally:
+            self._medir(inicio, esgotado=True)
+
+    def fetchone(self):
+        inicio = time.perf_counter()
+        row = super().fetchone()
+        self._medir(inicio, 0 if row is None else 1, esgotado=row is None)
+        return row
+
+    def fetchmany(self, size=None):
+        inicio = time.perf_counter()
+        rows = super().fetchmany(self.arraysize if size is None else size)
+        self._medir(inicio, len(rows), esgotado=not rows)
+        return rows
+
+    def fetchall(self):
+        inicio = time.perf_counter()
+        rows = super().fetchall()
+        self._medir(inicio, len(rows), esgotado=True)
+        return rows
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        inicio = time.perf_counter()
+        try:
+            row = super().__next__()
+        except StopIteration:
+            self._medir(inicio, esgotado=True)
+            raise
+        self._medir(inicio, 1)
+        return row
+
+    def close(self):
+        self._finalizar()
+        super().close()
+
+    def __del__(self):
+        try:
+            self._finalizar()
+        except Exception:
+            pass
+
+class ConexaoRegistrada(sqlite3.Connection):
+    """Conexão cujos comandos passam pelo CursorRegistrado; o progress handler conta os passos da VM."""
+
+    def __init__(self, database, *args, **kwargs):
+        super().__init__(database, *args, **kwargs)
+        self.banco = os.path.splitext(os.path.basename(str(database).replace('\\', '/')))[0]
+        self.origem = ''
+        self.passos = 0
+        self.set_progress_handler(self._contar_passos, PASSOS_POR_CHAMADA)
+
+    def _contar_passos(self):
+        self.passos += PASSOS_POR_CHAMADA
+        return 0
+
+    def cursor(self, factory=CursorRegistrado):
+        return super().cursor(factory)
+
+    # Connection.execute do sqlite3 não passa por cursor(); encaminha para o cursor registrado
+    def execute(self, sql, params=()):
+        return self.cursor().execute(sql, params)
+
+    def executemany(self, sql, seq_params):
+        return self.cursor().executemany(sql, seq_params)
+
+def conectar(database, **kwargs):
+    """sqlite3.connect que registra as consultas quando REGISTRAR_CONSULTAS=1."""
+    if not REGISTRO_ATIVO:
+        return sqlite3.connect(database, **kwargs)
+    origem = sys._getframe(1).f_globals.get('__name__', '')
+    conn = sqlite3.connect(database, factory=ConexaoRegistrada, **kwargs)
+    conn.origem = origem
+    return conn
+
+if REGISTRO_ATIVO:
+    atexit.register(gravar_registros)
+
+# ---------------------------------------------------------------------------
+# Relatório e sugestão de índices
+# ---------------------------------------------------------------------------
+
+_FIM_WHERE = r'\b(?:GROUP BY|ORDER BY|LIMIT|HAVING|UNION)\b'
+
+def colunas_do_filtro(sql):
+    """Colunas do WHERE separadas em igualdade (=, IN) e intervalo (<, >, BETWEEN)."""
+    where = re.search(rf'\bWHERE\b(.*?)(?:{_FIM_WHERE}|$)', sql, re.IGNORECASE | re.DOTALL)
+    if not where:
+        return [], []
+    texto = where.group(1)
+    igualdade, intervalo = [], []
+    for coluna, operador in re.findall(r'(?:\w+\.)?(\w+)\s*(NOT\s+IN|IN|BETWEEN|>=|<=|<>|!=|=|>|<)', texto, re.IGNORECASE):
+        operador = operador.upper()
+        if operador in ('NOT IN', '<>', '!='):
+            continue
+        destino = igualdade if operador in ('=', 'IN') else intervalo
+        if coluna not in igualdade + intervalo:
+            destino.append(coluna)
+    return igualdade, intervalo
+
+def colunas_da_ordenacao(sql):
+    ordem = re.search(r'\bORDER BY\b(.*?)(?:\bLIMIT\b|$)', sql, re.IGNORECASE | re.DOTALL)
+    if not ordem:
+        return []
+    return [re.sub(r'\s+(ASC|DESC)$', '', c.strip(), flags=re.IGNORECASE).split('.')[-1] for c in ordem.group(1).split(',')]
+
+def tabela_alvo(conn, tabela):
+    """Views de fato indexam na fato_<nome>; as colunas <data>_DIA viram a coluna de data da fato."""
+    row = conn.execute("SELECT type FROM sqlite_master WHERE name = ? COLLATE NOCASE", (tabela,)).fetchone()
+    if row and row[0] == 'view':
+        fato = f'fato_{tabela.lower()}'
+        if conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (fato,)).fetchone():
+            return fato, True
+    return tabela, False
+
+def sugerir_indice(conn, sql, plano):
+    """Sugere um CREATE INDEX quando o plano varre a tabela ou ordena em árvore temporária."""
+    varre = any(p.startswith('SCAN ') for p in plano)
+    ordena = any('TEMP B-TREE FOR ORDER BY' in p for p in plano)
+    tabela = re.search(r'\bFROM\s+(\w+)', sql, re.IGNORECASE)
+    if not tabela or not (varre or ordena):
+        return None
+    alvo, eh_view = tabela_alvo(conn, tabela.group(1))
+    existentes = {row[1] for row in conn.execute(f'PRAGMA table_info({alvo})')}
+
+    def coluna_real(coluna):
+        if eh_view and coluna.upper().endswith('_DIA'):
+            coluna = coluna[:-4]
+        return coluna if coluna in existentes else None
+
+    igualdade, intervalo = colunas_do_filtro(sql)
+    colunas = [c for c in map(coluna_real, igualdade) if c]
+    intervalo = [c for c in map(coluna_real, intervalo) if c]
+    if intervalo:
+        colunas.append(intervalo[0])
+    elif ordena:
+        colunas += [c for c in map(coluna_real, colunas_da_ordenacao(sql)) if c and c not in colunas]
+    if not colunas:
+        return None
+    nome = f"idx_{alvo}_{'_'.join(c.lower() for c in colunas)}"
+    return f"CREATE INDEX IF NOT EXISTS {nome} ON {alvo} ({', '.join(colunas)})"
+
+def relatorio(top=15, db_dir='database'):
+    """Imprime as consultas ordenadas pelo tempo total, com plano e sugestão de índice."""
+    gravar_registros()
+    if not os.path.exists(STATS_DB):
+        print(f"Nenhum registro em {STATS_DB}. Rode as páginas com REGISTRAR_CONSULTAS=1.")
+        return
+    stats = sqlite3.connect(STATS_DB)
+    try:
+        ranking = stats.execute('''
+            SELECT c.banco, c.sql, COUNT(*), SUM(c.duracao_ms), AVG(c.duracao_ms), MAX(c.duracao_ms),
+                   AVG(c.linhas), AVG(c.passos), GROUP_CONCAT(DISTINCT c.origem), e.sql_original, e.parametros
+            FROM consultas c
+            LEFT JOIN exemplos e ON e.banco = c.banco AND e.sql = c.sql
+            GROUP BY c.banco, c.sql
+            ORDER BY SUM(c.duracao_ms) DESC
+            LIMIT ?
+        ''', (top,)).fetchall()
+    finally:
+        stats.close()
+
+    for posicao, (banco, sql, chamadas, total, media, maximo, linhas, passos, origens, original, parametros) in enumerate(ranking, 1):
+        print(f"\n#{posicao} [{banco}] total {total:.1f} ms | {chamadas} chamadas | média {media:.1f} ms | máx {maximo:.1f} ms "
+              f"| {linhas:.0f} linhas | {passos:.0f} passos | origem: {origens}")
+        print(f"    {sql[:300]}")
+        caminho = os.path.join(db_dir, f'{banco}.db')
+        if not original or not os.path.exists(caminho) or not re.match(r'\s*(SELECT|WITH)\b', original, re.IGNORECASE):
+            continue
+        conn = sqlite3.connect(f"file:{caminho}?mode=ro", uri=True)
+        try:
+            params = json.loads(parametros) if parametros else ()
+            plano = [row[3] for row in conn.execute(f'EXPLAIN QUERY PLAN {original}', params).fetchall()]
+            for passo in plano:
+                print(f"    plano: {passo}")
+            sugestao = sugerir_indice(conn, original, plano)
+            if sugestao:
+                print(f"    sugestão: {sugestao}")
+        except (sqlite3.Error, ValueError) as e:
+            print(f"    plano indisponível: {e}")
+        finally:
+            conn.close()
+
+if __name__ == '__main__':
+    argumentos = sys.argv[1:]
+    top = int(argumentos[argumentos.index('--top') + 1]) if '--top' in argumentos else 15
+    bancos = argumentos[argumentos.index('--bancos') + 1] if '--bancos' in argumentos else 'database'
+    relatorio(top, bancos)
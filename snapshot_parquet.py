@@ -0,0 +1,226 @@
+# SNAPSHOT_PARQUET.PY - SNAPSHOTS PARQUET DAS TABELAS DO CACHE, PUBLICADOS PELO SINCRONIZADOR
+# Depois de cada sincronização com sucesso, o endpoint.py grava cada tabela em Parquet tipado e comprimido,
+# particionado por mês: database/parquet/<tabela>/mes=YYYY-MM/<versao>.parquet.
+# O manifest.json da tabela é trocado de forma atômica (os.replace) e é a única fonte da verdade:
+# leitores só abrem os arquivos listados nele, então nunca veem um mês pela metade.
+# Os snapshots são só exportação (BI, planilhas, DuckDB externo): as páginas leem do SQLite, e os únicos
+# Parquet lidos pelo sistema são os da camada fria (camada_fria.py), que reaproveita a gravação daqui.
+# Depende do pyarrow (pip install pyarrow); sem ele a publicação é desligada e as páginas seguem no SQLite.
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+from datetime import date, datetime
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+PARQUET_DISPONIVEL = pq is not None
+PARQUET_DIR = 'parquet'
+SNAPSHOT_COMPRESSION = 'zstd'
+# Partição das linhas sem data na coluna de particionamento
+MES_SEM_DATA = 'sem_data'
+
+logger = logging.getLogger(__name__)
+
+# Uma publicação por tabela de cada vez (o ciclo roda as tabelas em paralelo)
+_publicacao_locks = {}
+_publicacao_locks_guard = threading.Lock()
+
+# Afinidade declarada na VIEW -> tipo Arrow. Colunas calculadas (CAST, COALESCE) vêm sem tipo declarado
+# e são resolvidas pelo typeof() do primeiro valor não nulo (ver esquema_da_view).
+TIPOS_ARROW = {
+    'INTEGER': 'int64',
+    'REAL': 'float64',
+    'TEXT': 'string',
+}
+
+def _pasta_tabela(db_dir, tabela):
+    return os.path.join(db_dir, PARQUET_DIR, tabela)
+
+def _mes_do_dia(dia):
+    return MES_SEM_DATA if dia is None else date.fromordinal(int(dia) + 719163).strftime('%Y-%m')
+
+def _limites_do_mes(mes):
+    """Primeiro e último número do dia do mês 'YYYY-MM'."""
+    ano, numero = map(int, mes.split('-'))
+    inicio = date(ano, numero, 1)
+    fim = date(ano + numero // 12, numero % 12 + 1, 1)
+    return inicio.toordinal() - 719163, fim.toordinal() - 719163 - 1
+
+def carregar_manifesto(tabela, db_dir='database'):
+    """Manifesto publicado da tabela, ou None se ainda não houver snapshot."""
+    caminho = os.path.join(_pasta_tabela(db_dir, tabela), 'manifest.json')
+    try:
+        with open(caminho, encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        logger.warning(f"Manifesto Parquet de '{tabela}' ilegível: {e}")
+        return None
+
+def _gravar_manifesto(pasta, manifesto):
+    temporario = os.path.join(pasta, 'manifest.json.tmp')
+    with open(temporario, 'w', encoding='utf-8') as f:
+        json.dump(manifesto, f, ensure_ascii=False, indent=1)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temporario, os.path.join(pasta, 'manifest.json'))
+
+def esquema_da_view(cursor, tabela, colunas_data):
+    """[(coluna, tipo)] do snapshot: colunas de data viram date32 e as <data>_DIA ficam de fora."""
+    cursor.execute(f"PRAGMA table_info({tabela})")
+    esquema = []
+    for _, coluna, declarado, *_ in cursor.fetchall():
+        if coluna.endswith('_DIA'):
+            continue
+        if coluna in colunas_data:
+            tipo = 'date32'
+        elif declarado.upper() in TIPOS_ARROW:
+            tipo = TIPOS_ARROW[declarado.upper()]
+        else:
+            cursor.execute(f"SELECT typeof({coluna}) FROM {tabela} WHERE {coluna} IS NOT NULL LIMIT 1")
+            row = cursor.fetchone()
+            tipo = TIPOS_ARROW.get(row[0].upper(), 'string') if row else 'string'
+        esquema.append((coluna, tipo))
+    return esquema
+
+def _tabela_arrow(rows, esquema):
+    colunas = list(zip(*rows)) if rows else [[] for _ in esquema]
+    arrays = []
+    for (coluna, tipo), valores in zip(esquema, colunas):
+        if tipo == 'date32':
+            # A VIEW entrega 'YYYY-MM-DD'; o cast do Arrow converte direto para dias
+            arrays.append(pa.array(valores, pa.string()).cast(pa.date32()))
+        else:
+            arrays.append(pa.array(valores, getattr(pa, tipo)()))
+    return pa.Table.from_arrays(arrays, names=[coluna for coluna, _ in esquema])
+
+def assinaturas_mensais(cursor, fato, coluna_particao, intervalo=None):
+    """
+    {mes: assinatura} a partir do ROW_HASH das linhas da fato. Soma dos hashes (independe da ordem)
+    mais a contagem: muda sempre que alguma linha do mês entra, sai ou muda.
+    """
+    filtro, params = ('', ())
+    if intervalo:
+        filtro, params = (f"WHERE {coluna_particao} BETWEEN ? AND ?", intervalo)
+    cursor.execute(f"SELECT {coluna_particao}, ROW_HASH FROM {fato} {filtro}", params)
+    somas = {}
+    for dia, row_hash in cursor:
+        mes = _mes_do_dia(dia)
+        soma, linhas = somas.get(mes, (0, 0))
+        somas[mes] = ((soma + int(row_hash[:16] if row_hash else '0', 16)) % 2 ** 64, linhas + 1)
+    return {mes: f"{linhas}:{soma:016x}" for mes, (soma, linhas) in somas.items()}
+
+def _assinatura_dimensoes(cursor):
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'dim_controle'")
+    if not cursor.fetchone():
+        return ''
+    cursor.execute("SELECT DIMENSAO, HASH FROM dim_controle ORDER BY DIMENSAO")
+    return hashlib.md5(repr(cursor.fetchall()).encode()).hexdigest()
+
+def publicar_snapshot(tabela, fato, coluna_particao, colunas_data, db_dir='database', inicio=None, fim=None, congelado_ate=None):
+    """
+    Regrava em Parquet os meses da tabela que mudaram desde o último manifesto e publica um novo manifesto.
+    Com inicio/fim (date) só os meses da janela sincronizada são conferidos; sem eles, a tabela inteira.
+    Meses antes de congelado_ate (número do dia, camada_fria.py) já saíram do SQLite e ficam como publicados.
+    Retorna o número de meses regravados (0 quando nada mudou) ou None se o snapshot não foi publicado.
+    """
+    if not PARQUET_DISPONIVEL:
+        return None
+    with _publicacao_locks_guard:
+        lock = _publicacao_locks.setdefault(tabela, threading.Lock())
+
+    with lock:
+        pasta = _pasta_tabela(db_dir, tabela)
+        conn = None
+        try:
+            os.makedirs(pasta, exist_ok=True)
+            manifesto = carregar_manifesto(tabela, db_dir)
+            conn = sqlite3.connect(f"file:{os.path.join(db_dir, f'{tabela}.db')}?mode=ro", uri=True, timeout=10)
+            cursor = conn.cursor()
+            # Leitura consistente: assinaturas e linhas vêm do mesmo estado do arquivo
+            cursor.execute("BEGIN")
+
+            dimensoes = _assinatura_dimensoes(cursor)
+            esquema = esquema_da_view(cursor, tabela, colunas_data)
+            # Cadastros ou colunas mudaram: todas as partições são regravadas
+            reaproveitar = (
+                manifesto is not None and manifesto.get('dimensoes') == dimensoes
+                and [tuple(c) for c in manifesto['colunas']] == esquema
+            )
+            # A janela é ampliada para meses inteiros: a assinatura de cada mês cobre sempre o mês todo
+            intervalo = None
+            if reaproveitar and inicio is not None:
+                intervalo = (_limites_do_mes(inicio.strftime('%Y-%m'))[0], _limites_do_mes(fim.strftime('%Y-%m'))[1])
+            assinaturas = assinaturas_mensais(cursor, fato, coluna_particao, intervalo)
+
+            particoes = dict(manifesto['particoes']) if reaproveitar else {}
+            congelados = set()
+            if manifesto is not None and congelado_ate is not None:
+                congelados = {mes for mes in manifesto['particoes']
+                              if mes != MES_SEM_DATA and _limites_do_mes(mes)[1] < congelado_ate}
+                particoes.update({mes: manifesto['particoes'][mes] for mes in congelados})
+            # Meses conferidos que ficaram vazios saem do snapshot
+            if intervalo is None:
+                conferidos = set(particoes) - congelados
+            else:
+                conferidos = {_mes_do_dia(d) for d in range(intervalo[0], intervalo[1] + 1, 28)} | {_mes_do_dia(intervalo[1])}
+            for mes in [m for m in particoes if m in conferidos and m not in assinaturas]:
+                del particoes[mes]
+
+            alterados = sorted(mes for mes, assinatura in assinaturas.items()
+                               if mes not in congelados and particoes.get(mes, {}).get('assinatura') != assinatura)
+            if reaproveitar and not alterados and set(particoes) == set(manifesto['particoes']):
+                return 0
+
+            versao = (manifesto['versao'] if manifesto else 0) + 1
+            colunas_sql = ', '.join(coluna for coluna, _ in esquema)
+            dia_particao = f"{coluna_particao}_DIA"
+            for mes in alterados:
+                if mes == MES_SEM_DATA:
+                    cursor.execute(f"SELECT {colunas_sql} FROM {tabela} WHERE {dia_particao} IS NULL")
+                else:
+                    cursor.execute(f"SELECT {colunas_sql} FROM {tabela} WHERE {dia_particao} BETWEEN ? AND ?", _limites_do_mes(mes))
+                arquivo = f"mes={mes}/{versao:06d}.parquet"
+                os.makedirs(os.path.join(pasta, f"mes={mes}"), exist_ok=True)
+                tabela_arrow = _tabela_arrow(cursor.fetchall(), esquema)
+                pq.write_table(tabela_arrow, os.path.join(pasta, arquivo), compression=SNAPSHOT_COMPRESSION)
+                particoes[mes] = {'arquivo': arquivo, 'linhas': tabela_arrow.num_rows, 'assinatura': assinaturas[mes]}
+            conn.rollback()
+
+            # Arquivos trocados agora continuam no disco até a próxima publicação: um leitor que abriu
+            # o manifesto anterior ainda consegue ler o que ele listava.
+            atuais = {p['arquivo'] for p in particoes.values()}
+            anteriores = {p['arquivo'] for p in manifesto['particoes'].values()} if manifesto else set()
+            for arquivo in (manifesto or {}).get('remover', []):
+                if arquivo not in atuais:
+                    try:
+                        os.remove(os.path.join(pasta, arquivo))
+                    except OSError:
+                        pass
+
+            _gravar_manifesto(pasta, {
+                'tabela': tabela,
+                'versao': versao,
+                'gerado_em': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                'particionado_por': coluna_particao,
+                'colunas': esquema,
+                'dimensoes': dimensoes,
+                'particoes': dict(sorted(particoes.items())),
+                'remover': sorted(anteriores - atuais),
+            })
+            logger.info(f"Snapshot Parquet de '{tabela}' publicado (versão {versao}): {len(alterados)} mês(es) regravado(s).")
+            return len(alterados)
+        except (sqlite3.Error, OSError, pa.ArrowException) as e:
+            logger.error(f"Erro ao publicar snapshot Parquet de '{tabela}': {e}")
+            return None
+        finally:
+            if conn:
+                conn.close()